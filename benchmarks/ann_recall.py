@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import tempfile
+from time import perf_counter
+from argparse import ArgumentParser
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from vector_backends import MmapBackend
+
+def synthetic_corpus(chunks: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Generate clustered, unit-normalized embeddings resembling sentence embeddings.
+
+    Args:
+        chunks: Number of embeddings.
+        dim: Embedding dimension.
+        clusters: Number of topics the embeddings are drawn around.
+        seed: Random seed.
+
+    Returns:
+        float32 array of shape (chunks, dim).
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size = (clusters, dim)).astype(np.float32)
+    embeddings = centers[rng.integers(0, clusters, chunks)] + 0.6 * rng.normal(size = (chunks, dim)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis = 1, keepdims = True)
+
+def time_queries(backend: MmapBackend, queries: np.ndarray, k: int, ann_effort: int = None) -> tuple[list[list[str]], np.ndarray]:
+    """Run queries one at a time, as the retriever does.
+
+    Args:
+        backend: The backend to search.
+        queries: Query embeddings.
+        k: Number of results per query.
+        (optional) ann_effort: Clusters probed per query. Default is None.
+
+    Returns:
+        Tuple containing the result ids per query and the latency of each query in milliseconds.
+    """
+    ids, latencies = [], []
+    for query in queries:
+        start = perf_counter()
+        ids.append(backend.query([query], k, ann_effort = ann_effort)["ids"][0])
+        latencies.append((perf_counter() - start) * 1000)
+    return ids, np.array(latencies)
+
+def main() -> None:
+    parser = ArgumentParser(description = "Measure recall@k and latency of the IVF index against exact search on the same chunks.")
+    parser.add_argument("--index", help = "Directory of an existing mmap index to benchmark (e.g. path/to/persist_dir/mmap_index). Its ivf.npz is rebuilt. Defaults to a synthetic corpus.")
+    parser.add_argument("--chunks", type = int, default = 100000, help = "Size of the synthetic corpus. Defaults to 100000.")
+    parser.add_argument("--dim", type = int, default = 384, help = "Embedding dimension of the synthetic corpus. Defaults to 384.")
+    parser.add_argument("--dtype", choices = ["float32", "float16", "int8"], default = "float32", help = "Storage type of the synthetic index. Defaults to float32.")
+    parser.add_argument("--queries", type = int, default = 200, help = "Number of queries. Defaults to 200.")
+    parser.add_argument("--k", type = int, default = 10, help = "Number of results per query. Defaults to 10.")
+    parser.add_argument("--lists", type = int, help = "Number of IVF clusters. Defaults to 4 * sqrt(chunks).")
+    parser.add_argument("--efforts", default = "1,2,4,8,16,32", help = "Comma-separated clusters probed per query. Defaults to 1,2,4,8,16,32.")
+    parser.add_argument("--seed", type = int, default = 0, help = "Random seed. Defaults to 0.")
+    parser.add_argument("--output", help = "Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed + 1)
+    with tempfile.TemporaryDirectory() as scratch:
+        if args.index:
+            backend = MmapBackend(args.index)
+            # Perturbed copies of stored chunks stand in for queries about them
+            sample = rng.choice(np.flatnonzero(~backend.deleted), size = min(args.queries, backend.count()), replace = False)
+            queries = backend._dequantize_rows(np.sort(sample))
+        else:
+            print(f"Building a synthetic {args.dtype} index of {args.chunks} chunks...")
+            embeddings = synthetic_corpus(args.chunks + args.queries, args.dim, max(16, args.chunks // 500), args.seed)
+            queries = embeddings[args.chunks:]
+            backend = MmapBackend(os.path.join(scratch, "index"), args.dtype)
+            for start in range(0, args.chunks, backend.max_batch_size):
+                end = min(start + backend.max_batch_size, args.chunks)
+                backend.upsert([str(i) for i in range(start, end)], embeddings[start:end], [""] * (end - start), [{}] * (end - start))
+        queries = queries + 0.05 * rng.normal(size = queries.shape).astype(np.float32)
+
+        backend.ivf = None
+        exact_ids, exact_latency = time_queries(backend, queries, args.k)
+        start = perf_counter()
+        backend.build_ann(args.lists)
+        build_seconds = perf_counter() - start
+        lists = len(backend.ivf["centroids"])
+
+        report = {
+            "chunks": backend.count(),
+            "k": args.k,
+            "lists": lists,
+            "build_seconds": build_seconds,
+            "exact": {"p50_ms": float(np.percentile(exact_latency, 50)), "p95_ms": float(np.percentile(exact_latency, 95))},
+            "ann": []
+        }
+        print(f"{report['chunks']} chunks, {lists} clusters built in {build_seconds:.2f}s")
+        print(f"exact         p50 {report['exact']['p50_ms']:8.2f} ms  p95 {report['exact']['p95_ms']:8.2f} ms")
+        for effort in [int(value) for value in args.efforts.split(",")]:
+            if effort > lists:
+                continue
+            ids, latency = time_queries(backend, queries, args.k, effort)
+            recall = float(np.mean([len(set(found) & set(truth)) / len(truth) for found, truth in zip(ids, exact_ids)]))
+            row = {"ann_effort": effort, "recall_at_k": recall, "p50_ms": float(np.percentile(latency, 50)), "p95_ms": float(np.percentile(latency, 95))}
+            report["ann"].append(row)
+            print(f"effort {effort:5d}  p50 {row['p50_ms']:8.2f} ms  p95 {row['p95_ms']:8.2f} ms  recall@{args.k} {recall:.3f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as f:
+            json.dump(report, f, indent = 2)
+
+if __name__ == "__main__":
+    main()
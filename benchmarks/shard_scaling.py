@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import tempfile
+from time import perf_counter
+from argparse import ArgumentParser
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from vector_backends import ShardedBackend
+from ann_recall import synthetic_corpus
+
+def measure(shards: int, corpus: np.ndarray, queries: np.ndarray, k: int, batch: int, repeats: int) -> dict[str, float]:
+    """Build a sharded index with one core per shard and time searches against it.
+
+    Args:
+        shards: Number of shards.
+        corpus: Embeddings to index.
+        queries: Query embeddings.
+        k: Number of results per query.
+        batch: Number of queries per search in the throughput run.
+        repeats: Number of timed passes over the queries.
+
+    Returns:
+        Dictionary with the build time, single-query latency percentiles and batched throughput.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        backend = ShardedBackend(shards, path, threads_per_shard = 1)
+        try:
+            start = perf_counter()
+            for offset in range(0, len(corpus), backend.max_batch_size):
+                block = corpus[offset:offset + backend.max_batch_size]
+                backend.upsert([f"chunk-{offset + i}" for i in range(len(block))], block, ["" for _ in block], [{} for _ in block])
+            backend.flush()
+            build_seconds = perf_counter() - start
+
+            backend.query(queries[:batch], k)
+            latencies = []
+            for _ in range(repeats):
+                for query in queries:
+                    start = perf_counter()
+                    backend.query(query[None, :], k)
+                    latencies.append((perf_counter() - start) * 1000)
+
+            start = perf_counter()
+            for _ in range(repeats):
+                for offset in range(0, len(queries), batch):
+                    backend.query(queries[offset:offset + batch], k)
+            throughput = repeats * len(queries) / (perf_counter() - start)
+        finally:
+            backend.close()
+    return {
+        "build_seconds": build_seconds,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "queries_per_second": throughput
+    }
+
+def main() -> None:
+    parser = ArgumentParser(description = "Measure how sharded vector search scales with the number of shards, each a worker process with one core.")
+    parser.add_argument("--chunks", type = int, default = 500000, help = "Size of the synthetic corpus. Defaults to 500000.")
+    parser.add_argument("--dim", type = int, default = 384, help = "Embedding dimension. Defaults to 384.")
+    parser.add_argument("--shards", help = "Comma-separated shard counts. Defaults to powers of two up to the number of CPUs.")
+    parser.add_argument("--queries", type = int, default = 200, help = "Number of queries. Defaults to 200.")
+    parser.add_argument("--k", type = int, default = 10, help = "Number of results per query. Defaults to 10.")
+    parser.add_argument("--batch", type = int, default = 32, help = "Queries per search in the throughput run. Defaults to 32.")
+    parser.add_argument("--repeats", type = int, default = 3, help = "Number of timed passes over the queries. Defaults to 3.")
+    parser.add_argument("--seed", type = int, default = 0, help = "Random seed. Defaults to 0.")
+    parser.add_argument("--output", help = "Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    shard_counts = [int(count) for count in args.shards.split(",")] if args.shards else [2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus]
+    corpus = synthetic_corpus(args.chunks, args.dim, 64, args.seed)
+    queries = synthetic_corpus(args.queries, args.dim, 64, args.seed + 1)
+
+    report = {"chunks": args.chunks, "dim": args.dim, "cpus": cpus, "results": {}}
+    print(f"{args.chunks} chunks, {args.dim} dimensions, {cpus} CPU(s)")
+    print(f"{'shards':>6} {'build s':>8} {'p50 ms':>8} {'p95 ms':>8} {'q/s':>9} {'speedup':>8}")
+    baseline = None
+    for shards in shard_counts:
+        result = measure(shards, corpus, queries, args.k, args.batch, args.repeats)
+        baseline = baseline or result["queries_per_second"]
+        result["speedup"] = result["queries_per_second"] / baseline
+        report["results"][shards] = result
+        print(f"{shards:>6} {result['build_seconds']:>8.2f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['queries_per_second']:>9.1f} {result['speedup']:>7.2f}x")
+    if cpus < max(shard_counts):
+        print(f"Note: more shards than the {cpus} CPU(s) available; those runs cannot scale further.")
+
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as f:
+            json.dump(report, f, indent = 2)
+
+if __name__ == "__main__":
+    main()
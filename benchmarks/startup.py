@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import shlex
+import tempfile
+import subprocess
+from time import perf_counter
+from argparse import ArgumentParser
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+READY = "RAG Agent System ready."
+
+def time_to_prompt(arguments: list[str], timeout: float) -> float:
+    """Start the CLI and measure the time until it is ready for the first query.
+
+    Args:
+        arguments: Command line arguments for main.py.
+        timeout: Seconds to wait before giving up.
+
+    Returns:
+        Seconds from launching the process to the ready message.
+
+    Raises:
+        RuntimeError: If the CLI exits or times out before it is ready.
+    """
+    start = perf_counter()
+    process = subprocess.Popen([sys.executable, "main.py", *arguments], cwd = SRC, stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, text = True, encoding = "utf-8")
+    output = []
+    try:
+        for line in process.stdout:
+            output.append(line)
+            if READY in line:
+                elapsed = perf_counter() - start
+                process.communicate("exit\n", timeout = timeout)
+                return elapsed
+            if perf_counter() - start > timeout:
+                break
+        raise RuntimeError(f"main.py {' '.join(arguments)} was not ready after {perf_counter() - start:.1f}s. Last output:\n{''.join(output[-10:])}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+
+def main() -> None:
+    parser = ArgumentParser(description = "Measure the time from launching the CLI to its first prompt, with a cold (empty) and a warm (prebuilt) index, with and without --fast_start.")
+    parser.add_argument("--args", default = "--stub_llm", help = "Extra arguments for main.py, e.g. \"--vector_backend mmap\". Defaults to \"--stub_llm\".")
+    parser.add_argument("--runs", type = int, default = 3, help = "Number of warm starts per mode; the median is reported. Defaults to 3.")
+    parser.add_argument("--timeout", type = float, default = 600, help = "Seconds to wait for each start. Defaults to 600.")
+    parser.add_argument("--output", help = "Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    extra = shlex.split(args.args)
+    report = {"args": extra, "results": {}}
+    for mode, flags in [("default", []), ("fast_start", ["--fast_start"])]:
+        with tempfile.TemporaryDirectory() as index_dir:
+            arguments = [*extra, *flags, "--persist_dir", index_dir]
+            cold = time_to_prompt(arguments, args.timeout)
+            warm = [time_to_prompt(arguments, args.timeout) for _ in range(args.runs)]
+        report["results"][mode] = {"cold_seconds": cold, "warm_seconds": float(np.median(warm)), "warm_runs": warm}
+        print(f"{mode:12s} cold {cold:6.2f}s  warm {np.median(warm):6.2f}s (median of {args.runs})")
+
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as f:
+            json.dump(report, f, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import os
+import re
+import sys
+import json
+import random
+import shutil
+import platform
+import subprocess
+import tempfile
+from time import perf_counter
+from datetime import datetime, timezone
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+DEFAULT_QUERIES = [
+    "What is the memory configuration of the RTX 5090?",
+    "How much power does the RX 9070 XT draw?",
+    "Which architecture do the RTX 50 series cards use?",
+    "How do I claim my restaurant listing on Zomato?",
+    "Can I reply to customer reviews?",
+    "How do I recover my Google account?",
+    "How do I transfer data to my new OPPO phone?",
+    "Who wrote Pride and Prejudice?",
+    "Which movies have a rating above 8?",
+    "What is DLSS 4?"
+]
+
+def build_corpus(source_dir: str, target_dir: str, scale: int, seed: int) -> None:
+    """Copy the bundled corpus scale times into a directory.
+
+    Paragraphs of text files are shuffled in every copy after the first, so the copies chunk and embed differently instead of repeating the same chunks. Other files are copied as is.
+
+    Args:
+        source_dir: Directory of the bundled corpus.
+        target_dir: Directory the synthetic corpus is written to.
+        scale: Number of copies of each file.
+        seed: Random seed for the paragraph order.
+
+    Returns:
+        None.
+    """
+    rng = random.Random(seed)
+    os.makedirs(target_dir, exist_ok = True)
+    for filename in sorted(os.listdir(source_dir)):
+        path = os.path.join(source_dir, filename)
+        if not os.path.isfile(path):
+            continue
+        stem, extension = os.path.splitext(filename)
+        for copy in range(scale):
+            target = os.path.join(target_dir, filename if copy == 0 else f"{stem}_{copy}{extension}")
+            if copy == 0 or extension != ".txt":
+                shutil.copyfile(path, target)
+                continue
+            with open(path, 'r', encoding = 'utf-8') as f:
+                paragraphs = re.split(r"\n\s*\n", f.read())
+            rng.shuffle(paragraphs)
+            with open(target, 'w', encoding = 'utf-8') as f:
+                f.write("\n\n".join(paragraphs))
+
+def percentiles(latencies: list[float]) -> dict[str, float]:
+    """Summarize latencies in milliseconds.
+
+    Args:
+        latencies: Latencies in seconds.
+
+    Returns:
+        Dictionary with the count, mean, p50, p95, p99 and max in milliseconds.
+    """
+    values = np.array(latencies) * 1000
+    if len(values) == 0:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max())
+    }
+
+def peak_memory_mb() -> dict[str, float]:
+    """Read the memory high-water mark of this process and of its finished child processes.
+
+    Returns:
+        Dictionary with the peak resident set sizes in megabytes, or None values where the platform does not report them.
+    """
+    try:
+        import resource
+    except ImportError:
+        return {"process": None, "children": None}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "process": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit
+    }
+
+def run_scale(args: Namespace, scale: int, queries: list[str]) -> dict:
+    """Benchmark ingestion, retrieval and end-to-end queries on one corpus size.
+
+    Runs in its own process, so the memory high-water mark belongs to this corpus size alone.
+
+    Args:
+        args: Command line arguments.
+        scale: Number of copies of the bundled corpus.
+        queries: Benchmark queries.
+
+    Returns:
+        Dictionary with the results.
+    """
+    from document_loader import DocumentLoader
+    from embeddings import VectorStore
+    from vector_backends import MmapBackend
+    from ingestion import IngestionPipeline
+    from lexical_index import LexicalIndex
+    from retrieval import Retriever
+    from reranker import Reranker
+    from context_builder import ContextBuilder
+    from stub_llm import StubLLMService
+    from agent import Agent
+
+    with tempfile.TemporaryDirectory() as scratch:
+        data_dir = os.path.join(ROOT, "data")
+        if scale > 1:
+            data_dir = os.path.join(scratch, "data")
+            build_corpus(os.path.join(ROOT, "data"), data_dir, scale, args.seed)
+
+        vector_store = VectorStore(
+            batch_size = args.batch_size,
+            lexical_index = LexicalIndex() if args.hybrid else None,
+            backend = MmapBackend(os.path.join(scratch, "index"), args.embedding_dtype) if args.vector_backend == "mmap" else "chroma"
+        )
+        pipeline = IngestionPipeline(DocumentLoader(data_dir), vector_store, workers = args.ingest_workers, chunk_size = args.chunk_size, chunk_overlap = args.chunk_overlap, dedup_threshold = args.dedup_threshold)
+        print(f"\n[scale {scale}x] Ingesting {len(os.listdir(data_dir))} file(s)...")
+        start = perf_counter()
+        ingestion = pipeline.run()
+        ingestion["total_seconds"] = perf_counter() - start
+        memory_after_ingestion = peak_memory_mb()
+
+        reranker = Reranker(latency_budget_ms = args.rerank_budget_ms) if args.rerank_candidates else None
+        retriever = Retriever(vector_store, hybrid = args.hybrid, candidate_k = args.rerank_candidates or 20, reranker = reranker)
+
+        # The first pass embeds every query; later passes hit the query embedding cache
+        cold, warm = [], []
+        for repeat in range(args.repeats + 1):
+            for query in queries:
+                start = perf_counter()
+                retriever.retrieve(query, top_k = args.top_k)
+                (cold if repeat == 0 else warm).append(perf_counter() - start)
+
+        # No response cache or router, so every query pays for retrieval, context packing and the LLM call
+        agent = Agent(retriever, StubLLMService(latency = args.llm_latency), context_builder = ContextBuilder(token_budget = args.context_tokens) if args.context_tokens else None)
+        end_to_end = []
+        for _ in range(args.repeats):
+            for query in queries:
+                start = perf_counter()
+                agent.process_query(query)
+                end_to_end.append(perf_counter() - start)
+
+        result = {
+            "scale": scale,
+            "files": len(os.listdir(data_dir)),
+            "chunks": vector_store.count(),
+            "ingestion": ingestion,
+            "retrieval": {"cold": percentiles(cold), "warm": percentiles(warm)},
+            "end_to_end": percentiles(end_to_end),
+            "peak_rss_mb": {"after_ingestion": memory_after_ingestion, "final": peak_memory_mb()}
+        }
+    print(f"[scale {scale}x] {result['chunks']} chunks ({ingestion.get('dedup', {}).get('duplicates', 0)} near-duplicates dropped), ingestion {ingestion['total_seconds']:.2f}s, "
+          f"retrieval p50 {result['retrieval']['warm'].get('p50_ms', 0):.2f} ms, end-to-end p50 {result['end_to_end'].get('p50_ms', 0):.2f} ms, "
+          f"peak RSS {result['peak_rss_mb']['final']['process'] or 0:.0f} MB")
+    return result
+
+def environment() -> dict:
+    """Describe the machine and code the benchmark ran on, so results from different runs can be told apart.
+
+    Returns:
+        Dictionary with the timestamp, git commit, Python version, platform and CPU count.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = ROOT, capture_output = True, text = True, timeout = 10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec = "seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count()
+    }
+
+def compare(report: dict, baseline_path: str) -> None:
+    """Print the change of the headline metrics relative to an earlier run.
+
+    Args:
+        report: Results of this run.
+        baseline_path: JSON file written by an earlier run.
+
+    Returns:
+        None.
+    """
+    with open(baseline_path, 'r', encoding = 'utf-8') as f:
+        baseline = {result["scale"]: result for result in json.load(f)["results"]}
+    metrics = [
+        ("ingestion s", lambda r: r["ingestion"]["total_seconds"]),
+        ("retrieval p50 ms", lambda r: r["retrieval"]["warm"].get("p50_ms")),
+        ("retrieval p95 ms", lambda r: r["retrieval"]["warm"].get("p95_ms")),
+        ("end-to-end p50 ms", lambda r: r["end_to_end"].get("p50_ms")),
+        ("end-to-end p95 ms", lambda r: r["end_to_end"].get("p95_ms")),
+        ("peak RSS MB", lambda r: r["peak_rss_mb"]["final"]["process"])
+    ]
+    print(f"\nCompared with {baseline_path}:")
+    for result in report["results"]:
+        if result["scale"] not in baseline:
+            continue
+        for name, metric in metrics:
+            old, new = metric(baseline[result["scale"]]), metric(result)
+            if old and new is not None:
+                print(f"  {result['scale']:4d}x {name:18s} {old:10.2f} -> {new:10.2f} ({(new - old) / old:+.1%})")
+
+def main() -> None:
+    parser = ArgumentParser(description = "Benchmark ingestion throughput, retrieval latency, memory and end-to-end query latency offline, on the bundled corpus and copies of it scaled up.")
+    parser.add_argument("--scales", default = "1,10,100", help = "Comma-separated corpus sizes as multiples of the bundled corpus. Defaults to 1,10,100.")
+    parser.add_argument("--queries", help = "JSONL file of benchmark queries, in the --batch_input format. Defaults to a built-in set about the bundled corpus.")
+    parser.add_argument("--repeats", type = int, default = 5, help = "Number of timed passes over the queries. Defaults to 5.")
+    parser.add_argument("--top_k", type = int, default = 3, help = "Number of chunks retrieved per query. Defaults to 3.")
+    parser.add_argument("--chunk_size", type = int, default = 1000, help = "Maximum chunk size in characters. Defaults to 1000.")
+    parser.add_argument("--chunk_overlap", type = int, default = 200, help = "Overlap between chunks in characters. Defaults to 200.")
+    parser.add_argument("--batch_size", type = int, default = 256, help = "Number of chunks embedded per batch. Defaults to 256.")
+    parser.add_argument("--ingest_workers", type = int, help = "Number of processes used to load documents. Defaults to the number of CPUs.")
+    parser.add_argument("--dedup_threshold", type = float, default = 0.0, help = "Similarity at which chunks count as near-duplicates and are only indexed once. The scaled copies of the corpus are near-duplicates of each other, so this shrinks the index back towards the 1x size. Defaults to 0, which keeps every chunk, as main.py does.")
+    parser.add_argument("--vector_backend", choices = ["chroma", "mmap"], default = "chroma", help = "Vector index backend. Defaults to chroma.")
+    parser.add_argument("--embedding_dtype", choices = ["float32", "float16", "int8"], help = "Storage type of the embeddings in the mmap backend. Defaults to float32.")
+    parser.add_argument("--hybrid", action = "store_true", help = "Fuse dense retrieval with the BM25 keyword index.")
+    parser.add_argument("--rerank_candidates", type = int, default = 0, help = "Number of candidates the re-ranker picks from. Defaults to 0, which disables re-ranking.")
+    parser.add_argument("--rerank_budget_ms", type = float, default = 50.0, help = "Re-ranking latency budget in milliseconds. Defaults to 50.")
+    parser.add_argument("--context_tokens", type = int, default = 0, help = "Token budget of the packed context. Defaults to 0, which disables packing.")
+    parser.add_argument("--llm_latency", type = float, default = 0.0, help = "Seconds the stub LLM takes per answer. Defaults to 0, which measures the pipeline alone.")
+    parser.add_argument("--seed", type = int, default = 0, help = "Random seed of the synthetic corpus. Defaults to 0.")
+    parser.add_argument("--output", help = "Write the results as JSON to this file.")
+    parser.add_argument("--compare", help = "JSON file of an earlier run to compare the results with.")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        from batch import BatchRunner
+        queries = [question["query"] for question in BatchRunner.read_questions(args.queries)]
+
+    report = {"environment": environment(), "config": vars(args), "queries": len(queries), "results": []}
+    for scale in [int(value) for value in args.scales.split(",")]:
+        with ProcessPoolExecutor(max_workers = 1, mp_context = multiprocessing.get_context("spawn")) as executor:
+            report["results"].append(executor.submit(run_scale, args, scale, queries).result())
+
+    if args.compare:
+        compare(report, args.compare)
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as f:
+            json.dump(report, f, indent = 2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
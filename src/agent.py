@@ -1,46 +1,184 @@
-from typing import Any
+from typing import Any, AsyncIterator, Iterator, TYPE_CHECKING
+import asyncio
 from retrieval import Retriever
-from llm import LLMService
+from response_cache import ResponseCache
+from context_builder import ContextBuilder
+from router import QueryRouter
+from structured_store import StructuredStore
+from tracing import Tracer, Trace
+import tracing
+
+if TYPE_CHECKING:
+    from llm import LLMService
+
+# Tools whose result is an LLM message rather than a plain string
+LLM_TOOLS = ["rag", "none", "smalltalk", "structured"]
 
 class Agent:
-    def __init__(self, retriever: Retriever, llm_service: LLMService):
+    def __init__(self, retriever: Retriever, llm_service: "LLMService", cache: ResponseCache = None, context_builder: ContextBuilder = None, router: QueryRouter = None, tracer: Tracer = None):
         """Initialize the agent with necessary components.
         
         Args:
             retriever: Retriever instance for retrieving relevant chunks.
             llm_service: LLMService instance for generating responses.
+            (optional) cache: ResponseCache instance for answering repeated queries. Default is None.
+            (optional) context_builder: ContextBuilder instance that packs the relevant chunks into a token budget before they are sent to the LLM. Default is None, which sends every relevant chunk.
+            (optional) router: QueryRouter instance that sends arithmetic, FAQ questions and small talk down cheaper routes. Default is None, which sends every query through retrieval.
+            (optional) tracer: Tracer instance that exports the per-stage timings of each query. Default is None, which only attaches them to the response as 'trace'.
         """
         self.retriever = retriever
         self.llm_service = llm_service
+        self.cache = cache
+        self.context_builder = context_builder
+        self.router = router
+        self.tracer = tracer or Tracer()
     
-    def process_query(self, query: str) -> dict[str, Any]:
-        """Process a user query and return a response.
+    def _route(self, query: str, response: dict[str, Any]) -> dict[str, Any]:
+        """Classify the query and answer it directly if its route needs no LLM call.
         
         Args:
             query: User query string.
+            response: The response being built. The chosen route is logged to it.
             
         Returns:
-            Dictionary with response and process information.
+            The completed response for the calculator and FAQ routes, otherwise None.
         """
+        if self.router is None:
+            return None
         
-        response = {
-            "query": query,
-            "tool_used": None,
-            "log": [],
-            "reason": None
-        }
+        with tracing.span("route") as attributes:
+            route, answer = self.router.route(query)
+            attributes["route"] = route
+        estimate = self.router.ROUTES[route]
+        response["log"].append(
+            f"Router: {route} (estimated {estimate['latency_ms']} ms, {estimate['llm_calls']} LLM call(s), "
+            f"{'with' if estimate['retrieval'] else 'no'} retrieval)"
+        )
+        
+        if route == "calculator":
+            response["tool_used"] = "calculator"
+            response["result"] = answer
+            response["retrieved_chunks"] = []
+            response["log"].append("Agent detected tool: calculator")
+            return response
+        if route == "faq":
+            response["tool_used"] = "faq"
+            response["result"] = answer["answer"]
+            response["retrieved_chunks"] = []
+            response["log"].append(f"Agent detected tool: faq (matched \"{answer['question']}\" in {answer['filename']})")
+            return response
+        if route == "structured":
+            response["tool_used"] = "structured"
+            response["log"].append(f"Agent detected tool: structured ({answer['sql']} with {answer['params']} -> {len(answer['rows'])} row(s))")
+            if not answer["rows"]:
+                response["result"] = f"No rows in {answer['filename']} match: {answer['description']}."
+                response["retrieved_chunks"] = []
+                return response
+            response["retrieved_chunks"] = [{
+                "content": StructuredStore.format_rows(answer),
+                "source": answer["source"],
+                "filename": answer["filename"],
+                "chunk_id": None,
+                "relevance_score": 1.0
+            }]
+            return None
+        if route == "smalltalk":
+            response["tool_used"] = "smalltalk"
+            response["retrieved_chunks"] = []
+            response["log"].append("Agent detected tool: smalltalk")
+        return None
+    
+    def _check_cache(self, query: str, response: dict[str, Any]) -> dict[str, Any]:
+        """Look the query up in the response cache.
+        
+        Args:
+            query: User query string.
+            response: The response being built. A cache miss is logged to it.
+            
+        Returns:
+            The cached response, or None on a miss or if no cache is configured.
+        """
+        if self.cache is None:
+            return None
+        
+        with tracing.span("cache_lookup") as attributes:
+            cached, tier, similarity = self.cache.get(query)
+            attributes["hit"] = tier
+        if cached is not None:
+            cached["query"] = query
+            cached["log"] = [
+                f"Response cache: {tier} hit (similarity {similarity:.2f})",
+                f"Response cache stats: {self.cache.summary()}"
+            ]
+            return cached
+        response["log"].append(f"Response cache: miss ({self.cache.summary()})")
+        return None
+    
+    def _retrieve_context(self, query: str, response: dict[str, Any], chunks: list[dict[str, Any]] = None) -> list[dict[str, Any]]:
+        """Retrieve relevant chunks for the query and record the tool decision.
         
-        response["log"].append("Retrieving relevant chunks...")
-        chunks = self.retriever.retrieve(query)
+        Args:
+            query: User query string.
+            response: The response being built.
+            (optional) chunks: Chunks already retrieved for the query. Default is None, which retrieves them.
+            
+        Returns:
+            The relevant chunks to pass to the LLM, or None if there are none.
+        """
+        if response["tool_used"] == "smalltalk":
+            return None
+        if response["tool_used"] == "structured":
+            return response["retrieved_chunks"]
+        if chunks is None:
+            response["log"].append("Retrieving relevant chunks...")
+            with tracing.span("retrieval"):
+                chunks = self.retriever.retrieve(query)
+        return self._record_context(response, chunks)
+    
+    async def _aretrieve_context(self, query: str, response: dict[str, Any], chunks: list[dict[str, Any]] = None) -> list[dict[str, Any]]:
+        """Asynchronously retrieve relevant chunks for the query and record the tool decision.
+        
+        Args:
+            query: User query string.
+            response: The response being built.
+            (optional) chunks: Chunks already retrieved for the query. Default is None, which retrieves them.
+            
+        Returns:
+            The relevant chunks to pass to the LLM, or None if there are none.
+        """
+        if response["tool_used"] == "smalltalk":
+            return None
+        if response["tool_used"] == "structured":
+            return response["retrieved_chunks"]
+        if chunks is None:
+            response["log"].append("Retrieving relevant chunks...")
+            with tracing.span("retrieval"):
+                chunks = await self.retriever.aretrieve(query)
+        return self._record_context(response, chunks)
+    
+    def _record_context(self, response: dict[str, Any], chunks: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Keep the chunks that pass the relevance threshold and record the tool decision.
         
-        response["retrieved_chunks"] = [
-            {
-                "content": chunk["content"],
-                "source": chunk["metadata"]["source"],
-                "relevance_score": chunk["relevance_score"]
-            }
-            for chunk in chunks if chunk["relevance_score"] > 0.4
-        ]
+        Args:
+            response: The response being built.
+            chunks: Chunks returned by the retriever.
+            
+        Returns:
+            The relevant chunks to pass to the LLM, or None if there are none.
+        """
+        with tracing.span("threshold_filter", candidates = len(chunks)) as attributes:
+            response["retrieved_chunks"] = [
+                {
+                    "content": chunk["content"],
+                    "source": chunk["metadata"]["source"],
+                    "filename": chunk["metadata"].get("filename"),
+                    "chunk_id": chunk["metadata"].get("chunk_id"),
+                    "relevance_score": chunk["relevance_score"],
+                    **({"sources": chunk["metadata"]["sources"]} if chunk["metadata"].get("sources") else {})
+                }
+                for chunk in chunks if chunk["relevance_score"] > 0.4
+            ]
+            attributes["kept"] = len(response["retrieved_chunks"])
         
         if response["retrieved_chunks"] == []:
             response["log"].append("No relevant chunks found.")
@@ -51,9 +189,30 @@ class Agent:
             response["log"].append("Agent detected tool: rag")
             response["tool_used"] = "rag"
         
-        response["log"].append("Generating response with LLM...")
-        llm_response, response["reason"] = self.llm_service.generate_response(query, (None if response["retrieved_chunks"] == [] else response["retrieved_chunks"]))
+        if response["retrieved_chunks"] == []:
+            return None
+        if self.context_builder is None:
+            return response["retrieved_chunks"]
+        
+        with tracing.span("context_packing"):
+            context_chunks, stats = self.context_builder.build(response["retrieved_chunks"])
+        response["log"].append(
+            f"Packed context into {stats['tokens_after']} of {self.context_builder.token_budget} tokens "
+            f"({len(context_chunks)} passage(s), {stats['chunks_dropped']} chunk(s) dropped, {stats['tokens_saved']} prompt tokens saved)"
+        )
+        return context_chunks
+    
+    def _finish(self, query: str, response: dict[str, Any], llm_response: Any) -> dict[str, Any]:
+        """Record the LLM output in the response and cache successful responses.
         
+        Args:
+            query: User query string.
+            response: The response being built.
+            llm_response: The LLM output, or an error string.
+            
+        Returns:
+            The completed response.
+        """
         if(llm_response == "Invalid model."):
             response["result"] = "Invalid model."
             response["log"].append("Invalid model.")
@@ -63,5 +222,296 @@ class Agent:
         else:
             response["result"] = llm_response
             response["log"].append("LLM response generated")
+            self._log_cascade(response, llm_response)
+            self._annotate_usage(llm_response)
+            if self.cache is not None:
+                with tracing.span("cache_store"):
+                    self.cache.put(query, response, [chunk["filename"] for chunk in response["retrieved_chunks"]])
+        
+        return response
+    
+    @staticmethod
+    def _log_cascade(response: dict[str, Any], llm_response: Any) -> None:
+        """Log which model of a ModelCascade answered and why.
+
+        Args:
+            response: The response being built.
+            llm_response: The LLM output.
+
+        Returns:
+            None.
+        """
+        decision = (getattr(llm_response, "response_metadata", None) or {}).get("cascade")
+        if not decision:
+            return
+        timings = [f"{name} model {decision[f'{name}_ms']:.0f} ms" for name in ("small", "large") if decision[f"{name}_ms"] is not None]
+        if decision["estimated_saved_ms"] is not None:
+            timings.append(f"estimated {decision['estimated_saved_ms']:.0f} ms saved")
+        escalation = f", escalated: {decision['reason']}" if decision["escalated"] else ""
+        response["log"].append(f"Model cascade: answered by {decision['model']}{escalation} ({', '.join(timings)})")
+
+    @staticmethod
+    def _annotate_usage(llm_response: Any) -> None:
+        """Attach the token counts and server-side timings reported by the LLM to the active trace.
+        
+        Args:
+            llm_response: The LLM output.
+            
+        Returns:
+            None.
+        """
+        usage = getattr(llm_response, "usage_metadata", None)
+        if usage:
+            tracing.annotate(usage = {key: usage[key] for key in ("input_tokens", "output_tokens", "total_tokens") if key in usage})
+        # Ollama reports its own timings in nanoseconds
+        metadata = getattr(llm_response, "response_metadata", None) or {}
+        durations = {key.replace("_duration", "_ms"): value / 1e6 for key, value in metadata.items() if key.endswith("_duration") and isinstance(value, (int, float))}
+        if durations:
+            tracing.annotate(ollama = durations)
+    
+    @staticmethod
+    def _traced_stream(trace: Trace, stream: Iterator[dict[str, Any]]) -> Iterator[dict[str, Any]]:
+        """Pass through the events of an LLM stream, activating the trace only while the stream computes its next event.
+        
+        Keeps the trace from leaking into the consumer between events.
+        
+        Args:
+            trace: The trace of the query.
+            stream: The LLM stream.
+            
+        Returns:
+            Iterator over the stream's events.
+        """
+        while True:
+            with trace.activate():
+                event = next(stream, None)
+            if event is None:
+                return
+            yield event
+    
+    @staticmethod
+    async def _atraced_stream(trace: Trace, stream: AsyncIterator[dict[str, Any]]) -> AsyncIterator[dict[str, Any]]:
+        """Asynchronous version of _traced_stream().
+        
+        Args:
+            trace: The trace of the query.
+            stream: The LLM stream.
+            
+        Returns:
+            Async iterator over the stream's events.
+        """
+        while True:
+            with trace.activate():
+                event = await anext(stream, None)
+            if event is None:
+                return
+            yield event
+    
+    def _log_stream_timing(self, response: dict[str, Any], event: dict[str, Any]) -> None:
+        """Log the time to first token and generation speed of a streamed response.
+        
+        Args:
+            response: The response being built.
+            event: The end event of the LLM stream.
+            
+        Returns:
+            None.
+        """
+        if event["time_to_first_token"] is not None:
+            response["log"].append(f"Time to first token: {event['time_to_first_token']:.2f}s")
+        if event["tokens_per_second"] is not None:
+            response["log"].append(f"Generation speed: {event['tokens_per_second']:.1f} tokens/s")
+    
+    def process_query(self, query: str, chunks: list[dict[str, Any]] = None) -> dict[str, Any]:
+        """Process a user query and return a response.
+        
+        Args:
+            query: User query string.
+            (optional) chunks: Chunks already retrieved for the query, e.g. by a batched search. Default is None, which retrieves them.
+            
+        Returns:
+            Dictionary with response and process information.
+        """
+        
+        response = {
+            "query": query,
+            "tool_used": None,
+            "log": [],
+            "reason": None
+        }
+        
+        trace = self.tracer.start(query)
+        with trace.activate():
+            routed = self._route(query, response)
+            if routed is not None:
+                return self.tracer.finish(trace, routed)
+            
+            cached = self._check_cache(query, response)
+            if cached is not None:
+                return self.tracer.finish(trace, cached)
+            
+            context_chunks = self._retrieve_context(query, response, chunks)
+            
+            response["log"].append("Generating response with LLM...")
+            with tracing.span("llm"):
+                llm_response, response["reason"] = self.llm_service.generate_response(query, context_chunks)
+            
+            return self.tracer.finish(trace, self._finish(query, response, llm_response))
+    
+    def process_query_stream(self, query: str, chunks: list[dict[str, Any]] = None) -> Iterator[dict[str, Any]]:
+        """Process a user query, streaming the LLM output as it is generated.
+        
+        Args:
+            query: User query string.
+            (optional) chunks: Chunks already retrieved for the query, e.g. by a batched search. Default is None, which retrieves them.
             
-        return response
\ No newline at end of file
+        Returns:
+            Iterator over events. {"type": "retrieval", "response": ...} is emitted once retrieval is done (or skipped) and carries the partial response. {"type": "token", "content": str} is emitted for each piece of the answer. The last event is {"type": "response", "response": ...} with the same dictionary process_query() returns. Cached responses and queries answered without the LLM skip straight to the last event.
+        """
+        
+        response = {
+            "query": query,
+            "tool_used": None,
+            "log": [],
+            "reason": None
+        }
+        
+        # The trace is only activated around work done here, never across a yield
+        trace = self.tracer.start(query)
+        with trace.activate():
+            routed = self._route(query, response)
+        if routed is not None:
+            yield {"type": "response", "response": self.tracer.finish(trace, routed)}
+            return
+        
+        with trace.activate():
+            cached = self._check_cache(query, response)
+        if cached is not None:
+            yield {"type": "response", "response": self.tracer.finish(trace, cached)}
+            return
+        
+        with trace.activate():
+            context_chunks = self._retrieve_context(query, response, chunks)
+        yield {"type": "retrieval", "response": response}
+        
+        response["log"].append("Streaming response from LLM...")
+        llm_response = None
+        with trace.span("llm"):
+            for event in self._traced_stream(trace, self.llm_service.generate_response_stream(query, context_chunks)):
+                if event["type"] == "token":
+                    yield event
+                else:
+                    llm_response, response["reason"] = event["result"], event["reason"]
+                    self._log_stream_timing(response, event)
+        
+        with trace.activate():
+            response = self._finish(query, response, llm_response)
+        yield {"type": "response", "response": self.tracer.finish(trace, response)}
+    
+    async def aprocess_query(self, query: str, chunks: list[dict[str, Any]] = None) -> dict[str, Any]:
+        """Asynchronously process a user query and return a response.
+        
+        Many queries can be processed concurrently on one event loop. They share the loaded index, and calls to the LLM backend are bounded by the LLM service's concurrency limiter.
+        
+        Args:
+            query: User query string.
+            (optional) chunks: Chunks already retrieved for the query, e.g. by a batched search. Default is None, which retrieves them.
+            
+        Returns:
+            Same as process_query().
+        """
+        
+        response = {
+            "query": query,
+            "tool_used": None,
+            "log": [],
+            "reason": None
+        }
+        
+        trace = self.tracer.start(query)
+        with trace.activate():
+            routed = self._route(query, response)
+            if routed is not None:
+                return self.tracer.finish(trace, routed)
+            
+            cached = await asyncio.to_thread(self._check_cache, query, response)
+            if cached is not None:
+                return self.tracer.finish(trace, cached)
+            
+            context_chunks = await self._aretrieve_context(query, response, chunks)
+            
+            response["log"].append("Generating response with LLM...")
+            with tracing.span("llm"):
+                llm_response, response["reason"] = await self.llm_service.agenerate_response(query, context_chunks)
+            
+            return self.tracer.finish(trace, self._finish(query, response, llm_response))
+    
+    async def aprocess_query_stream(self, query: str, chunks: list[dict[str, Any]] = None) -> AsyncIterator[dict[str, Any]]:
+        """Asynchronously process a user query, streaming the LLM output as it is generated.
+        
+        Args:
+            query: User query string.
+            (optional) chunks: Chunks already retrieved for the query, e.g. by a batched search. Default is None, which retrieves them.
+            
+        Returns:
+            Async iterator over the same events as process_query_stream().
+        """
+        
+        response = {
+            "query": query,
+            "tool_used": None,
+            "log": [],
+            "reason": None
+        }
+        
+        trace = self.tracer.start(query)
+        with trace.activate():
+            routed = self._route(query, response)
+        if routed is not None:
+            yield {"type": "response", "response": self.tracer.finish(trace, routed)}
+            return
+        
+        with trace.activate():
+            cached = await asyncio.to_thread(self._check_cache, query, response)
+        if cached is not None:
+            yield {"type": "response", "response": self.tracer.finish(trace, cached)}
+            return
+        
+        with trace.activate():
+            context_chunks = await self._aretrieve_context(query, response, chunks)
+        yield {"type": "retrieval", "response": response}
+        
+        response["log"].append("Streaming response from LLM...")
+        llm_response = None
+        with trace.span("llm"):
+            async for event in self._atraced_stream(trace, self.llm_service.agenerate_response_stream(query, context_chunks)):
+                if event["type"] == "token":
+                    yield event
+                else:
+                    llm_response, response["reason"] = event["result"], event["reason"]
+                    self._log_stream_timing(response, event)
+        
+        with trace.activate():
+            response = self._finish(query, response, llm_response)
+        yield {"type": "response", "response": self.tracer.finish(trace, response)}
+
+def serialize_response(response: dict[str, Any]) -> dict[str, Any]:
+    """Convert an agent response into a JSON-serializable dictionary.
+
+    Args:
+        response: Response returned by Agent.process_query().
+
+    Returns:
+        Dictionary with the result text, usage information and the rest of the response.
+    """
+    result = response.get("result")
+    return {
+        "query": response.get("query"),
+        "result": getattr(result, "content", result),
+        "usage": getattr(result, "usage_metadata", None),
+        "tool_used": response.get("tool_used"),
+        "reason": response.get("reason"),
+        "retrieved_chunks": response.get("retrieved_chunks", []),
+        "log": response.get("log", []),
+        "trace": response.get("trace")
+    }
@@ -3,6 +3,8 @@ import streamlit as st
 from argparse import Namespace
 from pprint import pformat
 from main import main
+from agent import LLM_TOOLS
+from tracing import format_breakdown
 from time import sleep
 from keyboard import press_and_release
 import psutil
@@ -66,6 +68,7 @@ with col1:
             st.session_state.agent_initialized = True
             st.session_state.prev_response_info = None
             st.session_state.logs = None
+            st.session_state.trace = None
         st.sidebar.success("Agent initialized!")
 
     if "prev_response_info" not in st.session_state:
@@ -74,6 +77,9 @@ with col1:
     if "logs" not in st.session_state:
         st.session_state.logs = None
 
+    if "trace" not in st.session_state:
+        st.session_state.trace = None
+
     if not st.session_state.agent_initialized:
         st.info("Please initialize the agent from the sidebar before submitting queries.")
         st.stop()
@@ -102,9 +108,28 @@ with col1:
                 st.subheader("LOGS:")
                 for log_entry in st.session_state.logs:
                     st.text(log_entry)
+                if st.session_state.trace is not None:
+                    st.subheader("TIMINGS:")
+                    st.text("\n".join(format_breakdown(st.session_state.trace)))
         else:
+            final = {}
+            
+            def stream_tokens():
+                """Yield answer tokens from the agent while keeping the final response.
+                
+                Returns:
+                    Iterator over answer tokens.
+                """
+                for event in st.session_state.rag_agent.agent.process_query_stream(q):
+                    if event['type'] == 'token':
+                        yield event['content']
+                    elif event['type'] == 'response':
+                        final['response'] = event['response']
+            
+            st.subheader("Result")
             with st.spinner("Processing your query..."):
-                response = st.session_state.rag_agent.agent.process_query(q)
+                streamed_text = st.write_stream(stream_tokens())
+            response = final['response']
             
             if response['result'] == "Invalid model.":
                 st.error("Invalid model. Please check the model name or URL.")
@@ -113,9 +138,10 @@ with col1:
             else:
 
                 st.session_state.logs = response.get('log', None)
+                st.session_state.trace = response.get('trace', None)
                 result = response.get('result', None)
 
-                if response.get('tool_used') in ['rag', 'none']:
+                if response.get('tool_used') in LLM_TOOLS:
                     usage_info = getattr(result, 'usage_metadata', None)
                     metadata = getattr(result, 'response_metadata', None)
                     res_id = getattr(result, 'id', None)
@@ -130,8 +156,8 @@ with col1:
                 else:
                     content = str(result)
                 
-                st.subheader("Result")
-                st.info(content)
+                if not streamed_text:
+                    st.info(content)
                 
                 if response.get('reason'):
                     st.subheader("Reasoning")
@@ -142,7 +168,11 @@ with col1:
                 st.markdown(f"**Query:** {response.get('query', q)}")
                 st.markdown(f"**Tool Used:** {response.get('tool_used', 'unknown')}")
 
-                if response.get('tool_used') == 'rag':
+                if response.get('trace'):
+                    with st.expander(f"Timing Breakdown ({response['trace']['total_ms']:.0f} ms)"):
+                        st.text("\n".join(format_breakdown(response['trace'])))
+
+                if response.get('tool_used') in ['rag', 'structured']:
                     with st.expander("Show Retrieved Chunks"):
                         st.subheader("Retrieved Chunks")
                         for i, chunk in enumerate(response.get('retrieved_chunks', [])):
@@ -0,0 +1,160 @@
+import os
+import json
+from time import perf_counter
+from typing import Any, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from agent import Agent, LLM_TOOLS, serialize_response
+from retrieval import Retriever
+
+class BatchRunner:
+    def __init__(self, agent: Agent, retriever: Retriever, workers: int = 4, block_size: int = 512, top_k: int = 3):
+        """Initialize the offline runner that answers many questions from a JSONL file.
+
+        Questions are processed in blocks. Each block is embedded in one batch and searched with one multi-query collection query, then the LLM calls are fanned out across a thread pool.
+
+        Args:
+            agent: Agent instance used to generate the answers.
+            retriever: Retriever instance used for the batched searches.
+            (optional) workers: Number of LLM calls made concurrently. Default is 4.
+            (optional) block_size: Number of questions embedded and searched together. Bounds memory use on large inputs. Default is 512.
+            (optional) top_k: Number of chunks retrieved per question. Default is 3.
+        """
+        self.agent = agent
+        self.retriever = retriever
+        self.workers = workers
+        self.block_size = block_size
+        self.top_k = top_k
+
+    @staticmethod
+    def read_questions(input_path: str) -> Iterator[dict[str, Any]]:
+        """Read questions from a JSONL file.
+
+        Each line is an object with a "query" (or "question") field and an optional "id". Lines without an id are identified by their line number.
+
+        Args:
+            input_path: Path of the input JSONL file.
+
+        Returns:
+            Iterator over dictionaries with 'id' and 'query'.
+        """
+        with open(input_path, 'r', encoding = 'utf-8') as f:
+            for line_number, line in enumerate(f, start = 1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                query = record.get("query", record.get("question"))
+                if not query:
+                    print(f"Skipping line {line_number}: no 'query' or 'question' field.")
+                    continue
+                yield {"id": str(record.get("id", line_number)), "query": query}
+
+    @staticmethod
+    def completed_ids(output_path: str) -> set[str]:
+        """Collect the ids already answered in an output file, so an interrupted run can resume.
+
+        A partially written last line is removed from the file.
+
+        Args:
+            output_path: Path of the output JSONL file.
+
+        Returns:
+            Set of question ids that already have an answer.
+        """
+        if not os.path.exists(output_path):
+            return set()
+
+        done = set()
+        valid_bytes = 0
+        with open(output_path, 'rb') as f:
+            for line in f:
+                try:
+                    done.add(str(json.loads(line)["id"]))
+                except (ValueError, KeyError):
+                    break
+                valid_bytes += len(line)
+        if valid_bytes < os.path.getsize(output_path):
+            with open(output_path, 'r+b') as f:
+                f.truncate(valid_bytes)
+        return done
+
+    def _answer(self, question: dict[str, Any], chunks: list[dict[str, Any]]) -> dict[str, Any]:
+        """Answer one question with chunks that were already retrieved.
+
+        Args:
+            question: Dictionary with 'id' and 'query'.
+            chunks: Chunks retrieved for the question.
+
+        Returns:
+            The output record, or a record with an 'error' field if the question failed.
+        """
+        start = perf_counter()
+        try:
+            response = self.agent.process_query(question["query"], chunks)
+        except Exception as e:
+            return {"id": question["id"], "query": question["query"], "error": str(e)}
+        if isinstance(response["result"], str) and response["tool_used"] in LLM_TOOLS:
+            return {"id": question["id"], "query": question["query"], "error": response["result"]}
+        return {"id": question["id"], **serialize_response(response), "latency_ms": (perf_counter() - start) * 1000}
+
+    def run(self, input_path: str, output_path: str) -> dict[str, Any]:
+        """Answer every question in the input file that is not yet in the output file.
+
+        Results are appended to the output file as they complete. Failed questions are not written, so a later run retries them.
+
+        Args:
+            input_path: Path of the input JSONL file.
+            output_path: Path of the output JSONL file.
+
+        Returns:
+            Dictionary with the number of answered, skipped and failed questions and the throughput.
+        """
+        done = self.completed_ids(output_path)
+        stats = {"answered": 0, "skipped": 0, "failed": 0, "seconds": 0.0, "per_second": 0.0}
+        start = perf_counter()
+
+        block = []
+        with open(output_path, 'a', encoding = 'utf-8') as out, ThreadPoolExecutor(max_workers = self.workers) as executor:
+            for question in self.read_questions(input_path):
+                if question["id"] in done:
+                    stats["skipped"] += 1
+                    continue
+                block.append(question)
+                if len(block) >= self.block_size:
+                    self._run_block(block, out, executor, stats)
+                    block = []
+            if block:
+                self._run_block(block, out, executor, stats)
+
+        stats["seconds"] = perf_counter() - start
+        if stats["seconds"] > 0:
+            stats["per_second"] = stats["answered"] / stats["seconds"]
+        print(f"Batch run: {stats['answered']} answered, {stats['skipped']} already done, {stats['failed']} failed in {stats['seconds']:.2f}s ({stats['per_second']:.2f} questions/s)")
+        return stats
+
+    def _run_block(self, block: list[dict[str, Any]], out: Any, executor: ThreadPoolExecutor, stats: dict[str, Any]) -> None:
+        """Retrieve chunks for a block of questions in one search and answer them concurrently.
+
+        Args:
+            block: List of questions.
+            out: Output file opened for appending.
+            executor: Thread pool the LLM calls run on.
+            stats: Statistics dictionary to update.
+
+        Returns:
+            None.
+        """
+        queries = [question["query"] for question in block]
+        embeddings = self.retriever.vector_store.embed_queries(queries)
+        results = self.retriever.retrieve_batch(queries, self.top_k, embeddings)
+
+        futures = [executor.submit(self._answer, question, chunks) for question, chunks in zip(block, results)]
+        for future in as_completed(futures):
+            record = future.result()
+            if "error" in record:
+                stats["failed"] += 1
+                print(f"Question {record['id']} failed: {record['error']}")
+                continue
+            out.write(json.dumps(record, default = str) + "\n")
+            out.flush()
+            stats["answered"] += 1
@@ -0,0 +1,289 @@
+from typing import Any, AsyncIterator, Iterator
+from time import perf_counter
+import threading
+import re
+from langchain_core.messages import AIMessage
+from lexical_index import LexicalIndex
+import tracing
+
+class ModelCascade:
+    REFUSAL_PATTERN = re.compile(
+        r"\b(?:i\s+(?:do\s+not|don't)\s+know|i'?m\s+not\s+sure|i\s+am\s+not\s+sure|(?:cannot|can't|unable\s+to)\s+(?:answer|determine|find)"
+        r"|(?:no|not\s+enough|insufficient)\s+information|does(?:\s+not|n't)\s+(?:contain|mention|provide|include|specify|say)"
+        r"|(?:is\s+)?not\s+(?:mentioned|provided|specified|stated|included)\s+in)\b",
+        re.IGNORECASE
+    )
+    STOPWORDS = frozenset(
+        "a an and are as at be been but by can could did do does for from has have how i if in into is it its may more most no not of on or "
+        "our so such than that the their them then there these they this to was we were what when where which who will with would you your".split()
+    )
+
+    def __init__(self, small: Any, large: Any, min_retrieval_score: float = 0.5, min_support: float = 0.5):
+        """Initialize the cascade that answers with a small model first and escalates to a large model only when needed.
+
+        The large model is used straight away when the best retrieved chunk scores below min_retrieval_score. Otherwise the small model answers, and its answer is escalated when it fails, says it does not know, or when too few of its content words occur in the context it was given.
+
+        Args:
+            small: LLMService (or a stand-in with the same methods) for the fast model.
+            large: LLMService (or a stand-in with the same methods) for the large model.
+            (optional) min_retrieval_score: Relevance score the best context chunk needs for the small model to be tried. Default is 0.5.
+            (optional) min_support: Fraction of the small model's answer words that must occur in the context. Default is 0.5.
+        """
+        self.small = small
+        self.large = large
+        self.min_retrieval_score = min_retrieval_score
+        self.min_support = min_support
+        self.model_name = f"{small.model_name} -> {large.model_name}"
+        self.base_url = small.base_url
+        self.max_concurrency = small.max_concurrency
+        self.stats = {"queries": 0, "answered_by_small": 0, "escalated": 0, "reasons": {}, "small_seconds": 0.0, "wasted_small_seconds": 0.0, "large_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def warm_up(self) -> bool:
+        """Load both models on their Ollama servers.
+
+        Returns:
+            True if both models were loaded.
+        """
+        small = self.small.warm_up()
+        return self.large.warm_up() and small
+
+    def backend_stats(self) -> list[dict[str, Any]]:
+        """Get the backend statistics of both models.
+
+        Returns:
+            List of per-backend statistics dictionaries.
+        """
+        return self.small.backend_stats() + self.large.backend_stats()
+
+    def _support(self, answer: str, context_chunks: list[dict[str, Any]]) -> float:
+        """Measure how much of an answer is grounded in its context.
+
+        Args:
+            answer: The answer text.
+            context_chunks: The context chunks the answer was generated from.
+
+        Returns:
+            Fraction of the answer's content words that occur in the context, or 1.0 if the answer has too few content words to judge.
+        """
+        words = {word for word in LexicalIndex.tokenize(answer) if len(word) > 2 and word not in self.STOPWORDS}
+        if len(words) < 3:
+            return 1.0
+        context = set(LexicalIndex.tokenize(" ".join(chunk["content"] for chunk in context_chunks)))
+        return len(words & context) / len(words)
+
+    def _pre_escalation(self, context_chunks: list[dict[str, Any]]) -> str:
+        """Decide from the retrieval scores alone whether to skip the small model.
+
+        Args:
+            context_chunks: List of context chunks for the query, or None.
+
+        Returns:
+            The reason for going to the large model, or None to try the small model.
+        """
+        if not context_chunks:
+            return None
+        best = max(chunk.get("relevance_score", 1.0) for chunk in context_chunks)
+        if best < self.min_retrieval_score:
+            return f"low retrieval score ({best:.2f} < {self.min_retrieval_score})"
+        return None
+
+    def _escalation(self, result: Any, context_chunks: list[dict[str, Any]]) -> str:
+        """Decide whether the small model's answer should be escalated.
+
+        Args:
+            result: The small model's AIMessage, or an error string.
+            context_chunks: List of context chunks for the query, or None.
+
+        Returns:
+            The reason for escalating, or None to keep the answer.
+        """
+        if not isinstance(result, AIMessage):
+            return "small model failed"
+        answer = result.content.replace("’", "'")
+        if self.REFUSAL_PATTERN.search(answer):
+            return "small model did not know"
+        if context_chunks:
+            support = self._support(answer, context_chunks)
+            if support < self.min_support:
+                return f"answer not supported by context ({support:.2f} < {self.min_support})"
+        return None
+
+    def _record(self, result: Any, reason: str, small_seconds: float = None, large_seconds: float = None) -> None:
+        """Record a cascade decision in the statistics, the active trace and the result's metadata.
+
+        Args:
+            result: The final AIMessage, or an error string.
+            reason: Why the query was escalated, or None if the small model's answer was kept.
+            (optional) small_seconds: Time the small model took, or None if it was skipped. Default is None.
+            (optional) large_seconds: Time the large model took, or None if it was not used. Default is None.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            self.stats["queries"] += 1
+            if reason is None:
+                self.stats["answered_by_small"] += 1
+                self.stats["small_seconds"] += small_seconds
+            else:
+                self.stats["escalated"] += 1
+                self.stats["reasons"][reason.split(" (")[0]] = self.stats["reasons"].get(reason.split(" (")[0], 0) + 1
+                self.stats["wasted_small_seconds"] += small_seconds or 0.0
+                self.stats["large_seconds"] += large_seconds
+            mean_large = self.stats["large_seconds"] / self.stats["escalated"] if self.stats["escalated"] else None
+        if reason is None:
+            saved = None if mean_large is None else mean_large - small_seconds
+        else:
+            # Escalated queries pay for the small model on top of the large one
+            saved = -small_seconds if small_seconds is not None else 0.0
+        decision = {
+            "model": (self.small if reason is None else self.large).model_name,
+            "escalated": reason is not None,
+            "reason": reason,
+            "small_ms": None if small_seconds is None else small_seconds * 1000,
+            "large_ms": None if large_seconds is None else large_seconds * 1000,
+            "estimated_saved_ms": None if saved is None else saved * 1000
+        }
+        tracing.annotate(cascade = decision)
+        if isinstance(result, AIMessage):
+            result.response_metadata["cascade"] = decision
+
+    def summary(self) -> dict[str, Any]:
+        """Summarize the cascade decisions so far.
+
+        The latency saved is estimated as the mean large-model latency for every query the small model answered, minus the time the small model took on all queries, including the escalated ones.
+
+        Returns:
+            Dictionary with the query and escalation counts, escalation reasons, escalation rate and estimated seconds saved (None until the large model was used once).
+        """
+        with self._lock:
+            stats = dict(self.stats, reasons = dict(self.stats["reasons"]))
+        stats["escalation_rate"] = stats["escalated"] / stats["queries"] if stats["queries"] else None
+        stats["estimated_saved_seconds"] = (
+            stats["answered_by_small"] * stats["large_seconds"] / stats["escalated"] - stats["small_seconds"] - stats["wasted_small_seconds"]
+            if stats["escalated"] else None
+        )
+        return stats
+
+    def generate_response(self, query: str, context_chunks: list[dict[str, Any]] = None) -> tuple[Any, list[str]]:
+        """Generate a response, escalating to the large model when needed.
+
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+
+        Returns:
+            Tuple containing the LLM response (with the decision in response_metadata['cascade']) and the reasoning.
+        """
+        small_seconds = None
+        reason = self._pre_escalation(context_chunks)
+        if reason is None:
+            start = perf_counter()
+            with tracing.span("cascade_small"):
+                result, reasoning = self.small.generate_response(query, context_chunks)
+            small_seconds = perf_counter() - start
+            reason = self._escalation(result, context_chunks)
+            if reason is None:
+                self._record(result, None, small_seconds)
+                return result, reasoning
+
+        start = perf_counter()
+        with tracing.span("cascade_large", reason = reason):
+            result, reasoning = self.large.generate_response(query, context_chunks)
+        self._record(result, reason, small_seconds, perf_counter() - start)
+        return result, reasoning
+
+    async def agenerate_response(self, query: str, context_chunks: list[dict[str, Any]] = None) -> tuple[Any, list[str]]:
+        """Asynchronously generate a response, escalating to the large model when needed.
+
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+
+        Returns:
+            Same as generate_response().
+        """
+        small_seconds = None
+        reason = self._pre_escalation(context_chunks)
+        if reason is None:
+            start = perf_counter()
+            with tracing.span("cascade_small"):
+                result, reasoning = await self.small.agenerate_response(query, context_chunks)
+            small_seconds = perf_counter() - start
+            reason = self._escalation(result, context_chunks)
+            if reason is None:
+                self._record(result, None, small_seconds)
+                return result, reasoning
+
+        start = perf_counter()
+        with tracing.span("cascade_large", reason = reason):
+            result, reasoning = await self.large.agenerate_response(query, context_chunks)
+        self._record(result, reason, small_seconds, perf_counter() - start)
+        return result, reasoning
+
+    def generate_response_stream(self, query: str, context_chunks: list[dict[str, Any]] = None) -> Iterator[dict[str, Any]]:
+        """Stream a response, escalating to the large model when needed.
+
+        The small model's answer has to be checked before it is shown, so it is generated in full and then sent as a single token event. Escalated queries stream from the large model.
+
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+
+        Returns:
+            Iterator over the same events as LLMService.generate_response_stream().
+        """
+        small_seconds = None
+        reason = self._pre_escalation(context_chunks)
+        if reason is None:
+            start = perf_counter()
+            with tracing.span("cascade_small"):
+                events = list(self.small.generate_response_stream(query, context_chunks))
+            small_seconds = perf_counter() - start
+            end = events[-1]
+            reason = self._escalation(end["result"], context_chunks)
+            if reason is None:
+                self._record(end["result"], None, small_seconds)
+                yield {"type": "token", "content": end["result"].content}
+                yield end
+                return
+
+        start = perf_counter()
+        with tracing.span("cascade_large", reason = reason):
+            for event in self.large.generate_response_stream(query, context_chunks):
+                if event["type"] == "end":
+                    self._record(event["result"], reason, small_seconds, perf_counter() - start)
+                yield event
+
+    async def agenerate_response_stream(self, query: str, context_chunks: list[dict[str, Any]] = None) -> AsyncIterator[dict[str, Any]]:
+        """Asynchronously stream a response, escalating to the large model when needed.
+
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+
+        Returns:
+            Async iterator over the same events as LLMService.generate_response_stream().
+        """
+        small_seconds = None
+        reason = self._pre_escalation(context_chunks)
+        if reason is None:
+            start = perf_counter()
+            with tracing.span("cascade_small"):
+                events = [event async for event in self.small.agenerate_response_stream(query, context_chunks)]
+            small_seconds = perf_counter() - start
+            end = events[-1]
+            reason = self._escalation(end["result"], context_chunks)
+            if reason is None:
+                self._record(end["result"], None, small_seconds)
+                yield {"type": "token", "content": end["result"].content}
+                yield end
+                return
+
+        start = perf_counter()
+        with tracing.span("cascade_large", reason = reason):
+            async for event in self.large.agenerate_response_stream(query, context_chunks):
+                if event["type"] == "end":
+                    self._record(event["result"], reason, small_seconds, perf_counter() - start)
+                yield event
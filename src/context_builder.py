@@ -0,0 +1,115 @@
+import math
+from typing import Any
+
+class ContextBuilder:
+    def __init__(self, token_budget: int = 1500, chars_per_token: float = 4.0):
+        """Initialize the context assembly stage that packs retrieved chunks into a token budget.
+
+        Args:
+            (optional) token_budget: Maximum number of estimated tokens of context sent to the LLM. Default is 1500.
+            (optional) chars_per_token: Average number of characters per token used for estimates. Default is 4.0.
+        """
+        self.token_budget = token_budget
+        self.chars_per_token = chars_per_token
+
+    def estimate_tokens(self, text: str) -> int:
+        """Estimate the number of tokens in a text.
+
+        Args:
+            text: The text to estimate.
+
+        Returns:
+            Estimated token count.
+        """
+        return math.ceil(len(text) / self.chars_per_token)
+
+    @staticmethod
+    def _overlap(first: str, second: str) -> int:
+        """Find the length of the longest suffix of the first text that is a prefix of the second.
+
+        Args:
+            first: The earlier chunk.
+            second: The chunk that follows it.
+
+        Returns:
+            Number of overlapping characters.
+        """
+        for length in range(min(len(first), len(second)), 0, -1):
+            if first.endswith(second[:length]):
+                return length
+        return 0
+
+    def _merge(self, chunks: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Merge chunks that are neighbours in the same source, dropping their overlapping text.
+
+        Args:
+            chunks: Retrieved chunks with 'content', 'filename', 'chunk_id' and 'relevance_score'.
+
+        Returns:
+            List of merged chunks in source order, each scored by its best member.
+        """
+        ordered = sorted(
+            chunks,
+            key = lambda chunk: (str(chunk.get("filename")), chunk.get("chunk_id") if chunk.get("chunk_id") is not None else -1)
+        )
+        merged = []
+        for chunk in ordered:
+            previous = merged[-1] if merged else None
+            if (
+                previous is not None
+                and chunk.get("chunk_id") is not None
+                and previous["filename"] == chunk.get("filename")
+                and previous["last_chunk_id"] is not None
+                and chunk["chunk_id"] - previous["last_chunk_id"] <= 1
+            ):
+                if chunk["chunk_id"] != previous["last_chunk_id"]:
+                    overlap = self._overlap(previous["content"], chunk["content"])
+                    previous["content"] += chunk["content"][overlap:] if overlap else "\n" + chunk["content"]
+                previous["last_chunk_id"] = chunk["chunk_id"]
+                previous["relevance_score"] = max(previous["relevance_score"], chunk["relevance_score"])
+                previous["merged_chunks"] += 1
+                continue
+            merged.append({
+                **chunk,
+                "last_chunk_id": chunk.get("chunk_id"),
+                "merged_chunks": 1
+            })
+        return merged
+
+    def build(self, chunks: list[dict[str, Any]]) -> tuple[list[dict[str, Any]], dict[str, int]]:
+        """De-duplicate, merge and pack retrieved chunks into the token budget.
+
+        Args:
+            chunks: Retrieved chunks with 'content', 'filename', 'chunk_id' and 'relevance_score'.
+
+        Returns:
+            Tuple containing the packed chunks (best first) and statistics with the estimated tokens before and after packing, the tokens saved and the number of chunks dropped.
+        """
+        tokens_before = sum(self.estimate_tokens(chunk["content"]) for chunk in chunks)
+        merged = self._merge(chunks)
+
+        packed = []
+        used = 0
+        dropped = 0
+        for chunk in sorted(merged, key = lambda chunk: chunk["relevance_score"], reverse = True):
+            tokens = self.estimate_tokens(chunk["content"])
+            if used + tokens > self.token_budget:
+                dropped += chunk["merged_chunks"]
+                continue
+            packed.append(chunk)
+            used += tokens
+
+        if not packed and merged:
+            # Never send an empty context just because the best chunk alone is over budget
+            best = max(merged, key = lambda chunk: chunk["relevance_score"])
+            packed.append({**best, "content": best["content"][:int(self.token_budget * self.chars_per_token)]})
+            used = self.estimate_tokens(packed[0]["content"])
+            dropped -= best["merged_chunks"]
+
+        stats = {
+            "tokens_before": tokens_before,
+            "tokens_after": used,
+            "tokens_saved": tokens_before - used,
+            "chunks_dropped": dropped
+        }
+        return packed, stats
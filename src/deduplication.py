@@ -0,0 +1,204 @@
+import re
+from collections import defaultdict
+from typing import Any, Iterable, Iterator
+import numpy as np
+from embeddings import VectorStore
+
+class ChunkDeduplicator:
+    # Mersenne prime modulus of the universal hash family that stands in for random permutations
+    PRIME = (1 << 31) - 1
+    WHITESPACE = re.compile(r"\s+")
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 64, bands: int = 8, shingle_size: int = 5, seed: int = 0):
+        """Initialize the streaming near-duplicate filter for chunks.
+
+        Every chunk gets a MinHash signature of its character shingles, and a locality-sensitive hash over bands of the signature finds earlier chunks that are likely similar. A chunk whose estimated Jaccard similarity to an earlier chunk reaches the threshold is dropped, and the earlier (canonical) chunk records it: 'duplicates' counts the copies folded into it and 'sources' lists every file it occurs in.
+
+        Args:
+            (optional) threshold: Estimated Jaccard similarity of the shingle sets at which two chunks count as duplicates. Default is 0.9.
+            (optional) num_perm: Number of MinHash values per signature. Default is 64.
+            (optional) bands: Number of LSH bands the signature is split into. More bands find less similar candidates. Default is 8.
+            (optional) shingle_size: Length of the character shingles, in bytes. Default is 5.
+            (optional) seed: Random seed of the hash functions. Default is 0.
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands}).")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, self.PRIME, size = num_perm, dtype = np.uint64)
+        self._b = rng.integers(0, self.PRIME, size = num_perm, dtype = np.uint64)
+        # Shingles are read as big-endian integers of shingle_size bytes
+        self._weights = (256 ** np.arange(shingle_size - 1, -1, -1, dtype = np.uint64)).astype(np.uint64)
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget every chunk seen so far.
+
+        Returns:
+            None.
+        """
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = []
+        self.canonical = []
+        self.sources = {}
+        self.updated = set()
+        self.links = defaultdict(set)
+        self.stats = {"chunks": 0, "duplicates": 0, "duplicate_chars": 0}
+
+    def signature(self, text: str) -> np.ndarray:
+        """Compute the MinHash signature of a text's character shingles.
+
+        Case and runs of whitespace are ignored.
+
+        Args:
+            text: The chunk text.
+
+        Returns:
+            uint32 array of num_perm hash minima.
+        """
+        data = np.frombuffer(self.WHITESPACE.sub(" ", text.lower()).strip().encode('utf-8'), dtype = np.uint8)
+        if len(data) < self.shingle_size:
+            data = np.concatenate([data, np.zeros(self.shingle_size - len(data), dtype = np.uint8)])
+        windows = np.lib.stride_tricks.sliding_window_view(data, self.shingle_size).astype(np.uint64)
+        shingles = np.unique(windows @ self._weights) % np.uint64(self.PRIME)
+        hashes = (self._a[:, None] * shingles[None, :] + self._b[:, None]) % np.uint64(self.PRIME)
+        return hashes.min(axis = 1).astype(np.uint32)
+
+    def _match(self, signature: np.ndarray) -> int:
+        """Find an earlier canonical chunk that the signature is a near-duplicate of.
+
+        Args:
+            signature: Signature of the new chunk.
+
+        Returns:
+            Index of the most similar canonical chunk at or above the threshold, or None.
+        """
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(key, ()))
+        best, best_similarity = None, self.threshold
+        for index in candidates:
+            similarity = float(np.mean(self.signatures[index] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = index, similarity
+        return best
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        """Split a signature into its LSH band keys.
+
+        Args:
+            signature: A chunk's signature.
+
+        Returns:
+            One key per band.
+        """
+        return [band.tobytes() for band in signature.reshape(self.bands, -1)]
+
+    def add_existing(self, chunks: Iterable[dict[str, Any]]) -> None:
+        """Register chunks that are already in the vector store as canonical chunks, so new chunks are deduplicated against them too.
+
+        They do not count towards the statistics, and their 'sources' metadata is extended when a new duplicate turns up.
+
+        Args:
+            chunks: Iterable of stored chunk dictionaries with 'id', 'content' and 'metadata'.
+
+        Returns:
+            None.
+        """
+        for chunk in chunks:
+            index = self._add_canonical(self.signature(chunk['content']), chunk['id'], dict(chunk['metadata']))
+            if chunk['metadata'].get('sources'):
+                self.sources[index] = set(chunk['metadata']['sources'].split(", "))
+
+    def _add_canonical(self, signature: np.ndarray, chunk_id: str, metadata: dict[str, Any]) -> int:
+        """Make a chunk a candidate for later chunks to be merged into.
+
+        Args:
+            signature: Signature of the chunk.
+            chunk_id: Id of the chunk in the vector store.
+            metadata: Metadata of the chunk, updated in place by merges.
+
+        Returns:
+            Index of the canonical chunk.
+        """
+        index = len(self.canonical)
+        self.signatures.append(signature)
+        for band, key in enumerate(self._band_keys(signature)):
+            self.buckets[band].setdefault(key, []).append(index)
+        self.canonical.append((chunk_id, metadata))
+        return index
+
+    def filter(self, chunks: Iterable[dict[str, Any]]) -> Iterator[dict[str, Any]]:
+        """Drop chunks that are near-duplicates of earlier ones, lazily.
+
+        A canonical chunk may already be in the vector store when a duplicate of it turns up, so its metadata is updated in place and also returned by updates() for the store.
+
+        Args:
+            chunks: Iterable of chunk dictionaries with 'content' and 'metadata'.
+
+        Returns:
+            Iterator over the chunks that are not near-duplicates of an earlier chunk.
+        """
+        for chunk in chunks:
+            self.stats["chunks"] += 1
+            signature = self.signature(chunk['content'])
+            match = self._match(signature)
+            if match is not None:
+                self._merge(match, chunk)
+                continue
+
+            # Chunks with the same text in one file are always merged, so this is the id the store gives the chunk
+            self._add_canonical(signature, VectorStore._chunk_ids([chunk])[0], chunk['metadata'])
+            yield chunk
+
+    def _merge(self, index: int, chunk: dict[str, Any]) -> None:
+        """Fold a duplicate chunk into its canonical chunk.
+
+        Args:
+            index: Index of the canonical chunk.
+            chunk: The duplicate chunk.
+
+        Returns:
+            None.
+        """
+        _, metadata = self.canonical[index]
+        metadata['duplicates'] = metadata.get('duplicates', 0) + 1
+        canonical_source, source = metadata.get('filename'), chunk['metadata'].get('filename')
+        sources = self.sources.setdefault(index, {canonical_source})
+        if source not in sources:
+            sources.add(source)
+            # Metadata values must be scalars, so the sources are stored as one string
+            metadata['sources'] = ", ".join(sorted(sources))
+            self.links[canonical_source].add(source)
+            self.links[source].add(canonical_source)
+        self.updated.add(index)
+        self.stats["duplicates"] += 1
+        self.stats["duplicate_chars"] += len(chunk['content'])
+
+    def updates(self) -> tuple[list[str], list[dict[str, Any]]]:
+        """Get the canonical chunks whose metadata changed because duplicates were folded into them.
+
+        Returns:
+            Tuple containing their ids and their new metadata.
+        """
+        indices = sorted(self.updated)
+        return [self.canonical[i][0] for i in indices], [self.canonical[i][1] for i in indices]
+
+    def summary(self) -> dict[str, Any]:
+        """Summarize how much the deduplication removed.
+
+        Returns:
+            Dictionary with the chunks seen, duplicates dropped, chunks kept, the fraction of chunks dropped, the characters that were not embedded, and the files each file shares chunks with.
+        """
+        chunks, duplicates = self.stats["chunks"], self.stats["duplicates"]
+        return {
+            "chunks": chunks,
+            "duplicates": duplicates,
+            "kept": chunks - duplicates,
+            "reduction": duplicates / chunks if chunks else 0.0,
+            "duplicate_chars": self.stats["duplicate_chars"],
+            "links": {source: sorted(linked) for source, linked in self.links.items()}
+        }
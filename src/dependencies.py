@@ -0,0 +1,96 @@
+import os
+import sys
+import subprocess
+from importlib import metadata
+try:
+    from packaging.requirements import Requirement, InvalidRequirement
+    from packaging.version import InvalidVersion
+except ImportError:
+    # packaging is in requirements.txt, so it may not be installed yet; pip ships a copy
+    try:
+        from pip._vendor.packaging.requirements import Requirement, InvalidRequirement
+        from pip._vendor.packaging.version import InvalidVersion
+    except ImportError:
+        Requirement = None
+
+REQUIREMENTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'requirements.txt')
+
+def read_requirements(path: str = REQUIREMENTS_PATH) -> list[str]:
+    """Read the requirement lines of a requirements file.
+
+    The file may be UTF-8 or, as written by "pip freeze > requirements.txt" in PowerShell, UTF-16.
+
+    Args:
+        (optional) path: Path of the requirements file. Default is the requirements.txt next to "src".
+
+    Returns:
+        List of requirement strings, without comments and blank lines.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    text = raw.decode('utf-16') if raw[:2] in (b'\xff\xfe', b'\xfe\xff') else raw.decode('utf-8-sig')
+    return [line.split('#', 1)[0].strip() for line in text.splitlines() if line.split('#', 1)[0].strip()]
+
+def missing_requirements(path: str = REQUIREMENTS_PATH) -> list[str]:
+    """Find the requirements that are not installed, or not installed at a version they allow.
+
+    Requirements whose environment marker does not match this system, such as Windows-only packages on Linux, are skipped.
+
+    Args:
+        (optional) path: Path of the requirements file. Default is the requirements.txt next to "src".
+
+    Returns:
+        List of unsatisfied requirement strings. Every requirement if they cannot be parsed because neither packaging nor pip is installed.
+    """
+    requirements = read_requirements(path)
+    if Requirement is None:
+        return requirements
+
+    missing = []
+    for line in requirements:
+        try:
+            requirement = Requirement(line)
+        except InvalidRequirement:
+            missing.append(line)
+            continue
+        if requirement.marker is not None and not requirement.marker.evaluate():
+            continue
+        try:
+            installed = metadata.version(requirement.name)
+        except metadata.PackageNotFoundError:
+            missing.append(line)
+            continue
+        try:
+            satisfied = requirement.specifier.contains(installed, prereleases = True)
+        except InvalidVersion:
+            satisfied = False
+        if not satisfied:
+            missing.append(line)
+    return missing
+
+def ensure_requirements(path: str = REQUIREMENTS_PATH) -> bool:
+    """Install the requirements with pip, unless every one of them is already satisfied.
+
+    Checking the installed package metadata takes milliseconds, while running pip takes seconds even when there is nothing to install.
+
+    Args:
+        (optional) path: Path of the requirements file. Default is the requirements.txt next to "src".
+
+    Returns:
+        True if the requirements are satisfied, False if installing them failed.
+    """
+    try:
+        missing = missing_requirements(path)
+    except OSError as e:
+        print(f"Could not read {path}, skipping dependency installation:\n{e}")
+        return False
+    if not missing:
+        return True
+
+    print(f"\nManaging dependencies ({len(missing)} missing or outdated)...\nThis might take a few seconds...\n")
+    try:
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", path], stdout = subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error while installing dependencies:\n{e}")
+        return False
+    return True
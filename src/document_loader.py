@@ -1,11 +1,10 @@
 import os
-from typing import Any
-
-from langchain_community.document_loaders import TextLoader, CSVLoader, JSONLoader, PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
+from typing import Any, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
 
 class DocumentLoader:
+    SUPPORTED_EXTENSIONS = ('.txt', '.csv', '.json', '.pdf')
+    
     def __init__(self, data_dir: str = f"{os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')}"):
         """Initialize the document loader.
         
@@ -15,8 +14,8 @@ class DocumentLoader:
         
         self.data_dir = data_dir
 
-    def load_documents(self) -> list[dict[str, Any]]:
-        """Load all documents from the data directory.
+    def load_documents(self, filenames: list[str] = None) -> list[dict[str, Any]]:
+        """Load documents from the data directory.
         
         Supports multiple file types:
         - .txt: Plain text files
@@ -24,72 +23,78 @@ class DocumentLoader:
         - .json: JSON files
         - .pdf: PDF files
         
+        Args:
+            (optional) filenames: Names of the files inside the data directory to load. Default is None, which loads every file.
+        
         Returns:
             A list of document dictionaries with 'content' and 'metadata'.
         """
         documents = []
         
-        for filename in os.listdir(self.data_dir):
-            file_path = os.path.join(self.data_dir, filename)
-            file_extension = os.path.splitext(filename)[1].lower()
+        for filename in self.discover(filenames):
+            documents.extend(_load_file(self.data_dir, filename))
+        
+        return documents
+    
+    def discover(self, filenames: list[str] = None) -> Iterator[str]:
+        """Yield the names of the files to ingest from the data directory.
+        
+        Args:
+            (optional) filenames: Names of the files to ingest. Default is None, which yields every file in the data directory.
             
-            print(f"Loading {filename}...")
+        Returns:
+            Iterator over filenames.
+        """
+        if filenames is not None:
+            yield from filenames
+            return
+        
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield entry.name
+    
+    def iter_documents(self, filenames: Iterable[str], workers: int = None) -> Iterator[list[dict[str, Any]]]:
+        """Load files across a process pool and yield their documents file by file.
+        
+        At most twice as many files as there are workers are in flight at once, so memory stays bounded regardless of the corpus size.
+        
+        Args:
+            filenames: Names of the files inside the data directory to load.
+            (optional) workers: Number of worker processes. Default is None, which uses the number of CPUs. A value of 1 loads files in the current process.
             
-            try:
-                # Select appropriate loader based on file extension
-                if file_extension == '.txt':
-                    loader = TextLoader(file_path, encoding = 'utf-8')
-                elif file_extension == '.csv':
-                    loader = CSVLoader(file_path)
-                elif file_extension == '.json':
-                    loader = JSONLoader(
-                        file_path = file_path,
-                        jq_schema = '.',
-                        text_content = False
-                    )
-                elif file_extension == '.pdf':
-                    loader = PyPDFLoader(file_path)
-                else:
-                    print(f"Unsupported file extension: {file_extension} for {filename}")
-                    continue
-                
-                # Load document with appropriate loader
-                langchain_docs = loader.load()
-                
-                # Process loaded documents
-                for doc in langchain_docs:
-                    documents.append({
-                        'content': doc.page_content,
-                        'metadata': {
-                            'source': filename,
-                            'filename': filename,
-                            'file_type': file_extension,
-                            **doc.metadata
-                        }
-                    })
-                    
-            except Exception as e:
-                print(f"Error loading {filename}: {str(e)}")
+        Returns:
+            Iterator over the list of documents loaded from each file.
+        """
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            for filename in filenames:
+                yield _load_file(self.data_dir, filename)
+            return
         
-        return documents
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            pending = set()
+            for filename in filenames:
+                pending.add(executor.submit(_load_file, self.data_dir, filename))
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in as_completed(pending):
+                yield future.result()
     
-    def chunk_documents(self, documents: list[dict[str, Any]], chunk_size: int = 1000, chunk_overlap: int = 200) -> list[dict[str, Any]]:
-        """Chunk documents into smaller pieces using LangChain's text splitter.
+    def iter_chunks(self, documents: Iterable[dict[str, Any]], chunk_size: int = 1000, chunk_overlap: int = 200) -> Iterator[dict[str, Any]]:
+        """Lazily chunk documents into smaller pieces using LangChain's text splitter.
         
         Args:
-            documents: List of document dictionaries.
+            documents: Iterable of document dictionaries.
             (optional) chunk_size: Maximum size of each chunk. Default is 1000 characters.
             (optional) chunk_overlap: Overlap between chunks. Default is 200 characters.
             
         Returns:
-            A list of chunk dictionaries with 'content' and 'metadata'.
+            Iterator over chunk dictionaries with 'content' and 'metadata'. 'chunk_id' is the position of the chunk within its source file.
         """
-        langchain_docs = [
-            Document(
-                page_content = doc['content'],
-                metadata = doc['metadata']
-            ) for doc in documents
-        ]
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
         
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size = chunk_size,
@@ -98,16 +103,86 @@ class DocumentLoader:
             separators = ["\n\n", "\n", ". ", " ", ""]
         )
         
-        split_docs = text_splitter.split_documents(langchain_docs)
+        source_positions = {}
+        for doc in documents:
+            source = doc['metadata'].get('source')
+            for text in text_splitter.split_text(doc['content']):
+                position = source_positions.get(source, 0)
+                source_positions[source] = position + 1
+                yield {
+                    'content': text,
+                    'metadata': {
+                        **doc['metadata'],
+                        'chunk_id': position
+                    }
+                }
+    
+    def chunk_documents(self, documents: list[dict[str, Any]], chunk_size: int = 1000, chunk_overlap: int = 200) -> list[dict[str, Any]]:
+        """Chunk documents into smaller pieces using LangChain's text splitter.
         
-        chunks = []
-        for i, doc in enumerate(split_docs):
-            chunks.append({
+        Args:
+            documents: List of document dictionaries.
+            (optional) chunk_size: Maximum size of each chunk. Default is 1000 characters.
+            (optional) chunk_overlap: Overlap between chunks. Default is 200 characters.
+            
+        Returns:
+            A list of chunk dictionaries with 'content' and 'metadata'. 'chunk_id' is the position of the chunk within its source file.
+        """
+        return list(self.iter_chunks(documents, chunk_size, chunk_overlap))
+
+def _load_file(data_dir: str, filename: str) -> list[dict[str, Any]]:
+    """Load a single file with the loader matching its extension.
+    
+    Defined at module level so it can be sent to worker processes.
+    
+    Args:
+        data_dir: Directory containing the file.
+        filename: Name of the file to load.
+        
+    Returns:
+        A list of document dictionaries with 'content' and 'metadata'. Empty if the file could not be loaded.
+    """
+    file_path = os.path.join(data_dir, filename)
+    file_extension = os.path.splitext(filename)[1].lower()
+    documents = []
+    
+    print(f"Loading {filename}...")
+    
+    try:
+        # Select appropriate loader based on file extension. Loaders are imported on first use, so only the file types present are paid for
+        if file_extension == '.txt':
+            from langchain_community.document_loaders import TextLoader
+            loader = TextLoader(file_path, encoding = 'utf-8')
+        elif file_extension == '.csv':
+            from langchain_community.document_loaders import CSVLoader
+            loader = CSVLoader(file_path)
+        elif file_extension == '.json':
+            from langchain_community.document_loaders import JSONLoader
+            loader = JSONLoader(
+                file_path = file_path,
+                jq_schema = '.',
+                text_content = False
+            )
+        elif file_extension == '.pdf':
+            from langchain_community.document_loaders import PyPDFLoader
+            loader = PyPDFLoader(file_path)
+        else:
+            print(f"Unsupported file extension: {file_extension} for {filename}")
+            return documents
+        
+        # Load document lazily with appropriate loader
+        for doc in loader.lazy_load():
+            documents.append({
                 'content': doc.page_content,
                 'metadata': {
-                    **doc.metadata,
-                    'chunk_id': i
+                    'source': filename,
+                    'filename': filename,
+                    'file_type': file_extension,
+                    **doc.metadata
                 }
             })
-        
-        return chunks
\ No newline at end of file
+            
+    except Exception as e:
+        print(f"Error loading {filename}: {str(e)}")
+    
+    return documents
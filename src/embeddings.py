@@ -1,76 +1,526 @@
-from typing import Any
-import chromadb
+from typing import Any, Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from time import perf_counter
+import os
+import atexit
+import hashlib
+import threading
+import numpy as np
+from query_embedding_cache import QueryEmbeddingCache
+from lexical_index import LexicalIndex
+from metadata_index import MetadataIndex
+from vector_backends import VectorBackend, ChromaBackend, MmapBackend, ShardedBackend
+import tracing
 
 class VectorStore:
-    def __init__(self):
-        """Initialize the vector store with the specified embedding model."""
-        self.client = chromadb.EphemeralClient()
-        self.collection = self._get_collection()
-    
-    def _get_collection(self, collection_name: str = "document_chunks") -> chromadb.Collection:
-        """Get a ChromaDB collection.
+    def __init__(self, persist_dir: str = None, batch_size: int = 256, query_cache_size: int = 1024, query_cache_path: str = None, lexical_index: LexicalIndex = None, backend: str | VectorBackend = "chroma", embedding_dtype: str = None, ann: bool = False, ann_lists: int = None, ann_effort: int = None, hnsw: dict[str, int] = None, shards: int = None):
+        """Initialize the vector store with the specified embedding model.
         
         Args:
-            (optional) collection_name: Name of the collection. Default is "document_chunks".
+            (optional) persist_dir: Directory to persist the database in. Default is None, which keeps the database in memory (or, for the mmap backend, in a temporary directory).
+            (optional) batch_size: Number of chunks embedded and inserted per batch when adding chunks. Capped at the backend's maximum batch size. Default is 256.
+            (optional) query_cache_size: Maximum number of query embeddings kept in the query embedding cache. Default is 1024.
+            (optional) query_cache_path: File the query embedding cache is persisted to. Default is None, which uses "query_embeddings.json" inside persist_dir, or keeps the cache in memory if persist_dir is not set either.
+            (optional) lexical_index: LexicalIndex kept in sync with the index for hybrid retrieval. Default is None.
+            (optional) backend: "chroma" for a ChromaDB collection, "mmap" for the native memory-mapped index (stored in "mmap_index" inside persist_dir), or a VectorBackend instance. Default is "chroma".
+            (optional) embedding_dtype: Storage type of the embeddings in a new mmap index: "float32", "float16" or "int8". Default is None, which uses float32.
+            (optional) ann: Build and maintain an IVF index in the mmap backend. Default is False, which searches exactly.
+            (optional) ann_lists: Number of IVF clusters in the mmap backend. Default is None, which uses 4 * sqrt(chunks).
+            (optional) ann_effort: Default search effort: IVF clusters probed per query in the mmap backend, ef_search of a new Chroma collection. Default is None, which uses the backend's default.
+            (optional) hnsw: HNSW parameters ("M", "ef_construction") of a new Chroma collection. Default is None.
+            (optional) shards: Split the mmap index into this many shards (stored in "sharded_index" inside persist_dir), each searched by its own worker process. Default is None, which keeps one index in this process.
+        """
+        self.persist_dir = persist_dir
+        self.batch_size = batch_size
+        # Searches hold it for reading, and replacing the chunks of changed files holds it for writing
+        self.swap_lock = ReadWriteLock()
+        self._embedding_function = None
+        self._embedding_lock = threading.Lock()
+        if isinstance(backend, VectorBackend):
+            self.backend = backend
+        elif backend == "mmap" and shards and shards > 1:
+            self.backend = ShardedBackend(shards, os.path.join(persist_dir, "sharded_index") if persist_dir else None, embedding_dtype, ann, ann_lists, ann_effort or 8)
+        elif backend == "mmap":
+            self.backend = MmapBackend(os.path.join(persist_dir, "mmap_index") if persist_dir else None, embedding_dtype, ann, ann_lists, ann_effort or 8)
+        elif backend == "chroma":
+            hnsw = {**(hnsw or {}), **({"ef_search": ann_effort} if ann_effort else {})}
+            self.backend = ChromaBackend(self.embedding_function, persist_dir, hnsw = hnsw or None)
+        else:
+            raise ValueError(f"Unknown vector store backend: {backend}. Choose 'chroma' or 'mmap'.")
+        
+        if query_cache_path is None and persist_dir:
+            query_cache_path = os.path.join(persist_dir, "query_embeddings.json")
+        self.query_cache = QueryEmbeddingCache(lambda texts: self.embedding_function(texts), max_entries = query_cache_size, path = query_cache_path)
+        if query_cache_path:
+            atexit.register(self.query_cache.save)
+        
+        self.lexical_index = lexical_index
+        if lexical_index is not None and self.count() > 0:
+            self._rebuild_lexical_index()
+    
+    @property
+    def embedding_function(self) -> Any:
+        """The embedding model, loaded on first use.
+        
+        The mmap backend never needs it to open an index, so ChromaDB and the model are only loaded once something has to be embedded, or by warm_up().
+        """
+        if self._embedding_function is None:
+            with self._embedding_lock:
+                if self._embedding_function is None:
+                    from chromadb.utils import embedding_functions
+                    self._embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        return self._embedding_function
+    
+    def warm_up(self) -> None:
+        """Load the embedding model and run it once, so the first query does not pay for it.
+        
         Returns:
-            The ChromaDB collection.
+            None.
         """
-        try:
-            return self.client.get_or_create_collection(name = collection_name)
-        except Exception as e:
-            print(f"Error while accessing database:\n{e}")
+        self.embedding_function(["warm up"])
+    
+    def count(self) -> int:
+        """Count the chunks in the store.
+        
+        Returns:
+            Number of chunks.
+        """
+        return self.backend.count()
+    
+    def iter_chunks(self) -> Iterator[list[dict[str, Any]]]:
+        """Page through every chunk in the store.
+        
+        Returns:
+            Iterator over pages of chunk dictionaries with 'id', 'content' and 'metadata'.
+        """
+        page_size = self.backend.max_batch_size
+        offset = 0
+        while True:
+            page = self.backend.get(limit = page_size, offset = offset)
+            if not page['ids']:
+                return
+            yield [
+                {'id': chunk_id, 'content': document, 'metadata': metadata}
+                for chunk_id, document, metadata in zip(page['ids'], page['documents'], page['metadatas'])
+            ]
+            offset += len(page['ids'])
     
-    def add_chunks(self, chunks: list[dict[str, Any]]) -> None:
-        """Add document chunks to the vector store.
+    def _rebuild_lexical_index(self) -> None:
+        """Index every chunk already in the backend, e.g. when opening a persistent index.
+        
+        Returns:
+            None.
+        """
+        for page in self.iter_chunks():
+            self.lexical_index.add([chunk['id'] for chunk in page], page)
+    
+    @staticmethod
+    def _chunk_ids(chunks: list[dict[str, Any]], seen: dict[str, int] = None) -> list[str]:
+        """Derive stable ids for chunks from their source and content.
+        
+        Identical chunks within the same source file are told apart by their order of occurrence.
         
         Args:
             chunks: List of chunk dictionaries with 'content' and 'metadata'.
+            (optional) seen: Occurrence counts carried over from earlier batches of the same add. Default is None.
             
         Returns:
-            None.
+            List of chunk ids.
+        """
+        ids = []
+        seen = {} if seen is None else seen
+        for chunk in chunks:
+            source = chunk.get('metadata', {}).get('filename', '')
+            digest = hashlib.sha256(f"{source}\x00{chunk['content']}".encode('utf-8')).hexdigest()[:32]
+            occurrence = seen.get(digest, 0)
+            seen[digest] = occurrence + 1
+            ids.append(digest if occurrence == 0 else f"{digest}-{occurrence}")
+        return ids
+    
+    @staticmethod
+    def _batched(chunks: Iterable[dict[str, Any]], batch_size: int) -> Iterator[list[dict[str, Any]]]:
+        """Split an iterable of chunks into lists of at most batch_size chunks.
+        
+        Args:
+            chunks: Iterable of chunk dictionaries.
+            batch_size: Maximum number of chunks per batch.
+            
+        Returns:
+            Iterator over batches of chunks.
+        """
+        iterator = iter(chunks)
+        while batch := list(islice(iterator, batch_size)):
+            yield batch
+    
+    def _embed_batch(self, documents: list[str]) -> tuple[list[Any], float]:
+        """Compute embeddings for a batch of documents.
+        
+        Args:
+            documents: List of chunk texts.
+            
+        Returns:
+            Tuple containing the embeddings and the seconds spent computing them.
         """
-        if not chunks:
+        start = perf_counter()
+        embeddings = self.embedding_function(documents)
+        return embeddings, perf_counter() - start
+    
+    def add_chunks(self, chunks: Iterable[dict[str, Any]], batch_size: int = None, replace_sources: list[str] = None, metadata_updates: Callable[[], tuple[list[str], list[dict[str, Any]]]] = None) -> dict[str, Any]:
+        """Add document chunks to the vector store in batches.
+        
+        Chunks are streamed into the backend batch by batch. Embeddings for the next batch are computed on a background thread while the previous batch is inserted.
+        
+        With replace_sources, every chunk is embedded before any is inserted. The old chunks of those files are then deleted and the new ones inserted while searches wait, so a search sees either the old or the new version of a file, never both or neither.
+        
+        Args:
+            chunks: Iterable of chunk dictionaries with 'content' and 'metadata'.
+            (optional) batch_size: Number of chunks per batch. Default is None, which uses the store's batch size.
+            (optional) replace_sources: Filenames whose chunks the new chunks replace in one atomic swap. Default is None, which inserts each batch as soon as it is embedded.
+            (optional) metadata_updates: Function called once every chunk was read, returning the ids and new metadata of chunks whose metadata changed meanwhile, e.g. canonical chunks that near-duplicates were folded into. The updates are applied together with the last insert, inside the swap if there is one. Default is None.
+            
+        Returns:
+            Dictionary with the number of chunks added, total, embedding and insert seconds, chunks per second, and the seconds searches were held up by the swap.
+        """
+        stats = {"chunks": 0, "seconds": 0.0, "embed_seconds": 0.0, "insert_seconds": 0.0, "per_second": 0.0, "swap_seconds": 0.0}
+        batch_size = min(batch_size or self.batch_size, self.backend.max_batch_size)
+        seen = {}
+        staged = []
+        start = perf_counter()
+        
+        with ThreadPoolExecutor(max_workers = 1) as executor:
+            pending = None
+            for batch in self._batched(chunks, batch_size):
+                future = executor.submit(self._embed_batch, [chunk['content'] for chunk in batch])
+                if pending is not None:
+                    self._add_batch(pending, seen, stats, staged, replace_sources)
+                pending = (batch, future)
+            if pending is not None:
+                self._add_batch(pending, seen, stats, staged, replace_sources)
+            for _, future in staged:
+                future.result()
+        
+        swap_start = perf_counter()
+        with self.swap_lock.writing():
+            if replace_sources is not None:
+                self._delete_sources(replace_sources)
+            inserted = set()
+            for pending in staged:
+                inserted.update(self._insert_batch(*pending, seen, stats))
+            if metadata_updates is not None:
+                # Staged chunks are inserted with their final metadata already
+                ids, metadatas = [], []
+                for chunk_id, metadata in zip(*metadata_updates()):
+                    if chunk_id not in inserted:
+                        ids.append(chunk_id)
+                        metadatas.append(metadata)
+                self._update_metadata(ids, metadatas)
+            self.backend.flush()
+        if replace_sources is not None:
+            stats["swap_seconds"] = perf_counter() - swap_start
+        
+        stats["seconds"] = perf_counter() - start
+        if stats["chunks"] == 0:
             print("No chunks provided to add to the vector store")
-            return
+        elif stats["seconds"] > 0:
+            stats["per_second"] = stats["chunks"] / stats["seconds"]
+        return stats
+    
+    def _add_batch(self, pending: tuple[list[dict[str, Any]], Any], seen: dict[str, int], stats: dict[str, Any], staged: list[tuple[list[dict[str, Any]], Any]], replace_sources: list[str]) -> None:
+        """Insert a batch right away, or stage it for the atomic swap if files are being replaced.
         
-        ids = [f"chunk_{i}" for i in range(len(chunks))]
-        documents = [chunk['content'] for chunk in chunks]
-        metadatas = [chunk.get('metadata', {}) for chunk in chunks]
+        Args:
+            pending: The batch and the future resolving to its embeddings.
+            seen: Occurrence counts used to derive chunk ids, shared across batches.
+            stats: Statistics dictionary to update.
+            staged: Batches waiting for the swap.
+            replace_sources: Filenames being replaced, or None.
+            
+        Returns:
+            None.
+        """
+        if replace_sources is not None:
+            staged.append(pending)
+            return
+        with self.swap_lock.writing():
+            self._insert_batch(*pending, seen, stats)
+    
+    def _insert_batch(self, batch: list[dict[str, Any]], embedding_future: Any, seen: dict[str, int], stats: dict[str, Any]) -> list[str]:
+        """Insert one embedded batch of chunks into the backend.
         
-        self.collection.add(
-            documents = documents,
-            metadatas = metadatas,
+        Args:
+            batch: List of chunk dictionaries.
+            embedding_future: Future resolving to the batch's embeddings and embedding time.
+            seen: Occurrence counts used to derive chunk ids, shared across batches.
+            stats: Statistics dictionary to update.
+            
+        Returns:
+            Ids of the inserted chunks.
+        """
+        embeddings, embed_seconds = embedding_future.result()
+        ids = self._chunk_ids(batch, seen)
+        start = perf_counter()
+        self.backend.upsert(
+            documents = [chunk['content'] for chunk in batch],
+            metadatas = [chunk.get('metadata', {}) for chunk in batch],
+            embeddings = embeddings,
             ids = ids
         )
+        if self.lexical_index is not None:
+            self.lexical_index.add(ids, batch)
+        stats["insert_seconds"] += perf_counter() - start
+        stats["embed_seconds"] += embed_seconds
+        stats["chunks"] += len(batch)
+        return ids
     
-    def search(self, query: str, n_results: int = 3) -> list[Any]:
+    def delete_sources(self, sources: list[str]) -> None:
+        """Remove every chunk that came from the given source files.
+        
+        Args:
+            sources: Filenames whose chunks should be removed.
+            
+        Returns:
+            None.
+        """
+        if not sources:
+            return
+        
+        with self.swap_lock.writing():
+            self._delete_sources(sources)
+            self.backend.flush()
+    
+    def _delete_sources(self, sources: list[str]) -> None:
+        """Remove the chunks of the given source files without flushing. The caller holds swap_lock for writing.
+        
+        Args:
+            sources: Filenames whose chunks should be removed.
+            
+        Returns:
+            None.
+        """
+        if not sources:
+            return
+        
+        self.backend.delete_sources(sources)
+        if self.lexical_index is not None:
+            self.lexical_index.remove_sources(sources)
+    
+    def update_metadata(self, ids: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """Replace the metadata of chunks already in the store.
+        
+        Args:
+            ids: Ids of the chunks.
+            metadatas: New metadata of each chunk.
+            
+        Returns:
+            None.
+        """
+        if not ids:
+            return
+        
+        with self.swap_lock.writing():
+            self._update_metadata(ids, metadatas)
+            self.backend.flush()
+    
+    def _update_metadata(self, ids: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """Replace the metadata of chunks without flushing. The caller holds swap_lock for writing.
+        
+        Args:
+            ids: Ids of the chunks.
+            metadatas: New metadata of each chunk.
+            
+        Returns:
+            None.
+        """
+        if not ids:
+            return
+        
+        self.backend.update_metadata(list(ids), list(metadatas))
+        if self.lexical_index is not None:
+            self.lexical_index.update_metadata(list(ids), list(metadatas))
+    
+    def embed_query(self, query: str) -> Any:
+        """Embed a query, reusing the cached embedding if the same query was embedded before.
+        
+        Args:
+            query: The query string.
+            
+        Returns:
+            The query embedding.
+        """
+        with tracing.span("query_embedding"):
+            return self.query_cache.get(query)
+    
+    def embed_queries(self, queries: list[str]) -> list[Any]:
+        """Embed several queries, computing all uncached embeddings in one batch.
+        
+        Args:
+            queries: List of query strings.
+            
+        Returns:
+            List of query embeddings in the same order as the queries.
+        """
+        with tracing.span("query_embedding", queries = len(queries)):
+            return self.query_cache.get_many(queries)
+    
+    def get_chunks(self, ids: list[str], query_embedding: Any = None) -> list[Any]:
+        """Fetch chunks by id.
+        
+        Args:
+            ids: Ids of the chunks to fetch.
+            (optional) query_embedding: Embedding to measure each chunk's distance from, using the same squared L2 distance as search(). Default is None.
+            
+        Returns:
+            List of results with id, content and metadata, plus 'distance' and 'embedding' if query_embedding was given.
+        """
+        if not ids:
+            return []
+        
+        page = self.backend.get(ids = list(ids), include_embeddings = query_embedding is not None)
+        
+        formatted_results = []
+        for i, chunk_id in enumerate(page['ids']):
+            result = {
+                'id': chunk_id,
+                'content': page['documents'][i],
+                'metadata': page['metadatas'][i]
+            }
+            if query_embedding is not None:
+                difference = np.asarray(page['embeddings'][i], dtype = np.float32) - np.asarray(query_embedding, dtype = np.float32)
+                result['distance'] = float(difference @ difference)
+                result['embedding'] = page['embeddings'][i]
+            formatted_results.append(result)
+        
+        return formatted_results
+    
+    def search(self, query: str, n_results: int = 3, query_embedding: Any = None, include_embeddings: bool = False, ann_effort: int = None, where: dict[str, Any] = None) -> list[Any]:
         """Search for relevant chunks.
         
         Args:
             query: The query string.
             (optional) n_results: Number of top relevant results to return. Default is 3.
+            (optional) query_embedding: Precomputed embedding of the query. Default is None, which looks it up in the query embedding cache.
+            (optional) include_embeddings: Also return each chunk's stored 'embedding'. Default is False.
+            (optional) ann_effort: Search effort for this query, trading latency for recall: IVF clusters probed (mmap backend) or ef_search (Chroma). Default is None, which uses the store's default.
+            (optional) where: Metadata filter with ChromaDB's where operators, e.g. {"filename": {"$in": ["google_faq.txt"]}} or {"$and": [{"file_type": ".pdf"}, {"page": {"$lte": 3}}]}. Only matching chunks are scored. Default is None, which searches every chunk.
             
         Returns:
             List of results with content and metadata.
         """
-        results = self.collection.query(
-            query_texts = [query],
-            n_results = n_results
-        )
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        
+        return self.search_batch([query], n_results, [query_embedding], include_embeddings, ann_effort, where)[0]
+    
+    def search_batch(self, queries: list[str], n_results: int = 3, query_embeddings: list[Any] = None, include_embeddings: bool = False, ann_effort: int = None, where: dict[str, Any] = None) -> list[list[Any]]:
+        """Search for relevant chunks for several queries with a single backend query.
+        
+        Args:
+            queries: List of query strings.
+            (optional) n_results: Number of top relevant results to return per query. Default is 3.
+            (optional) query_embeddings: Precomputed embeddings of the queries. Default is None, which embeds all uncached queries in one batch.
+            (optional) include_embeddings: Also return each chunk's stored 'embedding'. Default is False.
+            (optional) ann_effort: Search effort for these queries. Default is None, which uses the store's default.
+            (optional) where: Metadata filter applied to every query, as in search(). Default is None.
+            
+        Returns:
+            One list of results with content and metadata per query.
+            
+        Raises:
+            ValueError: If the filter uses an unknown operator or is malformed.
+        """
+        if not queries:
+            return []
+        if query_embeddings is None:
+            query_embeddings = self.embed_queries(queries)
+        where = MetadataIndex.normalize(where)
+        
+        with tracing.span("vector_search", n_results = n_results, filtered = where is not None):
+            results = self.backend.query(list(query_embeddings), n_results, include_embeddings, ann_effort, where)
+        
+        return [self._format_results(results, i) for i in range(len(queries))]
+    
+    @staticmethod
+    def _format_results(results: dict[str, Any], index: int) -> list[Any]:
+        """Format the results of one query from a backend query.
         
+        Args:
+            results: Result of the backend's query().
+            index: Position of the query within the backend query.
+            
+        Returns:
+            List of results with content and metadata.
+        """
         formatted_results = []
         if results and results['documents'] and results['metadatas']:
-            documents = results['documents'][0]
-            metadatas = results['metadatas'][0]
-            distances = results.get('distances', [[]])[0]
+            ids = results['ids'][index]
+            documents = results['documents'][index]
+            metadatas = results['metadatas'][index]
+            distances = (results.get('distances') or [[]] * (index + 1))[index]
+            embeddings = results.get('embeddings')
+            embeddings = embeddings[index] if embeddings is not None else None
             
             for i, (doc, meta) in enumerate(zip(documents, metadatas)):
                 result = {
+                    'id': ids[i],
                     'content': doc,
                     'metadata': meta
                 }
                 if distances:
                     result['distance'] = distances[i]
+                if embeddings is not None:
+                    result['embedding'] = embeddings[i]
                 formatted_results.append(result)
         
-        return formatted_results
\ No newline at end of file
+        return formatted_results
+
+class ReadWriteLock:
+    def __init__(self):
+        """Initialize a lock that any number of readers, or one writer, can hold at a time.
+        
+        Waiting writers go before new readers, so a steady stream of searches cannot hold off an index update.
+        """
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+    
+    @contextmanager
+    def reading(self) -> Iterator[None]:
+        """Hold the lock for reading.
+        
+        Returns:
+            Context manager.
+        """
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+    
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """Hold the lock for writing.
+        
+        Returns:
+            Context manager.
+        """
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
@@ -0,0 +1,159 @@
+import os
+import json
+import hashlib
+from typing import Any
+
+class IndexManifest:
+    def __init__(self, path: str = None):
+        """Initialize the manifest that tracks which files are present in the index.
+
+        Args:
+            (optional) path: Path of the JSON file the manifest is stored in. Default is None, which keeps the manifest in memory only.
+        """
+        self.path = path
+        self.files = self._load()
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        """Load the manifest from disk.
+
+        Returns:
+            Dictionary mapping filenames to their fingerprints. Empty if no manifest exists yet.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding = 'utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error while reading index manifest, rebuilding index:\n{e}")
+            return {}
+
+    def save(self) -> None:
+        """Write the manifest to disk atomically. Does nothing if no path was given.
+
+        Returns:
+            None.
+        """
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding = 'utf-8') as f:
+            json.dump(self.files, f, indent = 2)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        """Compute the SHA-256 hash of a file's contents.
+
+        Args:
+            file_path: Path of the file to hash.
+
+        Returns:
+            Hex digest of the file contents.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def fingerprint(self, file_path: str) -> dict[str, Any]:
+        """Fingerprint a file by path, modification time, size and content hash.
+
+        The content hash is reused from the manifest when the modification time and size are unchanged, so unchanged files are never re-read.
+
+        Args:
+            file_path: Path of the file to fingerprint.
+
+        Returns:
+            Dictionary with 'path', 'mtime', 'size' and 'sha256'.
+        """
+        stat = os.stat(file_path)
+        previous = self.files.get(os.path.basename(file_path))
+        if previous and previous['mtime'] == stat.st_mtime and previous['size'] == stat.st_size:
+            sha256 = previous['sha256']
+        else:
+            sha256 = self.hash_file(file_path)
+        return {
+            'path': os.path.abspath(file_path),
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha256': sha256
+        }
+
+    def scan(self, data_dir: str) -> dict[str, dict[str, Any]]:
+        """Fingerprint every file in a directory.
+
+        Args:
+            data_dir: Directory to scan.
+
+        Returns:
+            Dictionary mapping filenames to their fingerprints.
+        """
+        return {
+            filename: self.fingerprint(os.path.join(data_dir, filename))
+            for filename in sorted(os.listdir(data_dir))
+            if os.path.isfile(os.path.join(data_dir, filename))
+        }
+
+    def diff(self, current: dict[str, dict[str, Any]]) -> tuple[list[str], list[str]]:
+        """Compare a fresh scan against the manifest.
+
+        Args:
+            current: Result of scan().
+
+        Returns:
+            Tuple containing the filenames that are new or changed and the filenames that were deleted.
+        """
+        changed = [
+            filename for filename, fingerprint in current.items()
+            if filename not in self.files or self.files[filename]['sha256'] != fingerprint['sha256']
+        ]
+        deleted = [filename for filename in self.files if filename not in current]
+        return changed, deleted
+
+    def linked(self, filenames: list[str]) -> list[str]:
+        """Find the files that share deduplicated chunks with the given files, directly or through other files.
+
+        A chunk that occurs in several files is stored once under one of them, so these files have to be re-indexed together.
+
+        Args:
+            filenames: Filenames to start from.
+
+        Returns:
+            Sorted filenames linked to the given ones, not including them.
+        """
+        found = set(filenames)
+        pending = list(filenames)
+        while pending:
+            for other in self.files.get(pending.pop(), {}).get('linked', []):
+                if other not in found:
+                    found.add(other)
+                    pending.append(other)
+        return sorted(found - set(filenames))
+
+    def update(self, current: dict[str, dict[str, Any]], changed: list[str], links: dict[str, list[str]] = None, failed: list[str] = None) -> None:
+        """Record the files in the index after a sync and save the manifest.
+
+        Args:
+            current: Result of scan().
+            changed: Filenames that were re-indexed.
+            (optional) links: Files each file shares chunks deduplicated during the sync with. They replace the links of re-indexed files and are added to those of the other files. Default is None.
+            (optional) failed: Re-indexed files that produced no documents. They are left out, so the next diff() reports them as new and they are retried. Default is None.
+
+        Returns:
+            None.
+        """
+        links, failed = links or {}, set(failed or [])
+        files = {}
+        for filename, fingerprint in current.items():
+            if filename in failed:
+                continue
+            if filename in changed:
+                linked = links.get(filename)
+            else:
+                # An unchanged file gains links when a re-indexed file duplicates its chunks
+                linked = sorted(set(self.files.get(filename, {}).get('linked') or []) | set(links.get(filename, [])))
+            files[filename] = {**fingerprint, 'linked': linked} if linked else dict(fingerprint)
+        self.files = files
+        self.save()
@@ -0,0 +1,112 @@
+from typing import Any, Callable
+from time import monotonic
+import threading
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+
+class IndexWatcher(FileSystemEventHandler):
+    def __init__(self, data_dir: str, on_change: Callable[[], Any], debounce_seconds: float = 1.0, max_delay_seconds: float = 10.0):
+        """Initialize the watcher that re-indexes the data directory when files in it are created, modified, moved or deleted.
+
+        Changes are debounced: a pass starts once no change was seen for debounce_seconds, so copying hundreds of files triggers a single pass. Changes made while a pass runs trigger one more pass after it.
+
+        Args:
+            data_dir: Directory to watch.
+            on_change: Function that brings the index up to date, called on the watcher's thread.
+            (optional) debounce_seconds: Seconds without changes to wait before a pass. Default is 1.0.
+            (optional) max_delay_seconds: Seconds after the first change by which a pass starts even if changes keep coming. Default is 10.0.
+        """
+        self.data_dir = data_dir
+        self.on_change = on_change
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.passes = 0
+        self._condition = threading.Condition()
+        self._first_change = None
+        self._last_change = None
+        self._paths = set()
+        self._stopped = False
+        self._observer = None
+        self._thread = None
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        """Record a change reported by watchdog.
+
+        Args:
+            event: The file system event.
+
+        Returns:
+            None.
+        """
+        if event.is_directory or event.event_type in ("opened", "closed_no_write"):
+            return
+        with self._condition:
+            now = monotonic()
+            self._first_change = self._first_change or now
+            self._last_change = now
+            self._paths.update(path for path in (event.src_path, getattr(event, "dest_path", "")) if path)
+            self._condition.notify_all()
+
+    def _next_batch(self) -> set[str]:
+        """Wait until a batch of changes has settled.
+
+        Returns:
+            The changed paths, or None once the watcher is stopped.
+        """
+        with self._condition:
+            while not self._stopped:
+                if self._first_change is None:
+                    self._condition.wait()
+                    continue
+                now = monotonic()
+                due = min(self._last_change + self.debounce_seconds, self._first_change + self.max_delay_seconds)
+                if now >= due:
+                    paths, self._paths = self._paths, set()
+                    self._first_change = self._last_change = None
+                    return paths
+                self._condition.wait(due - now)
+            return None
+
+    def _run(self) -> None:
+        """Re-index after every batch of changes until stopped.
+
+        Returns:
+            None.
+        """
+        while (paths := self._next_batch()) is not None:
+            print(f"\nWatcher: {len(paths)} changed path(s) in {self.data_dir}, re-indexing...")
+            try:
+                self.on_change()
+            except Exception as e:
+                # A file may vanish or still be written during the pass; its next change event triggers another one
+                print(f"Watcher: re-indexing failed:\n{e}")
+            self.passes += 1
+
+    def start(self) -> "IndexWatcher":
+        """Start watching on background threads.
+
+        Returns:
+            The watcher.
+        """
+        self._observer = Observer()
+        self._observer.schedule(self, self.data_dir, recursive = False)
+        self._observer.daemon = True
+        self._observer.start()
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop watching. A pass that is running is finished first.
+
+        Returns:
+            None.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread is not None:
+            self._thread.join()
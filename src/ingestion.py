@@ -0,0 +1,150 @@
+import os
+from time import perf_counter
+from typing import Any, Callable, Iterable, Iterator
+
+from document_loader import DocumentLoader
+from embeddings import VectorStore
+from deduplication import ChunkDeduplicator
+
+class IngestionPipeline:
+    def __init__(self, loader: DocumentLoader, vector_store: VectorStore, batch_size: int = None, workers: int = None, chunk_size: int = 1000, chunk_overlap: int = 200, dedup_threshold: float = None):
+        """Initialize the streaming ingestion pipeline.
+
+        Files flow through discover -> load -> chunk -> (dedup) -> embed + add lazily. The vector store pulls chunks one bounded batch at a time, so peak memory does not grow with the corpus.
+
+        Args:
+            loader: DocumentLoader instance used to discover, load and chunk files.
+            vector_store: VectorStore instance the chunks are added to.
+            (optional) batch_size: Number of chunks embedded and added per batch. Default is None, which uses the vector store's batch size.
+            (optional) workers: Number of processes used to load and parse files. Default is None, which uses the number of CPUs.
+            (optional) chunk_size: Maximum size of each chunk. Default is 1000 characters.
+            (optional) chunk_overlap: Overlap between chunks. Default is 200 characters.
+            (optional) dedup_threshold: Similarity at which chunks count as near-duplicates of each other or of an already indexed chunk and are only embedded once, e.g. 0.9. Default is None, which keeps every chunk.
+        """
+        self.loader = loader
+        self.vector_store = vector_store
+        self.batch_size = batch_size
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.dedup_threshold = dedup_threshold
+
+    @staticmethod
+    def _timed(iterable: Iterable[Any], stage: dict[str, Any]) -> Iterator[Any]:
+        """Wrap an iterator and accumulate the time spent producing its items.
+
+        The recorded time includes the time spent in upstream stages; run() subtracts it afterwards.
+
+        Args:
+            iterable: The iterable to wrap.
+            stage: Stage statistics dictionary to update.
+
+        Returns:
+            Iterator over the same items.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                stage["seconds"] += perf_counter() - start
+                return
+            stage["seconds"] += perf_counter() - start
+            stage["items"] += 1
+            yield item
+
+    @staticmethod
+    def _record(iterable: Iterable[Any], seen: set, key: Callable[[Any], Any] = None) -> Iterator[Any]:
+        """Wrap an iterator and add every item, or its key, to a set.
+
+        Args:
+            iterable: The iterable to wrap.
+            seen: Set the items are added to.
+            (optional) key: Function mapping an item to the value added. Default is None, which adds the item itself.
+
+        Returns:
+            Iterator over the same items.
+        """
+        for item in iterable:
+            seen.add(item if key is None else key(item))
+            yield item
+
+    def run(self, filenames: list[str] = None, replace_sources: list[str] = None) -> dict[str, dict[str, Any]]:
+        """Ingest files into the vector store.
+
+        When specific files are ingested with deduplication, their chunks are also compared against the chunks of the other files already in the store, and those chunks' 'sources' are extended in the same swap as the new chunks are added.
+
+        Args:
+            (optional) filenames: Names of the files inside the data directory to ingest. Default is None, which ingests every file.
+            (optional) replace_sources: Filenames whose existing chunks are swapped for the new chunks atomically once all of them are embedded. Default is None, which adds chunks batch by batch.
+
+        Returns:
+            Dictionary mapping each stage to its item count, exclusive wall-clock seconds and throughput. The "load" stage also lists the files of a supported type that produced no documents ("failed"), e.g. because they could not be parsed. The "dedup" stage also reports the duplicates dropped, the fraction of chunks dropped, the estimated embedding seconds saved and the files each file shares chunks with ("links").
+        """
+        deduplicator = ChunkDeduplicator(self.dedup_threshold) if self.dedup_threshold else None
+        stats = {
+            "discover": {"items": 0, "seconds": 0.0, "unit": "files"},
+            "load": {"items": 0, "seconds": 0.0, "unit": "files"},
+            "chunk": {"items": 0, "seconds": 0.0, "unit": "chunks"},
+            **({"dedup": {"items": 0, "seconds": 0.0, "unit": "chunks"}} if deduplicator is not None else {}),
+            "embed_add": {"items": 0, "seconds": 0.0, "unit": "chunks"}
+        }
+
+        seed_seconds = 0.0
+        if deduplicator is not None and filenames is not None:
+            seed_start = perf_counter()
+            # The files being ingested are replaced, so only the other files' chunks can be canonical
+            replaced = set(filenames) | set(replace_sources or [])
+            for page in self.vector_store.iter_chunks():
+                deduplicator.add_existing(chunk for chunk in page if chunk['metadata'].get('filename') not in replaced)
+            seed_seconds = perf_counter() - seed_start
+
+        discovered_files, loaded_files = set(), set()
+        discovered = self._timed(self._record(self.loader.discover(filenames), discovered_files), stats["discover"])
+        loaded = self._timed(self.loader.iter_documents(discovered, self.workers), stats["load"])
+        documents = self._record((doc for file_docs in loaded for doc in file_docs), loaded_files, lambda doc: doc['metadata'].get('filename'))
+        chunks = self._timed(self.loader.iter_chunks(documents, self.chunk_size, self.chunk_overlap), stats["chunk"])
+        if deduplicator is not None:
+            chunks = self._timed(deduplicator.filter(chunks), stats["dedup"])
+
+        added = self.vector_store.add_chunks(chunks, self.batch_size, replace_sources, deduplicator.updates if deduplicator is not None else None)
+        stats["embed_add"]["items"] = added["chunks"]
+        stats["embed_add"]["seconds"] = added["seconds"]
+        stats["embed_add"]["embed_seconds"] = added["embed_seconds"]
+        stats["embed_add"]["insert_seconds"] = added["insert_seconds"]
+        stats["embed_add"]["swap_seconds"] = added["swap_seconds"]
+
+        # Each upstream stage's time is included in the stage consuming it
+        if deduplicator is not None:
+            stats["embed_add"]["seconds"] -= stats["dedup"]["seconds"]
+            stats["dedup"]["seconds"] -= stats["chunk"]["seconds"]
+            stats["dedup"]["seconds"] += seed_seconds
+        else:
+            stats["embed_add"]["seconds"] -= stats["chunk"]["seconds"]
+        stats["chunk"]["seconds"] -= stats["load"]["seconds"]
+        stats["load"]["seconds"] -= stats["discover"]["seconds"]
+        stats["load"]["failed"] = sorted(
+            filename for filename in discovered_files - loaded_files
+            if os.path.splitext(filename)[1].lower() in DocumentLoader.SUPPORTED_EXTENSIONS
+        )
+
+        for name, stage in stats.items():
+            stage["per_second"] = stage["items"] / stage["seconds"] if stage["seconds"] > 0 else 0.0
+            print(f"Ingestion {name}: {stage['items']} {stage['unit']} in {stage['seconds']:.2f}s ({stage['per_second']:.1f} {stage['unit']}/s)")
+
+        if deduplicator is not None:
+            summary = deduplicator.summary()
+            # Dropped chunks would have cost as much to embed as the kept ones did on average
+            embed_seconds_saved = summary["duplicates"] * added["embed_seconds"] / added["chunks"] if added["chunks"] else 0.0
+            stats["dedup"].update(
+                duplicates = summary["duplicates"],
+                reduction = summary["reduction"],
+                duplicate_chars = summary["duplicate_chars"],
+                embed_seconds_saved = embed_seconds_saved,
+                links = summary["links"]
+            )
+            if summary["duplicates"]:
+                print(f"Ingestion dedup: {summary['duplicates']} of {summary['chunks']} chunks were near-duplicates, index {summary['reduction']:.1%} smaller, ~{embed_seconds_saved:.2f}s of embedding saved.")
+
+        return stats
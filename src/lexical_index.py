@@ -0,0 +1,180 @@
+import re
+import math
+import threading
+from collections import Counter, defaultdict
+from typing import Any
+from metadata_index import MetadataIndex
+
+class LexicalIndex:
+    TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """Initialize the in-process inverted index scored with BM25.
+
+        Args:
+            (optional) k1: BM25 term frequency saturation. Default is 1.5.
+            (optional) b: BM25 document length normalization. Default is 0.75.
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.doc_lengths = {}
+        self.doc_terms = {}
+        self.source_ids = defaultdict(set)
+        self.chunk_sources = {}
+        self.metadata = MetadataIndex()
+        self.total_length = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def tokenize(cls, text: str) -> list[str]:
+        """Split text into lowercase alphanumeric terms.
+
+        Args:
+            text: Text to tokenize.
+
+        Returns:
+            List of terms.
+        """
+        return cls.TOKEN_PATTERN.findall(text.lower())
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, ids: list[str], chunks: list[dict[str, Any]]) -> None:
+        """Index chunks, replacing any chunks already indexed under the same ids.
+
+        Args:
+            ids: Chunk ids, as stored in the vector store.
+            chunks: List of chunk dictionaries with 'content' and 'metadata'.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            for chunk_id, chunk in zip(ids, chunks):
+                self._remove(chunk_id)
+                terms = Counter(self.tokenize(chunk['content']))
+                for term, frequency in terms.items():
+                    self.postings[term][chunk_id] = frequency
+                length = sum(terms.values())
+                self.doc_lengths[chunk_id] = length
+                self.doc_terms[chunk_id] = list(terms)
+                self.total_length += length
+                self._set_source(chunk_id, chunk.get('metadata', {}).get('filename'))
+                self.metadata.add([chunk_id], [chunk.get('metadata', {})])
+
+    def _set_source(self, chunk_id: str, source: str) -> None:
+        """Record the source file of a chunk, moving it out of its previous source's ids.
+
+        Args:
+            chunk_id: Id of the chunk.
+            source: Filename the chunk now belongs to.
+
+        Returns:
+            None.
+        """
+        previous = self.chunk_sources.get(chunk_id)
+        if previous in self.source_ids and previous != source:
+            self.source_ids[previous].discard(chunk_id)
+            if not self.source_ids[previous]:
+                del self.source_ids[previous]
+        self.chunk_sources[chunk_id] = source
+        self.source_ids[source].add(chunk_id)
+
+    def _remove(self, chunk_id: str) -> None:
+        """Remove one chunk from the index, if present.
+
+        Args:
+            chunk_id: Id of the chunk to remove.
+
+        Returns:
+            None.
+        """
+        if chunk_id not in self.doc_lengths:
+            return
+        for term in self.doc_terms.pop(chunk_id):
+            postings = self.postings[term]
+            postings.pop(chunk_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(chunk_id)
+        self.metadata.remove([chunk_id])
+        source = self.chunk_sources.pop(chunk_id, None)
+        if source in self.source_ids:
+            self.source_ids[source].discard(chunk_id)
+            if not self.source_ids[source]:
+                del self.source_ids[source]
+
+    def remove(self, ids: list[str]) -> None:
+        """Remove chunks from the index.
+
+        Args:
+            ids: Ids of the chunks to remove.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            for chunk_id in ids:
+                self._remove(chunk_id)
+
+    def update_metadata(self, ids: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """Replace the metadata filters are matched against for indexed chunks.
+
+        Args:
+            ids: Chunk ids.
+            metadatas: New metadata of each chunk.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            known = [(chunk_id, metadata) for chunk_id, metadata in zip(ids, metadatas) if chunk_id in self.doc_lengths]
+            for chunk_id, metadata in known:
+                self._set_source(chunk_id, metadata.get('filename'))
+            self.metadata.add([chunk_id for chunk_id, _ in known], [metadata for _, metadata in known])
+
+    def remove_sources(self, sources: list[str]) -> None:
+        """Remove every chunk that came from the given source files.
+
+        Args:
+            sources: Filenames whose chunks should be removed.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            for source in sources:
+                for chunk_id in self.source_ids.pop(source, set()):
+                    self._remove(chunk_id)
+
+    def search(self, query: str, k: int = 10, where: dict[str, Any] = None) -> list[tuple[str, float]]:
+        """Score indexed chunks against a query with BM25.
+
+        Args:
+            query: The query string.
+            (optional) k: Number of top results to return. Default is 10.
+            (optional) where: ChromaDB-style metadata filter the chunks must match. Default is None.
+
+        Returns:
+            List of (chunk id, score) pairs, best first.
+        """
+        with self._lock:
+            n = len(self.doc_lengths)
+            if n == 0:
+                return []
+            allowed = None if MetadataIndex.normalize(where) is None else self.metadata.keys(where)
+            average_length = self.total_length / n
+            scores = defaultdict(float)
+            for term in set(self.tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, frequency in postings.items():
+                    if allowed is not None and chunk_id not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / average_length)
+                    scores[chunk_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key = lambda item: item[1], reverse = True)[:k]
@@ -1,33 +1,51 @@
-from typing import Any
-from langchain_ollama import ChatOllama
+from typing import Any, AsyncIterator, Iterator
+from time import perf_counter
+import asyncio
+import weakref
 from langchain.prompts import PromptTemplate
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, AIMessageChunk
 from ollama import _types
+from urllib.parse import urlparse
 import shutil
 import re
+import tracing
+from llm_pool import OllamaBackend, BackendPool
 
 class LLMService:
-    def __init__(self, model_name: str = "gemma3:1b", base_url: str = "http://localhost:11434"):
+    def __init__(self, model_name: str | list[str] = "gemma3:1b", base_url: str | list[str] = "http://localhost:11434", max_concurrency: int = 4, deadline: float = 120.0, request_timeout: float = None, max_failures: int = 3, eject_seconds: float = 30.0, health_interval: float = 10.0):
         """Initialize the LLM service using LangChain and Ollama.
         
+        Several models and/or Ollama endpoints may be given. Every model is then used on every endpoint, and requests are spread across them by fewest outstanding requests. A failed request is retried on another backend until one answers or the deadline passes, and failing backends are ejected until a health check finds them working again.
+        
         Args:
-            (optional) model_name: Name of the Ollama model to use. Default is "gemma3:1b".
-            (optional) base_url: Base URL for the Ollama API. Default is "http://localhost:11434".
+            (optional) model_name: Name, or list of names, of the Ollama model to use. Default is "gemma3:1b".
+            (optional) base_url: Base URL, or list of base URLs, of the Ollama API. Default is "http://localhost:11434".
+            (optional) max_concurrency: Maximum number of async requests sent to each backend at once. Further requests wait for a free slot. Default is 4.
+            (optional) deadline: Seconds a request may take, including retries on other backends. Default is 120.0.
+            (optional) request_timeout: Seconds a single attempt may take. Default is None, which uses the deadline.
+            (optional) max_failures: Consecutive errors returned by a backend after which it is ejected. Backends that cannot be reached are ejected right away. Default is 3.
+            (optional) eject_seconds: Minimum seconds an ejected backend is left out. Default is 30.0.
+            (optional) health_interval: Seconds between health checks of the backends. Default is 10.0.
         """
-        self.model_name = model_name
-        self.base_url = base_url
+        self.model_names = [model_name] if isinstance(model_name, str) else list(model_name)
+        self.base_urls = [base_url] if isinstance(base_url, str) else list(base_url)
+        self.model_name = ", ".join(self.model_names)
+        self.base_url = self.base_urls[0]
+        self.deadline = deadline
+        self._semaphores = weakref.WeakKeyDictionary()
         
-        if shutil.which("ollama") is None:
+        if any(urlparse(url).hostname in ("localhost", "127.0.0.1") for url in self.base_urls) and shutil.which("ollama") is None:
             print("Could not detect Ollama. Please install it from https://ollama.com/download or add it to PATH.")
             print("(I tried to find it using the name 'ollama'. Please rename the PATH variable to 'ollama' if it has a different name.)")
             exit(1)
         
-        self.llm = ChatOllama(
-            model = model_name,
-            base_url = base_url,
-            temperature = 0.2,
-            num_predict = 500
+        self.pool = BackendPool(
+            [OllamaBackend(url, model, request_timeout or deadline, max_concurrency) for url in self.base_urls for model in self.model_names],
+            max_failures = max_failures,
+            eject_seconds = eject_seconds,
+            health_interval = health_interval
         )
+        self.max_concurrency = max_concurrency * len(self.pool.backends)
         
         self.qa_with_context_template = PromptTemplate(
             input_variables = ["context", "question"],
@@ -49,6 +67,54 @@ class LLMService:
             )
         )
     
+    def warm_up(self) -> bool:
+        """Load the model into memory on every Ollama backend, so the first query does not wait for it.
+        
+        Meant to run on a background thread while the rest of the system starts.
+        
+        Returns:
+            True if the model was loaded on at least one backend, False if none could be reached or has the model.
+        """
+        from ollama import Client
+        
+        loaded = False
+        for backend in self.pool.backends:
+            try:
+                # A generate request without a prompt only loads the model
+                Client(host = backend.base_url).generate(model = backend.model_name, prompt = "")
+                loaded = True
+            except Exception:
+                continue
+        return loaded
+    
+    def backend_stats(self) -> list[dict[str, Any]]:
+        """Get the health, load and latency of every backend.
+        
+        Returns:
+            List of per-backend statistics dictionaries.
+        """
+        return self.pool.stats()
+    
+    def _backends(self, deadline: float) -> Iterator[OllamaBackend]:
+        """Pick the backends to try for one request, each at most once, until the deadline passes.
+        
+        Every backend yielded is counted as outstanding until the caller releases it with self.pool.release().
+        
+        Args:
+            deadline: perf_counter() value after which no further attempt is made.
+            
+        Returns:
+            Iterator over the backends.
+        """
+        tried = []
+        while perf_counter() < deadline:
+            backend = self.pool.acquire(tried)
+            if backend is None:
+                return
+            tried.append(backend)
+            tracing.annotate(llm_backend = backend.name, llm_attempts = len(tried))
+            yield backend
+    
     def _remove_reasoning_tags(self, message: AIMessage) -> tuple[AIMessage, list[str]]:
         """Remove reasoning tags from the AI message.
         
@@ -63,6 +129,88 @@ class LLMService:
         message.content = re.sub(r'<think>.*?</think>', '', message.content, flags = re.DOTALL)
         return message, reason
     
+    def _build_prompt(self, query: str, context_chunks: list[dict[str, Any]] = None) -> tuple[PromptTemplate, Any]:
+        """Pick the prompt template and build its input for a query.
+        
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+            
+        Returns:
+            Tuple containing the prompt template, to be piped into a backend's model, and the input to invoke it with.
+        """
+        if context_chunks:
+            context_text = "\n\n".join([chunk['content'] for chunk in context_chunks])
+            return self.qa_with_context_template, {"context": context_text, "question": query}
+        return self.qa_without_context_template, query
+    
+    def _error_result(self, e: Exception) -> str:
+        """Turn an exception raised while calling the model into the error string returned to the agent.
+        
+        Args:
+            e: The exception raised, or None if no backend could be tried before the deadline.
+            
+        Returns:
+            The error message.
+        """
+        if e is None:
+            # Report why the backends last failed, so e.g. an ejected backend without the model still gives "Invalid model."
+            e = next((backend.last_exception for backend in self.pool.backends if backend.last_exception is not None), None)
+        if isinstance(e, _types.ResponseError):
+            s = "Invalid model."
+        else:
+            s = "Error while accessing LLM service. Please ensure the Ollama server is running by running 'ollama ps'.\n(Maybe the model is listening on a different port?)"
+        print(s)
+        return s
+    
+    def _limiter(self) -> asyncio.Semaphore:
+        """Get the concurrency limiter for the running event loop.
+        
+        Returns:
+            Semaphore bounding the number of in-flight async requests.
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+    
+    @staticmethod
+    def _stream_end_event(stripper: "ReasoningStripper", full: AIMessageChunk, start: float, first_token_time: float, token_count: int) -> dict[str, Any]:
+        """Build the final event of a streamed response.
+        
+        Args:
+            stripper: The ReasoningStripper the stream was fed through.
+            full: All streamed chunks added together, or None if nothing was streamed.
+            start: perf_counter() value when the request was sent.
+            first_token_time: perf_counter() value when the first chunk arrived, or None.
+            token_count: Number of chunks received.
+            
+        Returns:
+            The end event with the complete message, reasoning and timing.
+        """
+        end = perf_counter()
+        if first_token_time is not None:
+            tracing.record("llm_time_to_first_token", start, first_token_time)
+        tracing.record("llm_total", start, end)
+        tracing.record("reasoning_strip", end - stripper.seconds, end)
+        full = full or AIMessageChunk(content = "")
+        message = AIMessage(
+            content = stripper.content,
+            id = full.id,
+            response_metadata = full.response_metadata,
+            usage_metadata = full.usage_metadata
+        )
+        if full.usage_metadata:
+            token_count = full.usage_metadata.get("output_tokens", token_count)
+        generation_time = end - (first_token_time or end)
+        return {
+            "type": "end",
+            "result": message,
+            "reason": stripper.reasoning,
+            "time_to_first_token": None if first_token_time is None else first_token_time - start,
+            "tokens_per_second": token_count / generation_time if generation_time > 0 else None
+        }
+    
     def generate_response(self, query: str, context_chunks: list[dict[str, Any]] = None) -> str:
         """Generate a response using the Ollama model via LangChain.
         
@@ -74,24 +222,225 @@ class LLMService:
             Generated LLM response.
         """
         
-        llm = self.llm
         print(f"Loading response using the {self.model_name} model...\n")
-        try:
-            if context_chunks:
-                context_text = "\n\n".join([chunk['content'] for chunk in context_chunks])
-                prompt = self.qa_with_context_template
-                chain = prompt | llm
-                response = chain.invoke(input = {"context": context_text, "question": query})
-            else:
-                prompt = self.qa_without_context_template
-                chain = prompt | llm
-                response = chain.invoke(query)
-            return self._remove_reasoning_tags(response)
-        except _types.ResponseError as e:
-            s = "Invalid model."
-            print(s)
-            return s, None
-        except Exception as e:
-            s = "Error while accessing LLM service. Please ensure the Ollama server is running by running 'ollama ps'.\n(Maybe the model is listening on a different port?)"
-            print(s)
-            return s, None
\ No newline at end of file
+        with tracing.span("prompt_build"):
+            template, chain_input = self._build_prompt(query, context_chunks)
+        error = None
+        for backend in self._backends(perf_counter() + self.deadline):
+            start = perf_counter()
+            try:
+                with tracing.span("llm_total", backend = backend.name):
+                    response = (template | backend.llm).invoke(input = chain_input)
+            except Exception as e:
+                self.pool.release(backend, error = e)
+                error = e
+                continue
+            self.pool.release(backend, perf_counter() - start)
+            with tracing.span("reasoning_strip"):
+                return self._remove_reasoning_tags(response)
+        return self._error_result(error), None
+    
+    async def agenerate_response(self, query: str, context_chunks: list[dict[str, Any]] = None) -> str:
+        """Asynchronously generate a response, waiting for a free slot in the concurrency limiter.
+        
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+            
+        Returns:
+            Generated LLM response.
+        """
+        
+        async with self._limiter():
+            print(f"Loading response using the {self.model_name} model...\n")
+            with tracing.span("prompt_build"):
+                template, chain_input = self._build_prompt(query, context_chunks)
+            deadline = perf_counter() + self.deadline
+            error = None
+            for backend in self._backends(deadline):
+                start = perf_counter()
+                try:
+                    with tracing.span("llm_total", backend = backend.name):
+                        response = await asyncio.wait_for((template | backend.llm).ainvoke(input = chain_input), deadline - start)
+                except Exception as e:
+                    self.pool.release(backend, error = e)
+                    error = e
+                    continue
+                self.pool.release(backend, perf_counter() - start)
+                with tracing.span("reasoning_strip"):
+                    return self._remove_reasoning_tags(response)
+            return self._error_result(error), None
+    
+    def generate_response_stream(self, query: str, context_chunks: list[dict[str, Any]] = None) -> Iterator[dict[str, Any]]:
+        """Stream a response from the Ollama model token by token.
+        
+        Reasoning enclosed in <think>...</think> is stripped as the tokens arrive, so only the answer is streamed. A backend that fails before the first token is retried on another one; once tokens were streamed, a failure ends the stream with an error.
+        
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+            
+        Returns:
+            Iterator over events. Token events are {"type": "token", "content": str}. The last event is {"type": "end", "result": ..., "reason": ..., "time_to_first_token": ..., "tokens_per_second": ...}, where "result" is the complete AIMessage with reasoning removed, or an error string.
+        """
+        
+        print(f"Streaming response using the {self.model_name} model...\n")
+        stripper = ReasoningStripper()
+        full = None
+        start = perf_counter()
+        first_token_time = None
+        token_count = 0
+        with tracing.span("prompt_build"):
+            template, chain_input = self._build_prompt(query, context_chunks)
+        error = None
+        for backend in self._backends(start + self.deadline):
+            attempt_start = perf_counter()
+            try:
+                for chunk in (template | backend.llm).stream(input = chain_input):
+                    if first_token_time is None:
+                        first_token_time = perf_counter()
+                    token_count += 1
+                    full = chunk if full is None else full + chunk
+                    visible = stripper.feed(chunk.content)
+                    if visible:
+                        yield {"type": "token", "content": visible}
+                visible = stripper.flush()
+                if visible:
+                    yield {"type": "token", "content": visible}
+            except Exception as e:
+                self.pool.release(backend, error = e)
+                error = e
+                if first_token_time is not None:
+                    break
+                continue
+            except BaseException:
+                # The consumer stopped reading the stream
+                self.pool.release(backend)
+                raise
+            self.pool.release(backend, perf_counter() - attempt_start)
+            yield self._stream_end_event(stripper, full, start, first_token_time, token_count)
+            return
+        
+        yield {"type": "end", "result": self._error_result(error), "reason": None, "time_to_first_token": None, "tokens_per_second": None}
+    
+    async def agenerate_response_stream(self, query: str, context_chunks: list[dict[str, Any]] = None) -> AsyncIterator[dict[str, Any]]:
+        """Asynchronously stream a response token by token, waiting for a free slot in the concurrency limiter.
+        
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+            
+        Returns:
+            Async iterator over the same events as generate_response_stream().
+        """
+        
+        async with self._limiter():
+            print(f"Streaming response using the {self.model_name} model...\n")
+            stripper = ReasoningStripper()
+            full = None
+            start = perf_counter()
+            first_token_time = None
+            token_count = 0
+            with tracing.span("prompt_build"):
+                template, chain_input = self._build_prompt(query, context_chunks)
+            error = None
+            for backend in self._backends(start + self.deadline):
+                attempt_start = perf_counter()
+                try:
+                    async for chunk in (template | backend.llm).astream(input = chain_input):
+                        if first_token_time is None:
+                            first_token_time = perf_counter()
+                        token_count += 1
+                        full = chunk if full is None else full + chunk
+                        visible = stripper.feed(chunk.content)
+                        if visible:
+                            yield {"type": "token", "content": visible}
+                    visible = stripper.flush()
+                    if visible:
+                        yield {"type": "token", "content": visible}
+                except Exception as e:
+                    self.pool.release(backend, error = e)
+                    error = e
+                    if first_token_time is not None:
+                        break
+                    continue
+                except BaseException:
+                    # The consumer stopped reading the stream or the task was cancelled
+                    self.pool.release(backend)
+                    raise
+                self.pool.release(backend, perf_counter() - attempt_start)
+                yield self._stream_end_event(stripper, full, start, first_token_time, token_count)
+                return
+            
+            yield {"type": "end", "result": self._error_result(error), "reason": None, "time_to_first_token": None, "tokens_per_second": None}
+
+class ReasoningStripper:
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+    
+    def __init__(self):
+        """Initialize the incremental remover of <think>...</think> reasoning blocks."""
+        self.buffer = ""
+        self.inside = False
+        self.reasoning = []
+        self._current_reason = []
+        self._content = []
+        self.seconds = 0.0
+    
+    @property
+    def content(self) -> str:
+        """The visible text emitted so far."""
+        return "".join(self._content)
+    
+    def feed(self, text: str) -> str:
+        """Consume streamed text and return the part that is safe to show.
+        
+        Text that could be the start of a tag is held back until the next call.
+        
+        Args:
+            text: The next piece of streamed text.
+            
+        Returns:
+            Visible text outside reasoning blocks.
+        """
+        start = perf_counter()
+        self.buffer += text
+        visible = []
+        while True:
+            tag = self.CLOSE_TAG if self.inside else self.OPEN_TAG
+            index = self.buffer.find(tag)
+            if index < 0:
+                break
+            (self._current_reason if self.inside else visible).append(self.buffer[:index])
+            self.buffer = self.buffer[index + len(tag):]
+            if self.inside:
+                self.reasoning.append("".join(self._current_reason))
+                self._current_reason = []
+            self.inside = not self.inside
+        
+        keep = next((n for n in range(min(len(tag) - 1, len(self.buffer)), 0, -1) if tag.startswith(self.buffer[-n:])), 0)
+        (self._current_reason if self.inside else visible).append(self.buffer[:len(self.buffer) - keep])
+        self.buffer = self.buffer[len(self.buffer) - keep:]
+        
+        visible = "".join(visible)
+        self._content.append(visible)
+        self.seconds += perf_counter() - start
+        return visible
+    
+    def flush(self) -> str:
+        """Return any held-back text once the stream has ended.
+        
+        An unterminated reasoning block is treated as visible text, matching the non-streaming behaviour.
+        
+        Returns:
+            The remaining visible text.
+        """
+        if self.inside:
+            visible = self.OPEN_TAG + "".join(self._current_reason) + self.buffer
+            self._current_reason = []
+            self.inside = False
+        else:
+            visible = self.buffer
+        self.buffer = ""
+        self._content.append(visible)
+        return visible
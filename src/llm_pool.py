@@ -0,0 +1,212 @@
+from typing import Any
+from collections import deque
+from time import monotonic, sleep
+import threading
+import numpy as np
+import httpx
+from langchain_ollama import ChatOllama
+
+class OllamaBackend:
+    def __init__(self, base_url: str, model_name: str, request_timeout: float = None, max_connections: int = 4, latency_window: int = 1000):
+        """Initialize one Ollama endpoint serving one model.
+
+        The underlying HTTP clients are created once and keep their connections alive between requests.
+
+        Args:
+            base_url: Base URL of the Ollama API.
+            model_name: Name of the model to use on it.
+            (optional) request_timeout: Seconds a request may take before it fails. Default is None, which waits indefinitely.
+            (optional) max_connections: Number of idle connections kept open. Default is 4.
+            (optional) latency_window: Number of most recent request latencies kept for the statistics. Default is 1000.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.model_name = model_name
+        self.llm = ChatOllama(
+            model = model_name,
+            base_url = self.base_url,
+            temperature = 0.2,
+            num_predict = 500,
+            client_kwargs = {"timeout": request_timeout, "limits": httpx.Limits(max_keepalive_connections = max_connections, keepalive_expiry = 60.0)}
+        )
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = None
+        self.last_error = None
+        self.last_exception = None
+        self.latencies = deque(maxlen = latency_window)
+
+    @property
+    def name(self) -> str:
+        """Name identifying the backend in logs and statistics."""
+        return f"{self.model_name}@{self.base_url}"
+
+    def stats(self) -> dict[str, Any]:
+        """Summarize the backend's state and latency.
+
+        Returns:
+            Dictionary with the name, health, outstanding and total requests, failures, last error and p50/p95 latency in milliseconds.
+        """
+        p50, p95 = (float(value) for value in np.percentile(np.fromiter(self.latencies, dtype = float), [50, 95]) * 1000) if self.latencies else (None, None)
+        return {
+            "name": self.name,
+            "healthy": self.ejected_until is None,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "p50_ms": p50,
+            "p95_ms": p95
+        }
+
+class BackendPool:
+    def __init__(self, backends: list[OllamaBackend], max_failures: int = 3, eject_seconds: float = 30.0, health_interval: float = 10.0):
+        """Initialize the pool that spreads LLM requests across Ollama backends.
+
+        Each request goes to the healthy backend with the fewest outstanding requests. A backend is ejected when it cannot be reached or after max_failures failures in a row. A background thread health-checks every backend and brings ejected ones back once they answer and have their model.
+
+        Args:
+            backends: Backends in the pool.
+            (optional) max_failures: Consecutive failed requests after which a reachable backend is ejected. Default is 3.
+            (optional) eject_seconds: Minimum seconds an ejected backend stays out of rotation. Default is 30.0.
+            (optional) health_interval: Seconds between health checks. Default is 10.0. Health checks only run with more than one backend.
+        """
+        self.backends = backends
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._health_thread = None
+        self._turn = 0
+
+    def acquire(self, exclude: list[OllamaBackend] = None) -> OllamaBackend:
+        """Pick the backend for the next request and count it as outstanding.
+
+        Ties are taken in turn, so sequential requests go round-robin. If every remaining backend is ejected, the one due back soonest is used rather than failing outright.
+
+        Args:
+            (optional) exclude: Backends already tried for this request. Default is None.
+
+        Returns:
+            The backend, or None if every backend was tried.
+        """
+        self._start_health_checks()
+        exclude = exclude or []
+        with self._lock:
+            turn = self._turn % len(self.backends)
+            self._turn += 1
+            candidates = [backend for backend in self.backends[turn:] + self.backends[:turn] if backend not in exclude]
+            if not candidates:
+                return None
+            healthy = [backend for backend in candidates if backend.ejected_until is None]
+            if healthy:
+                backend = min(healthy, key = lambda backend: backend.outstanding)
+            else:
+                backend = min(candidates, key = lambda backend: backend.ejected_until)
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend: OllamaBackend, seconds: float = None, error: Exception = None) -> None:
+        """Record the outcome of a request sent to a backend.
+
+        Args:
+            backend: The backend returned by acquire().
+            (optional) seconds: Latency of a successful request. Default is None.
+            (optional) error: The exception of a failed request. Default is None, which records a success.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            backend.outstanding -= 1
+            if error is None:
+                backend.consecutive_failures = 0
+                backend.last_exception = None
+                if seconds is not None:
+                    backend.latencies.append(seconds)
+                return
+            backend.failures += 1
+            backend.consecutive_failures += 1
+            backend.last_error = f"{type(error).__name__}: {error}".rstrip(": ")
+            backend.last_exception = error
+            # A backend that cannot be reached is ejected right away; errors and timeouts from one that is up only when they repeat
+            if isinstance(error, (ConnectionError, httpx.ConnectError, httpx.RemoteProtocolError)) or backend.consecutive_failures >= self.max_failures:
+                self._eject(backend)
+
+    def _eject(self, backend: OllamaBackend) -> None:
+        """Take a backend out of rotation. The caller holds the lock.
+
+        Args:
+            backend: The backend to eject.
+
+        Returns:
+            None.
+        """
+        if backend.ejected_until is None and len(self.backends) > 1:
+            print(f"LLM backend {backend.name} ejected after: {backend.last_error}")
+        backend.ejected_until = monotonic() + self.eject_seconds
+
+    def check_health(self, backend: OllamaBackend, client: httpx.Client) -> bool:
+        """Check that a backend answers and has its model.
+
+        Args:
+            backend: The backend to check.
+            client: HTTP client used for the check.
+
+        Returns:
+            True if the backend is healthy.
+        """
+        try:
+            response = client.get(f"{backend.base_url}/api/tags")
+            response.raise_for_status()
+            models = {model.get("name") for model in response.json().get("models", [])} | {model.get("model") for model in response.json().get("models", [])}
+        except (httpx.HTTPError, ValueError) as e:
+            backend.last_error = f"Health check failed: {type(e).__name__}: {e}"
+            return False
+        if backend.model_name not in models and f"{backend.model_name}:latest" not in models:
+            backend.last_error = f"Health check failed: model {backend.model_name} is not available."
+            return False
+        return True
+
+    def _start_health_checks(self) -> None:
+        """Start the health check thread, if there is more than one backend and it is not running yet.
+
+        Returns:
+            None.
+        """
+        if self._health_thread is not None or len(self.backends) < 2:
+            return
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target = self._health_loop, daemon = True)
+                self._health_thread.start()
+
+    def _health_loop(self) -> None:
+        """Health-check every backend forever, ejecting failing ones and bringing recovered ones back.
+
+        Returns:
+            None.
+        """
+        with httpx.Client(timeout = 2.0) as client:
+            while True:
+                for backend in self.backends:
+                    healthy = self.check_health(backend, client)
+                    with self._lock:
+                        if not healthy:
+                            self._eject(backend)
+                        elif backend.ejected_until is not None and backend.ejected_until <= monotonic():
+                            backend.ejected_until = None
+                            backend.consecutive_failures = 0
+                            print(f"LLM backend {backend.name} is healthy again.")
+                sleep(self.health_interval)
+
+    def stats(self) -> list[dict[str, Any]]:
+        """Summarize every backend.
+
+        Returns:
+            List of OllamaBackend.stats() dictionaries.
+        """
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
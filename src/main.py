@@ -1,16 +1,32 @@
-import subprocess
-import sys
+from time import perf_counter
+STARTED = perf_counter()
 import os
-print("\nManaging dependencies...\nThis might take a few seconds...\n")
-subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", f"{os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'requirements.txt')}"], stdout = subprocess.DEVNULL)
+import threading
+from dependencies import ensure_requirements
+# Processes started with "spawn" (the ingestion pool on Windows and macOS) import this module as __mp_main__ and skip the check
+if __name__ != "__mp_main__":
+    ensure_requirements()
 from pprint import pprint
 from argparse import ArgumentParser, Namespace
 
 from document_loader import DocumentLoader
 from embeddings import VectorStore
 from retrieval import Retriever
-from llm import LLMService
-from agent import Agent
+from agent import Agent, LLM_TOOLS
+from index_manifest import IndexManifest
+from ingestion import IngestionPipeline
+from response_cache import ResponseCache
+from stub_llm import StubLLMService
+from batch import BatchRunner
+from lexical_index import LexicalIndex
+from source_scope import SourceScope
+from context_builder import ContextBuilder
+from reranker import Reranker
+from router import QueryRouter, FAQTable
+from structured_store import StructuredStore
+from tracing import Tracer, PrometheusMetrics, format_breakdown
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.rag_index')
 
 class main:
     def __init__(self, args: Namespace):
@@ -20,30 +36,173 @@ class main:
             args: Command line arguments.
         """
         
+        setup_started = perf_counter()
         print("Setting up RAG agent system...")
+        self.fast_start = getattr(args, "fast_start", False)
+        
+        llm_kwargs = {"max_concurrency": getattr(args, "max_concurrency", None) or 4}
+        if args.model:
+            llm_kwargs["model_name"] = [model.strip() for model in args.model.split(",")]
+        if args.model_url:
+            llm_kwargs["base_url"] = [url.strip() for url in args.model_url.split(",")]
+        if getattr(args, "llm_deadline", None):
+            llm_kwargs["deadline"] = args.llm_deadline
+        cascade_model = getattr(args, "cascade_model", None)
+        if getattr(args, "stub_llm", False):
+            self.llm_service = StubLLMService(max_concurrency = llm_kwargs["max_concurrency"])
+            large_service = StubLLMService(model_name = "stub-large", max_concurrency = llm_kwargs["max_concurrency"]) if cascade_model else None
+        else:
+            from llm import LLMService
+            self.llm_service = LLMService(**llm_kwargs)
+            large_service = LLMService(**{**llm_kwargs, "model_name": [model.strip() for model in cascade_model.split(",")]}) if cascade_model else None
+        if large_service is not None:
+            from cascade import ModelCascade
+            min_score, min_support = getattr(args, "cascade_min_score", None), getattr(args, "cascade_min_support", None)
+            self.llm_service = ModelCascade(
+                self.llm_service,
+                large_service,
+                min_retrieval_score = 0.5 if min_score is None else min_score,
+                min_support = 0.5 if min_support is None else min_support
+            )
         
         self.loader = DocumentLoader()
-        self.vector_store = VectorStore()
-        
-        self.documents = self.loader.load_documents()
-        self.chunks = self.loader.chunk_documents(self.documents)
-        self.vector_store.add_chunks(self.chunks)
-        
-        if args.model and not args.model_url:
-            self.llm_service = LLMService(model_name = args.model)
-        elif args.model_url and not args.model:
-            self.llm_service = LLMService(base_url = args.model_url)
-        elif args.model and args.model_url:
-            self.llm_service = LLMService(model_name = args.model, base_url = args.model_url)
+        self.persist_dir = getattr(args, "persist_dir", None) or (DEFAULT_INDEX_DIR if self.fast_start else None)
+        self.vector_store = VectorStore(
+            persist_dir = self.persist_dir,
+            batch_size = getattr(args, "batch_size", None) or 256,
+            query_cache_size = getattr(args, "query_cache_size", None) or 1024,
+            lexical_index = LexicalIndex() if getattr(args, "hybrid", False) else None,
+            backend = getattr(args, "vector_backend", None) or "chroma",
+            embedding_dtype = getattr(args, "embedding_dtype", None),
+            ann = getattr(args, "ann", False),
+            ann_lists = getattr(args, "ann_lists", None),
+            ann_effort = getattr(args, "ann_effort", None),
+            shards = getattr(args, "shards", None),
+            hnsw = {"M": getattr(args, "hnsw_m", None), "ef_construction": getattr(args, "hnsw_ef_construction", None)} if getattr(args, "hnsw_m", None) or getattr(args, "hnsw_ef_construction", None) else None
+        )
+        if self.fast_start:
+            # Ollama loading the model and the embedding model loading overlap with opening the index
+            threading.Thread(target = self.llm_service.warm_up, daemon = True).start()
+            threading.Thread(target = self.vector_store.warm_up, daemon = True).start()
+        self.ingestion = IngestionPipeline(self.loader, self.vector_store, workers = getattr(args, "ingest_workers", None), dedup_threshold = getattr(args, "dedup_threshold", None))
+        cache_size = getattr(args, "cache_size", None)
+        cache_similarity = getattr(args, "cache_similarity", None)
+        self.cache = None if cache_size == 0 else ResponseCache(
+            embed = self.vector_store.embed_query if cache_similarity else None,
+            max_entries = cache_size or 256,
+            ttl_seconds = getattr(args, "cache_ttl", None) or 3600,
+            similarity_threshold = cache_similarity or 0.95
+        )
+        
+        self.faq_table = FAQTable()
+        self.structured_store = StructuredStore()
+        self._sync_lock = threading.Lock()
+        self.source_scope = SourceScope() if getattr(args, "auto_scope", False) else None
+        self.manifest = IndexManifest(os.path.join(self.persist_dir, "manifest.json") if self.persist_dir else None)
+        self._sync_index(defer_tables = self.fast_start)
+        
+        rerank_candidates = getattr(args, "rerank_candidates", None)
+        if not rerank_candidates:
+            self.reranker = None
+            self.retriever = Retriever(self.vector_store, hybrid = getattr(args, "hybrid", False), scope = self.source_scope)
         else:
-            self.llm_service = LLMService()
+            rerank_budget_ms = getattr(args, "rerank_budget_ms", None)
+            self.reranker = Reranker(latency_budget_ms = 50.0 if rerank_budget_ms is None else rerank_budget_ms)
+            self.retriever = Retriever(self.vector_store, hybrid = getattr(args, "hybrid", False), candidate_k = rerank_candidates, reranker = self.reranker, scope = self.source_scope)
+        
+        context_tokens = getattr(args, "context_tokens", None)
+        self.context_builder = ContextBuilder(token_budget = context_tokens) if context_tokens else None
         
-        self.retriever = Retriever(self.vector_store)
+        self.router = QueryRouter(self.faq_table, self.structured_store)
+        metrics_file = getattr(args, "metrics_file", None)
+        self.tracer = Tracer(getattr(args, "trace_file", None), PrometheusMetrics(metrics_file) if metrics_file else None)
+        self.agent = Agent(self.retriever, self.llm_service, self.cache, self.context_builder, self.router, self.tracer)
         
-        self.agent = Agent(self.retriever, self.llm_service)
+        self.watcher = None
+        if getattr(args, "watch", False):
+            from index_watcher import IndexWatcher
+            self.watcher = IndexWatcher(self.loader.data_dir, lambda: self._sync_index(atomic = True), debounce_seconds = getattr(args, "watch_debounce", None) or 1.0).start()
+            print(f"Watching {self.loader.data_dir} for changes.")
         
         self.prev_response_info = None
         self.logs = None
+        self.trace = None
+        
+        now = perf_counter()
+        self.startup_stats = {"imports_seconds": setup_started - STARTED, "setup_seconds": now - setup_started, "fast_start": self.fast_start}
+        print(f"Startup took {now - STARTED:.2f}s ({setup_started - STARTED:.2f}s dependency check and imports, {now - setup_started:.2f}s setup{', fast start' if self.fast_start else ''}).")
+
+    def _sync_index(self, defer_tables: bool = False, atomic: bool = False) -> tuple[list[str], list[str]]:
+        """Bring the index up to date with the data directory.
+        
+        Only files that are new or whose contents changed since the last sync (or, for a persistent index, the last run) are re-loaded, re-chunked and re-embedded. Chunks of deleted files are evicted.
+        
+        Args:
+            (optional) defer_tables: Load the FAQ table and the structured store on a background thread instead of before returning. Until they are loaded, FAQ and tabular questions go through retrieval. Default is False.
+            (optional) atomic: Embed the changed files first and then swap their chunks in at once, so queries answered meanwhile see the old or the new version of each file. Default is False, which evicts the old chunks first and streams the new ones in.
+        
+        Returns:
+            Tuple containing the filenames that were re-indexed and the filenames that were removed.
+        """
+        
+        with self._sync_lock:
+            manifest = self.manifest
+            current = manifest.scan(self.loader.data_dir)
+            changed, deleted = manifest.diff(current)
+            
+            if self.vector_store.count() == 0:
+                changed = list(current)
+            # Files sharing deduplicated chunks with a changed or deleted file are re-indexed with it, so no file loses a chunk stored under another
+            changed += [filename for filename in manifest.linked(changed + deleted) if filename in current and filename not in changed]
+            
+            print(f"Index sync: {len(changed)} new or changed file(s), {len(deleted)} deleted file(s), {len(current) - len(changed)} unchanged.")
+            
+            if atomic and changed:
+                self.ingestion_stats = self.ingestion.run(changed, replace_sources = changed + deleted)
+            else:
+                self.vector_store.delete_sources(changed + deleted)
+                self.ingestion_stats = self.ingestion.run(changed) if changed else None
+            if self.cache is not None:
+                # Invalidated after the new chunks are in, so answers cached from the old ones meanwhile are dropped as well
+                self.cache.invalidate_sources(changed + deleted)
+            
+            if defer_tables:
+                threading.Thread(target = self._sync_tables, args = (current, changed, deleted), daemon = True).start()
+            else:
+                self._sync_tables(current, changed, deleted)
+            
+            stats = self.ingestion_stats if changed and self.ingestion_stats else {}
+            failed = stats.get("load", {}).get("failed", [])
+            if failed:
+                print(f"Index sync: {len(failed)} file(s) produced no documents and will be retried on the next sync: {', '.join(failed)}")
+            manifest.update(current, changed, stats.get("dedup", {}).get("links"), failed)
+            if self.source_scope is not None:
+                self.source_scope.update(list(current), {filename: fingerprint.get("linked", []) for filename, fingerprint in manifest.files.items()})
+            return changed, deleted
+    
+    def _sync_tables(self, current: dict[str, dict], changed: list[str], deleted: list[str]) -> None:
+        """Bring the FAQ table and the structured store up to date with the data directory.
+        
+        Args:
+            current: Fingerprints of the files currently in the data directory.
+            changed: Filenames that are new or changed.
+            deleted: Filenames that were deleted.
+            
+        Returns:
+            None.
+        """
+        # Files that failed to index are not in the manifest, so their deletion is not in "deleted"
+        deleted = deleted + [filename for filename in {**self.faq_table.sources, **self.structured_store.sources} if filename not in current]
+        faq_files = [filename for filename in current if FAQTable.is_faq_file(filename) and (filename in changed or filename not in self.faq_table.sources)]
+        self.faq_table.remove_sources(changed + deleted)
+        if faq_files:
+            documents = (document for documents in self.loader.iter_documents(faq_files, workers = 1) for document in documents)
+            print(f"FAQ table: {self.faq_table.add_documents(documents)} question(s) loaded from {len(faq_files)} file(s).")
+        
+        tabular_files = [filename for filename in current if StructuredStore.is_tabular_file(filename) and (filename in changed or filename not in self.structured_store.sources)]
+        self.structured_store.remove_sources(changed + deleted)
+        for filename in tabular_files:
+            print(f"Structured store: {self.structured_store.load_file(self.loader.data_dir, filename)} row(s) loaded from {filename}.")
 
     def cli_interface(self) -> None:
         """Run a simple CLI interface for the RAG agent.
@@ -55,6 +214,8 @@ class main:
         print("\n\nRAG Agent System ready.\nType 'exit' to quit, 'info' for additional information about the last query made, or 'logs' to see the logs of the last query.")
         print("Example queries:")
         print("  - What is your flagship product?")
+        print("  - What is 12 * (3 + 4)?")
+        print("  - Movies released after 2010 with rating > 8")
         
         while True:
             
@@ -86,10 +247,26 @@ class main:
                     print("LOGS:")
                     for log in self.logs:
                         print(f"- {log}")
+                    if self.trace is not None:
+                        print("-"*50)
+                        print("TIMINGS:")
+                        for line in format_breakdown(self.trace):
+                            print(line)
                     print("-"*50)
                 continue
             
-            self.response = self.agent.process_query(query)
+            self.response = None
+            header_printed = False
+            streamed = False
+            for event in self.agent.process_query_stream(query):
+                if event['type'] == 'retrieval':
+                    self._print_response_header(event['response'])
+                    header_printed = True
+                elif event['type'] == 'token':
+                    print(event['content'], end = "", flush = True)
+                    streamed = True
+                else:
+                    self.response = event['response']
             
             if self.response['result'] == "Invalid model.":
                 break
@@ -97,43 +274,106 @@ class main:
                 break
             
             self.logs = self.response['log']
+            self.trace = self.response.get('trace')
             
-            print("\n" + "="*50)
-            print(f"QUERY: {self.response['query']}")
-            print(f"TOOL: {self.response['tool_used']}")
-            print("-"*50)
-            
-            if self.response['tool_used'] == 'rag':
-                print("RETRIEVED CHUNKS:")
-                for i, chunk in enumerate(self.response['retrieved_chunks']):
-                    print(f"\nChunk {i+1} (Source: {chunk['source']}, Score: {chunk['relevance_score']:.2f}):")
-                    print(f"{chunk['content'][:200]}...")
-                print("-"*50)
+            if not header_printed:
+                self._print_response_header(self.response)
             
-            if self.response['tool_used'] == 'rag' or self.response['tool_used'] == 'none':
+            if self.response['tool_used'] in LLM_TOOLS:
                 self.prev_response_info = {
                     "Usage info": self.response['result'].usage_metadata,
                     "Metadata": self.response['result'].response_metadata,
                     "ID": self.response['result'].id
                     }
                 
+                print("" if streamed else self.response['result'].content)
+                
                 if self.response['reason']:
+                    print("-"*50)
                     print("REASONING:")
                     [print(f"{_}") for _ in self.response['reason']]
-                    print("-"*50)
-                
-                print("RESULT:")
-                print(self.response['result'].content)
                 print("="*50 + "\n")
             else:
-                print("RESULT:")
                 print(self.response['result'])
                 print("="*50 + "\n")
+    
+    def _print_response_header(self, response: dict) -> None:
+        """Print the query, the tool used and any retrieved chunks, followed by the result heading.
+        
+        Args:
+            response: The (possibly partial) response from the agent.
+            
+        Returns:
+            None
+        """
+        
+        print("\n" + "="*50)
+        print(f"QUERY: {response['query']}")
+        print(f"TOOL: {response['tool_used']}")
+        print("-"*50)
+        
+        if response['tool_used'] in ['rag', 'structured']:
+            print("RETRIEVED CHUNKS:")
+            for i, chunk in enumerate(response['retrieved_chunks']):
+                also = f", found in: {chunk['sources']}" if chunk.get('sources') else ""
+                print(f"\nChunk {i+1} (Source: {chunk['source']}{also}, Score: {chunk['relevance_score']:.2f}):")
+                print(f"{chunk['content'][:200]}...")
+            print("-"*50)
+        
+        print("RESULT:")
+
+def build_arg_parser() -> ArgumentParser:
+    """Build the command line argument parser shared by the CLI and the other entry points.
+    
+    Returns:
+        The argument parser.
+    """
+    
+    parser = ArgumentParser(description = "RAG Agent System. Available tools: Calculator, FAQ, Small talk, RAG.")
+    parser.add_argument("--model", help = "Select the ollama model to use for the LLM service. A comma-separated list spreads requests across several models.")
+    parser.add_argument("--model_url", help = "Select the url the ollama model exists at. A comma-separated list spreads requests across several Ollama servers, with failover between them.")
+    parser.add_argument("--max_concurrency", type = int, help = "Maximum number of concurrent async requests sent to each Ollama backend. Defaults to 4.")
+    parser.add_argument("--cascade_model", help = "Larger ollama model to escalate to. The --model answers first, and a query goes to this model only when retrieval scores are low or the small model's answer looks unsure or unsupported by the context.")
+    parser.add_argument("--cascade_min_score", type = float, help = "Best retrieval score below which a query goes straight to --cascade_model. Defaults to 0.5.")
+    parser.add_argument("--cascade_min_support", type = float, help = "Fraction of the small model's answer words that must occur in the context for it to be kept. Defaults to 0.5.")
+    parser.add_argument("--llm_deadline", type = float, help = "Seconds an LLM request may take, including retries on other backends. Defaults to 120.")
+    parser.add_argument("--persist_dir", help = "Directory to keep a persistent vector index in. Only new or changed files are re-embedded on startup.")
+    parser.add_argument("--vector_backend", choices = ["chroma", "mmap"], help = "Vector index backend. 'mmap' keeps embeddings in a memory-mapped file that several processes can share through --persist_dir. Defaults to chroma.")
+    parser.add_argument("--embedding_dtype", choices = ["float32", "float16", "int8"], help = "Storage type of the embeddings in the mmap backend. float16 halves and int8 quarters the index size. Defaults to float32.")
+    parser.add_argument("--ann", action = "store_true", help = "Build an IVF approximate nearest-neighbour index in the mmap backend, persisted next to it and rebuilt as the corpus grows.")
+    parser.add_argument("--ann_lists", type = int, help = "Number of IVF clusters. Defaults to 4 * sqrt(number of chunks).")
+    parser.add_argument("--ann_effort", type = int, help = "Search effort trading latency for recall: IVF clusters probed per query (mmap) or HNSW ef_search (chroma). Defaults to 8 for mmap and Chroma's default for chroma.")
+    parser.add_argument("--shards", type = int, help = "Split the mmap index into this many hash-partitioned shards, each searched in parallel by its own worker process. Only used with --vector_backend mmap.")
+    parser.add_argument("--hnsw_m", type = int, help = "HNSW graph degree M of a new Chroma index.")
+    parser.add_argument("--hnsw_ef_construction", type = int, help = "HNSW ef_construction of a new Chroma index.")
+    parser.add_argument("--hybrid", action = "store_true", help = "Fuse dense retrieval with a BM25 keyword index using reciprocal-rank fusion. Helps with exact terms like model numbers.")
+    parser.add_argument("--rerank_candidates", type = int, help = "Re-rank this many first-stage candidates and keep the best. 50 is a good start. Defaults to 0, which disables re-ranking.")
+    parser.add_argument("--rerank_budget_ms", type = float, help = "Milliseconds re-ranking may take before falling back to first-stage order. Defaults to 50.")
+    parser.add_argument("--context_tokens", type = int, help = "Token budget for the retrieved context sent to the LLM, e.g. 1500. Overlapping neighbouring chunks are merged before packing. Defaults to 0, which sends every relevant chunk as is.")
+    parser.add_argument("--cache_size", type = int, help = "Maximum number of cached responses. 0 disables the response cache. Defaults to 256.")
+    parser.add_argument("--cache_ttl", type = float, help = "Seconds a cached response stays valid. Defaults to 3600.")
+    parser.add_argument("--cache_similarity", type = float, help = "Minimum cosine similarity between queries for a semantic cache hit, e.g. 0.95. The queries must also mention the same numbers and names. Defaults to 0, which only answers exact repeats from the cache.")
+    parser.add_argument("--query_cache_size", type = int, help = "Maximum number of query embeddings kept in memory. Persisted inside --persist_dir if set. Defaults to 1024.")
+    parser.add_argument("--batch_size", type = int, help = "Number of chunks embedded and inserted per batch during ingestion. Defaults to 256.")
+    parser.add_argument("--batch_input", help = "Answer every question in this JSONL file instead of starting the interactive CLI. Each line needs a 'query' field and may have an 'id'.")
+    parser.add_argument("--batch_output", help = "JSONL file batch answers are appended to. Questions already answered in it are skipped, so interrupted runs resume. Defaults to the input path with '.out.jsonl' appended.")
+    parser.add_argument("--batch_workers", type = int, default = 4, help = "Number of concurrent LLM calls in batch mode. Defaults to 4.")
+    parser.add_argument("--stub_llm", action = "store_true", help = "Answer with a deterministic stub instead of Ollama. Useful for testing and benchmarking.")
+    parser.add_argument("--trace_file", help = "JSONL file the per-stage timings of every query are appended to.")
+    parser.add_argument("--metrics_file", help = "File Prometheus-style counters and latency histograms are written to after every query, e.g. for the node exporter's textfile collector.")
+    parser.add_argument("--fast_start", action = "store_true", help = f"Start as fast as possible: reuse the index in --persist_dir (defaults to {DEFAULT_INDEX_DIR}), load the FAQ and tabular files in the background, and warm up the Ollama and embedding models in the background.")
+    parser.add_argument("--auto_scope", action = "store_true", help = "Search only the files a query names, e.g. only nvidia_rtx_50_series.txt for a question about Nvidia. Entities are taken from the filenames in the data directory.")
+    parser.add_argument("--watch", action = "store_true", help = "Watch the data directory and re-index created, modified and deleted files while running. Their chunks are swapped in atomically, so queries see either the old or the new version of a file.")
+    parser.add_argument("--watch_debounce", type = float, help = "Seconds without file changes to wait before re-indexing, so a bulk copy is indexed in one pass. Defaults to 1.")
+    parser.add_argument("--dedup_threshold", type = float, help = "Similarity (0-1, e.g. 0.9) at which chunks count as near-duplicates when indexing. Only one copy is embedded and stored, and it lists every file it occurs in. Defaults to 0, which keeps every chunk.")
+    parser.add_argument("--ingest_workers", type = int, help = "Number of processes used to load and parse documents. Defaults to the number of CPUs.")
+    return parser
 
 if __name__ == "__main__":
-    parser = ArgumentParser(description = "RAG Agent System. Available tools: Calulator, Dictionary, RAG.")
-    parser.add_argument("--model", help = "Select the ollama model to use for the LLM service.")
-    parser.add_argument("--model_url", help = "Select the url the ollama model exists at.")
+    parser = build_arg_parser()
     args = parser.parse_args()
     obj = main(args)
-    obj.cli_interface()
\ No newline at end of file
+    if args.batch_input:
+        BatchRunner(obj.agent, obj.retriever, workers = args.batch_workers).run(args.batch_input, args.batch_output or f"{args.batch_input}.out.jsonl")
+    else:
+        obj.cli_interface()
\ No newline at end of file
@@ -0,0 +1,184 @@
+import threading
+from collections import defaultdict
+from typing import Any, Hashable, Iterable
+
+class MetadataIndex:
+    OPERATORS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin")
+
+    def __init__(self):
+        """Initialize the inverted index from metadata values to the keys (rows or chunk ids) that have them.
+
+        Filters use the operators of ChromaDB's where clauses: a field mapped to a value (equality) or to one of {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin"}, combined with {"$and": [...]} and {"$or": [...]}. Several fields in one dictionary must all match. A filter is answered from the distinct values of the fields it names, so the matching keys are known before any vector is scored.
+        """
+        self.values = defaultdict(lambda: defaultdict(set))
+        self.metadatas = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.metadatas)
+
+    def add(self, keys: Iterable[Hashable], metadatas: Iterable[dict[str, Any]]) -> None:
+        """Index metadata, replacing any metadata already indexed under the same keys.
+
+        Args:
+            keys: Row numbers or chunk ids.
+            metadatas: Metadata dictionary of each key.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            for key, metadata in zip(keys, metadatas):
+                self._remove(key)
+                self.metadatas[key] = metadata
+                for field, value in metadata.items():
+                    if isinstance(value, Hashable):
+                        self.values[field][value].add(key)
+
+    def _remove(self, key: Hashable) -> None:
+        """Remove one key from the index, if present.
+
+        Args:
+            key: Row number or chunk id.
+
+        Returns:
+            None.
+        """
+        metadata = self.metadatas.pop(key, None)
+        if metadata is None:
+            return
+        for field, value in metadata.items():
+            keys = self.values[field].get(value) if isinstance(value, Hashable) else None
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.values[field][value]
+
+    def remove(self, keys: Iterable[Hashable]) -> None:
+        """Remove keys from the index.
+
+        Args:
+            keys: Row numbers or chunk ids.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    @classmethod
+    def normalize(cls, where: dict[str, Any]) -> dict[str, Any]:
+        """Check a filter and rewrite it in the form ChromaDB accepts: one field or operator per dictionary.
+
+        Args:
+            where: The filter.
+
+        Returns:
+            The filter, with dictionaries naming several fields turned into "$and" clauses, or None for an empty filter.
+
+        Raises:
+            ValueError: If the filter uses an unknown operator or is malformed.
+        """
+        if not where:
+            return None
+        if not isinstance(where, dict):
+            raise ValueError(f"Metadata filter must be a dictionary, not {type(where).__name__}.")
+        clauses = []
+        for field, condition in where.items():
+            if field in ("$and", "$or"):
+                if not isinstance(condition, list) or not condition:
+                    raise ValueError(f"{field} needs a non-empty list of filters.")
+                clauses.append({field: [cls.normalize(clause) for clause in condition]})
+            elif field.startswith("$"):
+                raise ValueError(f"Unsupported filter operator: {field}. Use $and or $or to combine filters.")
+            elif isinstance(condition, dict):
+                if len(condition) != 1 or next(iter(condition)) not in cls.OPERATORS:
+                    raise ValueError(f"Filter on '{field}' needs exactly one of {', '.join(cls.OPERATORS)}.")
+                operator, operand = next(iter(condition.items()))
+                if operator in ("$in", "$nin") and not isinstance(operand, (list, tuple, set)):
+                    raise ValueError(f"{operator} on '{field}' needs a list of values.")
+                clauses.append({field: {operator: list(operand) if operator in ("$in", "$nin") else operand}})
+            else:
+                clauses.append({field: condition})
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    @staticmethod
+    def _compare(operator: str, value: Any, operand: Any) -> bool:
+        """Apply a comparison operator to one metadata value.
+
+        Args:
+            operator: One of OPERATORS.
+            value: The metadata value.
+            operand: The value from the filter.
+
+        Returns:
+            True if the value matches. Values that cannot be ordered against the operand do not match range operators.
+        """
+        try:
+            match operator:
+                case "$eq":
+                    return value == operand
+                case "$ne":
+                    return value != operand
+                case "$gt":
+                    return value > operand
+                case "$gte":
+                    return value >= operand
+                case "$lt":
+                    return value < operand
+                case "$lte":
+                    return value <= operand
+                case "$in":
+                    return value in operand
+                case "$nin":
+                    return value not in operand
+        except TypeError:
+            return False
+
+    def keys(self, where: dict[str, Any]) -> set[Hashable]:
+        """Find the keys whose metadata matches a filter.
+
+        Only the distinct values of the filtered fields are compared, not every key's metadata. Keys without the filtered field match none of the operators, including "$ne" and "$nin".
+
+        Args:
+            where: The filter.
+
+        Returns:
+            Set of matching keys.
+
+        Raises:
+            ValueError: If the filter uses an unknown operator or is malformed.
+        """
+        with self._lock:
+            return self._keys(self.normalize(where))
+
+    def _keys(self, where: dict[str, Any]) -> set[Hashable]:
+        """Find the keys matching a normalized filter.
+
+        Args:
+            where: Normalized filter, or None to match every key.
+
+        Returns:
+            Set of matching keys.
+        """
+        if where is None:
+            return set(self.metadatas)
+        field, condition = next(iter(where.items()))
+        if field == "$and":
+            matches = self._keys(condition[0])
+            for clause in condition[1:]:
+                if not matches:
+                    break
+                matches &= self._keys(clause)
+            return matches
+        if field == "$or":
+            return set().union(*(self._keys(clause) for clause in condition))
+
+        operator, operand = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+        values = self.values.get(field, {})
+        if operator == "$eq":
+            return set(values.get(operand, ())) if isinstance(operand, Hashable) else set()
+        if operator == "$in":
+            return set().union(*(values.get(value, ()) for value in operand if isinstance(value, Hashable)))
+        return set().union(*(keys for value, keys in values.items() if self._compare(operator, value, operand)))
@@ -0,0 +1,98 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+import numpy as np
+
+class QueryEmbeddingCache:
+    def __init__(self, embed_batch: Callable[[list[str]], list[Any]], max_entries: int = 1024, path: str = None):
+        """Initialize the bounded LRU cache of query text to query embedding.
+
+        Args:
+            embed_batch: Function mapping a list of texts to their embeddings.
+            (optional) max_entries: Maximum number of cached embeddings. Least recently used entries are evicted first. Default is 1024.
+            (optional) path: JSON file the cache is loaded from and saved to, so it survives restarts. Default is None, which keeps it in memory only.
+        """
+        self.embed_batch = embed_batch
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+
+    def _load(self) -> None:
+        """Load cached embeddings from disk, if the cache file exists.
+
+        Returns:
+            None.
+        """
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding = 'utf-8') as f:
+                for query, vector in json.load(f).items():
+                    self.entries[query] = np.asarray(vector, dtype = np.float32)
+        except (OSError, ValueError) as e:
+            print(f"Error while reading query embedding cache, starting empty:\n{e}")
+            self.entries.clear()
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last = False)
+
+    def save(self) -> None:
+        """Write the cached embeddings to disk atomically. Does nothing if no path was given.
+
+        Returns:
+            None.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            data = {query: vector.tolist() for query, vector in self.entries.items()}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding = 'utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def get_many(self, queries: list[str]) -> list[np.ndarray]:
+        """Return embeddings for several queries, embedding all misses in one batch.
+
+        Args:
+            queries: List of query strings.
+
+        Returns:
+            List of query embeddings in the same order as the queries.
+        """
+        with self._lock:
+            vectors = [self.entries.get(query) for query in queries]
+            for query, vector in zip(queries, vectors):
+                if vector is not None:
+                    self.entries.move_to_end(query)
+        missing = list(dict.fromkeys(query for query, vector in zip(queries, vectors) if vector is None))
+
+        if missing:
+            computed = dict(zip(missing, (np.asarray(v, dtype = np.float32) for v in self.embed_batch(missing))))
+            vectors = [computed[query] if vector is None else vector for query, vector in zip(queries, vectors)]
+            with self._lock:
+                self.entries.update(computed)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last = False)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(queries) - len(missing)
+        return vectors
+
+    def get(self, query: str) -> np.ndarray:
+        """Return the embedding for a query, computing and caching it on a miss.
+
+        Args:
+            query: The query string.
+
+        Returns:
+            The query embedding.
+        """
+        return self.get_many([query])[0]
@@ -0,0 +1,118 @@
+import threading
+from time import perf_counter
+from collections import OrderedDict
+from typing import Any
+import numpy as np
+
+from lexical_index import LexicalIndex
+
+class Reranker:
+    def __init__(self, dense_weight: float = 0.7, lexical_weight: float = 0.3, latency_budget_ms: float = 50.0, cache_size: int = 4096):
+        """Initialize the CPU re-ranker used as the second retrieval stage.
+
+        All candidates are scored in one vectorized pass. The score mixes the exact cosine similarity between the query and chunk embeddings with the IDF-weighted share of query terms that appear in the chunk.
+
+        Args:
+            (optional) dense_weight: Weight of the cosine similarity. Default is 0.7.
+            (optional) lexical_weight: Weight of the query term coverage. Default is 0.3.
+            (optional) latency_budget_ms: Milliseconds the re-ranking may take. If exceeded, the first-stage order is used instead. Default is 50.0.
+            (optional) cache_size: Maximum number of (query, chunk) pairs whose cosine similarity and query term matches are cached. Default is 4096.
+        """
+        self.dense_weight = dense_weight
+        self.lexical_weight = lexical_weight
+        self.latency_budget = latency_budget_ms / 1000
+        self.cache_size = cache_size
+        self.feature_cache = OrderedDict()
+        self.stats = {"reranked": 0, "fallbacks": 0, "cache_hits": 0, "scored": 0}
+        self._lock = threading.Lock()
+
+    def _features(self, query_vector: np.ndarray, terms: list[str], candidates: list[dict[str, Any]], deadline: float) -> tuple[np.ndarray, np.ndarray]:
+        """Compute the per-candidate parts of the score, which do not depend on the other candidates.
+
+        Args:
+            query_vector: Embedding of the query.
+            terms: Distinct query terms.
+            candidates: Candidates with 'content' and 'embedding'.
+            deadline: perf_counter() value after which scoring is abandoned.
+
+        Returns:
+            Tuple containing the cosine similarity of every candidate and a matrix of which query terms each candidate contains, or None if the deadline passed.
+        """
+        embeddings = np.asarray([candidate['embedding'] for candidate in candidates], dtype = np.float32)
+        norms = np.linalg.norm(embeddings, axis = 1) * np.linalg.norm(query_vector)
+        cosine = (embeddings @ query_vector) / np.where(norms > 0, norms, 1.0)
+
+        presence = np.zeros((len(candidates), len(terms)), dtype = np.float32)
+        if terms:
+            for i, candidate in enumerate(candidates):
+                if perf_counter() > deadline:
+                    return None
+                chunk_terms = set(LexicalIndex.tokenize(candidate['content']))
+                presence[i] = [term in chunk_terms for term in terms]
+        return cosine, presence
+
+    def _score(self, cosine: np.ndarray, presence: np.ndarray) -> np.ndarray:
+        """Combine the features of all candidates into their scores.
+
+        Term IDF is computed over the whole candidate list, so the scores of one list share a scale whichever features came from the cache.
+
+        Args:
+            cosine: Cosine similarity of every candidate.
+            presence: Matrix of which query terms each candidate contains.
+
+        Returns:
+            Array of scores.
+        """
+        if not presence.shape[1]:
+            return self.dense_weight * cosine
+        document_frequency = presence.sum(axis = 0)
+        idf = np.log1p((len(presence) - document_frequency + 0.5) / (document_frequency + 0.5))
+        coverage = presence @ idf / idf.sum()
+        return self.dense_weight * cosine + self.lexical_weight * coverage
+
+    def rerank(self, query: str, query_embedding: Any, candidates: list[dict[str, Any]], top_k: int) -> list[dict[str, Any]]:
+        """Pick the best top_k candidates.
+
+        Args:
+            query: The user query string.
+            query_embedding: Embedding of the query.
+            candidates: First-stage candidates with 'id', 'content' and 'embedding', best first.
+            top_k: Number of candidates to keep.
+
+        Returns:
+            The top_k candidates with their 'rerank_score', best first. If the latency budget is exceeded, the first top_k candidates in first-stage order.
+        """
+        if not candidates:
+            return []
+
+        start = perf_counter()
+        terms = list(dict.fromkeys(LexicalIndex.tokenize(query)))
+        with self._lock:
+            features = [self.feature_cache.get((query, candidate.get('id'))) for candidate in candidates]
+            for candidate, feature in zip(candidates, features):
+                if feature is not None:
+                    self.feature_cache.move_to_end((query, candidate.get('id')))
+        missing = [i for i, feature in enumerate(features) if feature is None]
+
+        if missing:
+            computed = self._features(np.asarray(query_embedding, dtype = np.float32), terms, [candidates[i] for i in missing], start + self.latency_budget)
+            if computed is None or perf_counter() - start > self.latency_budget:
+                with self._lock:
+                    self.stats["fallbacks"] += 1
+                return candidates[:top_k]
+            with self._lock:
+                for i, cosine, presence in zip(missing, *computed):
+                    features[i] = (float(cosine), presence)
+                    if candidates[i].get('id') is not None:
+                        self.feature_cache[(query, candidates[i]['id'])] = features[i]
+                while len(self.feature_cache) > self.cache_size:
+                    self.feature_cache.popitem(last = False)
+
+        with self._lock:
+            self.stats["reranked"] += 1
+            self.stats["scored"] += len(missing)
+            self.stats["cache_hits"] += len(candidates) - len(missing)
+
+        scores = self._score(np.asarray([cosine for cosine, _ in features], dtype = np.float32), np.stack([presence for _, presence in features]))
+        order = np.argsort(-scores, kind = "stable")[:top_k]
+        return [{**candidates[i], 'rerank_score': float(scores[i])} for i in order]
@@ -0,0 +1,193 @@
+import re
+import copy
+import threading
+from time import monotonic
+from collections import OrderedDict
+from typing import Any, Callable
+import numpy as np
+
+class ResponseCache:
+    # Numbers and capitalized words, e.g. "RTX", "5090" or "Inception", which tell otherwise similar questions apart
+    KEY_TOKEN_PATTERN = re.compile(r"\d+(?:[.,]\d+)*|\b[A-Z][\w-]*")
+
+    def __init__(self, embed: Callable[[str], Any] = None, max_entries: int = 256, ttl_seconds: float = 3600, similarity_threshold: float = 0.95):
+        """Initialize the two-tier response cache.
+
+        The first tier matches queries exactly after normalization. The second tier matches queries whose embedding is close enough to a cached query's embedding and that mention the same numbers and names.
+
+        Args:
+            (optional) embed: Function mapping a query to its embedding. Default is None, which disables the semantic tier.
+            (optional) max_entries: Maximum number of cached responses. Least recently used entries are evicted first. Default is 256.
+            (optional) ttl_seconds: Seconds a cached response stays valid. Default is 3600.
+            (optional) similarity_threshold: Minimum cosine similarity for a semantic hit. Default is 0.95.
+        """
+        self.embed = embed
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.entries = OrderedDict()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        # Lookups come from worker threads and invalidations from the index watcher
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Normalize a query for exact matching.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            The query lowercased, with punctuation removed and whitespace collapsed.
+        """
+        return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+    @classmethod
+    def key_tokens(cls, query: str) -> frozenset[str]:
+        """Extract the numbers and names of a query, which a semantic hit must share with the cached query.
+
+        Capitalized words at the start of a sentence and "I" are not names.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            The lowercased numbers and capitalized words.
+        """
+        tokens = set()
+        for match in cls.KEY_TOKEN_PATTERN.finditer(query):
+            token = match.group()
+            if not token[0].isdigit() and (token == "I" or re.search(r"(^|[.!?])\W*$", query[:match.start()])):
+                continue
+            tokens.add(token.lower())
+        return frozenset(tokens)
+
+    def _expired(self, entry: dict[str, Any]) -> bool:
+        """Check whether a cache entry has outlived its TTL.
+
+        Args:
+            entry: The cache entry.
+
+        Returns:
+            True if the entry has expired.
+        """
+        return monotonic() - entry["created"] > self.ttl_seconds
+
+    def _embed(self, query: str) -> np.ndarray:
+        """Embed a query and normalize the vector to unit length.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            The unit-length query embedding.
+        """
+        vector = np.asarray(self.embed(query), dtype = np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def get(self, query: str) -> tuple[dict[str, Any], str, float]:
+        """Look up a cached response for a query.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            Tuple containing a copy of the cached response (or None), the tier that hit ("exact", "semantic" or None) and the similarity of the hit.
+        """
+        key_tokens = self.key_tokens(query)
+        key = self.normalize(query)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry):
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.stats["exact_hits"] += 1
+                return copy.deepcopy(entry["response"]), "exact", 1.0
+            semantic = self.embed is not None and bool(self.entries)
+
+        # Embedded outside the lock, so other lookups do not wait for the embedding model
+        embedding = self._embed(query) if semantic else None
+        with self._lock:
+            if embedding is not None:
+                for expired_key in [k for k, e in self.entries.items() if self._expired(e)]:
+                    del self.entries[expired_key]
+                if self.entries:
+                    keys = list(self.entries)
+                    matrix = np.stack([self.entries[k]["embedding"] for k in keys])
+                    similarities = matrix @ embedding
+                    # "RTX 5090 power draw" must not be answered with the cached answer for "RTX 5080 power draw"
+                    similarities[[self.entries[k]["key_tokens"] != key_tokens for k in keys]] = -np.inf
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        self.entries.move_to_end(keys[best])
+                        self.stats["semantic_hits"] += 1
+                        return copy.deepcopy(self.entries[keys[best]]["response"]), "semantic", float(similarities[best])
+
+            self.stats["misses"] += 1
+            return None, None, 0.0
+
+    def put(self, query: str, response: dict[str, Any], sources: list[str]) -> None:
+        """Cache a response.
+
+        Args:
+            query: The user query.
+            response: The response to cache.
+            sources: Filenames of the chunks the response was generated from.
+
+        Returns:
+            None.
+        """
+        if self.max_entries <= 0:
+            return
+
+        key = self.normalize(query)
+        entry = {
+            "response": copy.deepcopy(response),
+            "embedding": self._embed(query) if self.embed is not None else None,
+            "key_tokens": self.key_tokens(query),
+            "sources": set(sources),
+            "created": monotonic()
+        }
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+                self.stats["evictions"] += 1
+
+    def invalidate_sources(self, sources: list[str]) -> int:
+        """Drop cached responses that depend on changed source files.
+
+        Responses generated without any context are dropped as well, since the changed files may now hold relevant information.
+
+        Args:
+            sources: Filenames that were added, changed or deleted.
+
+        Returns:
+            Number of entries dropped.
+        """
+        sources = set(sources)
+        if not sources:
+            return 0
+
+        with self._lock:
+            stale = [key for key, entry in self.entries.items() if not entry["sources"] or entry["sources"] & sources]
+            for key in stale:
+                del self.entries[key]
+            self.stats["invalidations"] += len(stale)
+        return len(stale)
+
+    def summary(self) -> str:
+        """Summarize the cache statistics for the logs.
+
+        Returns:
+            One-line summary of hits, misses and size.
+        """
+        with self._lock:
+            return (
+                f"exact hits: {self.stats['exact_hits']}, semantic hits: {self.stats['semantic_hits']}, "
+                f"misses: {self.stats['misses']}, entries: {len(self.entries)}/{self.max_entries}"
+            )
@@ -1,35 +1,202 @@
 from typing import Any
+from collections import defaultdict
+import asyncio
+import json
+import tracing
 
 class Retriever:
-    def __init__(self, vector_store):
+    def __init__(self, vector_store, hybrid: bool = False, candidate_k: int = 20, rrf_k: int = 60, reranker = None, scope = None):
         """Initialize the retriever with a vector store.
         
         Args:
             vector_store: VectorStore instance.
+            (optional) hybrid: Fuse dense results with BM25 results from the vector store's lexical index using reciprocal-rank fusion. Default is False.
+            (optional) candidate_k: Number of candidates taken from each first-stage ranking before fusion or re-ranking. Default is 20.
+            (optional) rrf_k: Rank offset of reciprocal-rank fusion. Larger values flatten the contribution of top ranks. Default is 60.
+            (optional) reranker: Reranker instance that picks the final chunks from the first-stage candidates. Default is None, which keeps the first-stage order.
+            (optional) scope: SourceScope that restricts queries naming an entity to the source files about it, when no filter is given. Default is None, which searches every source.
         """
         self.vector_store = vector_store
+        self.hybrid = hybrid and getattr(vector_store, "lexical_index", None) is not None
+        self.candidate_k = candidate_k
+        self.rrf_k = rrf_k
+        self.reranker = reranker
+        self.scope = scope
     
-    def retrieve(self, query: str, top_k: int = 3) -> list[dict[str, Any]]:
+    def _filter(self, query: str, where: dict[str, Any] = None) -> dict[str, Any]:
+        """Pick the metadata filter a query is searched with.
+        
+        Args:
+            query: The user query string.
+            (optional) where: Filter given by the caller. Default is None.
+            
+        Returns:
+            The caller's filter, else the automatic scope's filter for the query, or None to search every chunk.
+        """
+        if where is None and self.scope is not None:
+            where = self.scope.where(query)
+            if where is not None:
+                tracing.annotate(retrieval_scope = where["filename"]["$in"])
+        return where
+    
+    def retrieve(self, query: str, top_k: int = 3, query_embedding: Any = None, where: dict[str, Any] = None) -> list[dict[str, Any]]:
         """Retrieve the top_k most relevant chunks for the query.
         
         Args:
             query: The user query string.
             (optional) top_k: Number of chunks to retrieve. Default is 3.
+            (optional) query_embedding: Precomputed embedding of the query. Default is None, which embeds the query through the vector store's query embedding cache.
+            (optional) where: Metadata filter with ChromaDB's where operators, e.g. {"filename": "nvidia_rtx_50_series.txt"} or {"file_type": {"$in": [".pdf", ".txt"]}}. Only matching chunks are scored. Default is None, which uses the automatic scope if there is one.
             
         Returns:
             List of the top_k most relevant chunks with their metadata and relevance scores. Relevance scores are calculated as 1 / (1 + cosine_sim_distance).
         """
-        if self.vector_store.collection is None or self.vector_store.collection.count() == 0:
-            raise ValueError("Vector store is empty. Please add documents first.")
+        if query_embedding is None:
+            query_embedding = self.vector_store.embed_query(query)
+        where = self._filter(query, where)
+        # Files re-indexed while serving are swapped in under the write side of this lock, so a query sees one version of them
+        with self.vector_store.swap_lock.reading():
+            if self.vector_store.count() == 0:
+                raise ValueError("Vector store is empty. Please add documents first.")
+            
+            if not self.hybrid and self.reranker is None:
+                return self._score(self.vector_store.search(query, top_k, query_embedding, where = where))
+            
+            dense = self.vector_store.search(query, max(top_k, self.candidate_k), query_embedding, self.reranker is not None, where = where)
+            return self._score(self._second_stage(query, dense, top_k, query_embedding, where))
+    
+    def retrieve_batch(self, queries: list[str], top_k: int = 3, query_embeddings: list[Any] = None, where: dict[str, Any] = None) -> list[list[dict[str, Any]]]:
+        """Retrieve the top_k most relevant chunks for several queries with one embedding batch and one search per distinct filter.
+        
+        Args:
+            queries: List of user query strings.
+            (optional) top_k: Number of chunks to retrieve per query. Default is 3.
+            (optional) query_embeddings: Precomputed embeddings of the queries. Default is None.
+            (optional) where: Metadata filter applied to every query. Default is None, which scopes each query automatically if there is an automatic scope.
+            
+        Returns:
+            One list of retrieved chunks per query, as returned by retrieve().
+        """
+        if query_embeddings is None:
+            query_embeddings = self.vector_store.embed_queries(queries)
+        # Queries scoped to the same sources share a search
+        groups = defaultdict(list)
+        filters = {}
+        for i, query in enumerate(queries):
+            query_filter = self._filter(query, where)
+            key = json.dumps(query_filter, sort_keys = True)
+            filters[key] = query_filter
+            groups[key].append(i)
+        
+        results = [None] * len(queries)
+        with self.vector_store.swap_lock.reading():
+            if self.vector_store.count() == 0:
+                raise ValueError("Vector store is empty. Please add documents first.")
+            
+            for key, indices in groups.items():
+                group_queries = [queries[i] for i in indices]
+                group_embeddings = [query_embeddings[i] for i in indices]
+                if not self.hybrid and self.reranker is None:
+                    chunk_lists = [self._score(found) for found in self.vector_store.search_batch(group_queries, top_k, group_embeddings, where = filters[key])]
+                else:
+                    dense_lists = self.vector_store.search_batch(group_queries, max(top_k, self.candidate_k), group_embeddings, self.reranker is not None, where = filters[key])
+                    chunk_lists = [
+                        self._score(self._second_stage(query, dense, top_k, query_embedding, filters[key]))
+                        for query, dense, query_embedding in zip(group_queries, dense_lists, group_embeddings)
+                    ]
+                for i, chunks in zip(indices, chunk_lists):
+                    results[i] = chunks
+        return results
+    
+    def _second_stage(self, query: str, dense: list[dict[str, Any]], top_k: int, query_embedding: Any, where: dict[str, Any] = None) -> list[dict[str, Any]]:
+        """Narrow the wide first-stage candidates down to the final top_k.
+        
+        Args:
+            query: The user query string.
+            dense: Dense search results, best first.
+            top_k: Number of results to return.
+            query_embedding: Embedding of the query.
+            (optional) where: Metadata filter the dense search was run with. Default is None.
+            
+        Returns:
+            The top_k results, fused and/or re-ranked, best first.
+        """
+        if self.reranker is None:
+            return self._fuse(query, dense, top_k, query_embedding, where)
         
-        results = self.vector_store.search(query, top_k)
+        candidates = self._fuse(query, dense, max(top_k, self.candidate_k), query_embedding, where) if self.hybrid else dense
+        with tracing.span("rerank", candidates = len(candidates)):
+            return self.reranker.rerank(query, query_embedding, candidates, top_k)
+    
+    def _fuse(self, query: str, dense: list[dict[str, Any]], top_k: int, query_embedding: Any, where: dict[str, Any] = None) -> list[dict[str, Any]]:
+        """Fuse dense and lexical rankings with reciprocal-rank fusion.
+        
+        Args:
+            query: The user query string.
+            dense: Dense search results, best first.
+            top_k: Number of fused results to return.
+            query_embedding: Embedding of the query, used to measure the distance of chunks found only lexically.
+            (optional) where: Metadata filter the lexical search is restricted to as well. Default is None.
+            
+        Returns:
+            The top_k fused results with their 'fusion_score', best first.
+        """
+        with tracing.span("lexical_search"):
+            lexical = self.vector_store.lexical_index.search(query, max(top_k, self.candidate_k), where)
+        
+        fusion_scores = defaultdict(float)
+        for rank, result in enumerate(dense):
+            fusion_scores[result['id']] += 1.0 / (self.rrf_k + rank + 1)
+        for rank, (chunk_id, _) in enumerate(lexical):
+            fusion_scores[chunk_id] += 1.0 / (self.rrf_k + rank + 1)
+        
+        top_ids = sorted(fusion_scores, key = fusion_scores.get, reverse = True)[:top_k]
+        results_by_id = {result['id']: result for result in dense}
+        missing = [chunk_id for chunk_id in top_ids if chunk_id not in results_by_id]
+        results_by_id.update({result['id']: result for result in self.vector_store.get_chunks(missing, query_embedding)})
         
+        return [
+            {**results_by_id[chunk_id], 'fusion_score': fusion_scores[chunk_id]}
+            for chunk_id in top_ids if chunk_id in results_by_id
+        ]
+    
+    @staticmethod
+    def _score(results: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Attach relevance scores to search results.
+        
+        Args:
+            results: Results from the vector store.
+            
+        Returns:
+            List of chunks with 'id', 'content', 'metadata' and 'relevance_score', plus 'fusion_score' for hybrid results and 'rerank_score' for re-ranked results.
+        """
         retrieved_chunks = []
         for result in results:
-            retrieved_chunks.append({
+            chunk = {
+                'id': result.get('id'),
                 'content': result['content'],
                 'metadata': result['metadata'],
                 'relevance_score': float(1.0 / (1.0 + result.get('distance', 0)))
-            })
+            }
+            for key in ('fusion_score', 'rerank_score'):
+                if key in result:
+                    chunk[key] = result[key]
+            retrieved_chunks.append(chunk)
+        
+        return retrieved_chunks
+    
+    async def aretrieve(self, query: str, top_k: int = 3, query_embedding: Any = None, where: dict[str, Any] = None) -> list[dict[str, Any]]:
+        """Asynchronously retrieve the top_k most relevant chunks for the query.
+        
+        The search runs on a worker thread so the event loop keeps serving other queries while it runs.
         
-        return retrieved_chunks
\ No newline at end of file
+        Args:
+            query: The user query string.
+            (optional) top_k: Number of chunks to retrieve. Default is 3.
+            (optional) query_embedding: Precomputed embedding of the query. Default is None.
+            (optional) where: Metadata filter, as in retrieve(). Default is None.
+            
+        Returns:
+            Same as retrieve().
+        """
+        return await asyncio.to_thread(self.retrieve, query, top_k, query_embedding, where)
\ No newline at end of file
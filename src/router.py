@@ -0,0 +1,278 @@
+import re
+import ast
+import math
+import operator
+import threading
+from collections import defaultdict
+from typing import Any, Iterable
+
+from response_cache import ResponseCache
+from structured_store import StructuredStore
+
+class Calculator:
+    OPERATORS = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Div: operator.truediv,
+        ast.FloorDiv: operator.floordiv,
+        ast.Mod: operator.mod,
+        ast.Pow: operator.pow,
+        ast.USub: operator.neg,
+        ast.UAdd: operator.pos
+    }
+    PREFIX_PATTERN = re.compile(r"^(what\s+is|what's|whats|calculate|compute|evaluate|solve)\s+", re.IGNORECASE)
+    EXPRESSION_PATTERN = re.compile(r"^[\d\s.+\-*/%()]*\d[\d\s.+\-*/%()]*$")
+    # Phone numbers, dates and IDs: digit groups joined by unspaced hyphens, one of them long or zero-padded
+    IDENTIFIER_PATTERN = re.compile(r"^(?=.*(?:\d{3}|(?:^|-)0\d))\+?\d+(?:-\d+){2,}$|^\(\d+\)\s*\d+-\d+$")
+    # Year ranges such as "2010-2020" are only calculated after an explicit cue like "calculate"
+    YEAR_RANGE_PATTERN = re.compile(r"^\d{4}\s*-\s*\d{4}$")
+    MAX_DIGITS = 1000
+
+    @classmethod
+    def parse(cls, query: str) -> str:
+        """Extract an arithmetic expression from a query.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            The expression in Python syntax, or None if the query is not plain arithmetic or does not parse.
+        """
+        expression, cued = cls.PREFIX_PATTERN.subn("", query.strip())
+        expression = expression.rstrip("?= ").strip()
+        expression = expression.replace("×", "*").replace("÷", "/").replace("^", "**").replace(",", "")
+        expression = re.sub(r"(?<=[\d)\s])x(?=[\d(\s])", "*", expression)
+        if not cls.EXPRESSION_PATTERN.match(expression) or not re.search(r"\d\s*[-+*/%]", expression):
+            return None
+        if cls.IDENTIFIER_PATTERN.match(expression) or (not cued and cls.YEAR_RANGE_PATTERN.match(expression)):
+            return None
+        try:
+            ast.parse(expression, mode = "eval")
+        except SyntaxError:
+            # Version numbers and the like, e.g. "3.5.6 + 1", go to retrieval instead
+            return None
+        return expression
+
+    @classmethod
+    def _check_size(cls, value: float) -> float:
+        """Reject a value that is too large to compute with or print.
+
+        Args:
+            value: An intermediate or final result.
+
+        Returns:
+            The value.
+
+        Raises:
+            ValueError: If the value has more than MAX_DIGITS digits, is infinite or not a number, or is complex.
+        """
+        if isinstance(value, complex):
+            raise ValueError("Result is not a real number.")
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError("Result is too large.")
+        if isinstance(value, int) and value.bit_length() * math.log10(2) > cls.MAX_DIGITS:
+            raise ValueError("Result is too large.")
+        return value
+
+    @classmethod
+    def _evaluate(cls, node: ast.AST) -> float:
+        """Evaluate a parsed arithmetic expression without calling eval().
+
+        Every intermediate result is bounded to MAX_DIGITS digits, and a power is rejected before it is computed if its result would exceed that.
+
+        Args:
+            node: Node of the parsed expression.
+
+        Returns:
+            The value of the node.
+
+        Raises:
+            ValueError: If the node is not plain arithmetic or a result is too large.
+        """
+        if isinstance(node, ast.Expression):
+            return cls._evaluate(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.UnaryOp) and type(node.op) in cls.OPERATORS:
+            return cls.OPERATORS[type(node.op)](cls._evaluate(node.operand))
+        if isinstance(node, ast.BinOp) and type(node.op) in cls.OPERATORS:
+            left, right = cls._evaluate(node.left), cls._evaluate(node.right)
+            if isinstance(node.op, ast.Pow) and left and right * math.log10(abs(left)) > cls.MAX_DIGITS:
+                raise ValueError("Result is too large.")
+            return cls._check_size(cls.OPERATORS[type(node.op)](left, right))
+        raise ValueError("Unsupported expression.")
+
+    @classmethod
+    def calculate(cls, expression: str) -> str:
+        """Evaluate an arithmetic expression.
+
+        Args:
+            expression: Expression returned by parse().
+
+        Returns:
+            The result, or an error message if it cannot be evaluated.
+        """
+        try:
+            value = cls._evaluate(ast.parse(expression, mode = "eval"))
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            return f"{expression.replace('**', '^')} = {value}"
+        except ZeroDivisionError:
+            return "Error: division by zero."
+        except OverflowError:
+            return "Error: Result is too large."
+        except (ValueError, SyntaxError) as e:
+            return f"Error: {e}"
+
+class FAQTable:
+    QUESTION_PATTERN = re.compile(r"^(?:\*\*)?(?:\d+\.\s*)?(?P<question>[^*].*?\?)(?:\*\*)?$")
+
+    def __init__(self):
+        """Initialize the exact-match table of FAQ questions and their answers."""
+        self.entries = {}
+        self.sources = defaultdict(set)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_faq_file(filename: str) -> bool:
+        """Check whether a file is an FAQ document.
+
+        Args:
+            filename: Name of the file.
+
+        Returns:
+            True if the filename contains "faq".
+        """
+        return "faq" in filename.lower()
+
+    @classmethod
+    def parse(cls, text: str) -> list[tuple[str, str]]:
+        """Split an FAQ document into question and answer pairs.
+
+        A question is a line ending in a question mark, optionally numbered or in **bold**. Its answer is the text up to the next question.
+
+        Args:
+            text: Text of the FAQ document.
+
+        Returns:
+            List of (question, answer) pairs.
+        """
+        pairs = []
+        question, answer = None, []
+        for line in text.splitlines():
+            match = cls.QUESTION_PATTERN.match(line.strip())
+            if match and len(line.strip()) <= 200:
+                if question and answer:
+                    pairs.append((question, " ".join(answer)))
+                question, answer = match.group("question").strip(), []
+            elif question and line.strip():
+                answer.append(line.strip())
+        if question and answer:
+            pairs.append((question, " ".join(answer)))
+        return pairs
+
+    def add_documents(self, documents: Iterable[dict[str, Any]]) -> int:
+        """Add the questions of FAQ documents to the table.
+
+        Args:
+            documents: Documents with 'content' and 'metadata'. Pages of the same file are joined before parsing.
+
+        Returns:
+            Number of questions added.
+        """
+        texts = defaultdict(list)
+        for document in documents:
+            texts[document['metadata'].get('filename')].append(document['content'])
+
+        added = 0
+        with self._lock:
+            for filename, pages in texts.items():
+                for question, answer in self.parse("\n".join(pages)):
+                    key = ResponseCache.normalize(question)
+                    self.entries[key] = {"question": question, "answer": answer, "filename": filename}
+                    self.sources[filename].add(key)
+                    added += 1
+        return added
+
+    def remove_sources(self, sources: list[str]) -> None:
+        """Remove the questions that came from the given files.
+
+        Args:
+            sources: Filenames whose questions should be removed.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            for source in sources:
+                for key in self.sources.pop(source, set()):
+                    if self.entries.get(key, {}).get("filename") == source:
+                        del self.entries[key]
+
+    def lookup(self, query: str) -> dict[str, Any]:
+        """Find the FAQ entry whose question matches the query exactly, ignoring case, punctuation and spacing.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            Dictionary with 'question', 'answer' and 'filename', or None if there is no match.
+        """
+        return self.entries.get(ResponseCache.normalize(query))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+class QueryRouter:
+    # Rough per-query estimates shown in the logs, so the cost of each route is visible
+    ROUTES = {
+        "calculator": {"latency_ms": 0.1, "llm_calls": 0, "retrieval": False},
+        "faq": {"latency_ms": 0.1, "llm_calls": 0, "retrieval": False},
+        "structured": {"latency_ms": 600, "llm_calls": 1, "retrieval": False},
+        "smalltalk": {"latency_ms": 500, "llm_calls": 1, "retrieval": False},
+        "rag": {"latency_ms": 1500, "llm_calls": 1, "retrieval": True}
+    }
+    SMALLTALK_PATTERN = re.compile(
+        r"^(hi|hii+|hello|hey|hey there|yo|greetings|good (morning|afternoon|evening|night)|how are you( doing)?|"
+        r"how s it going|what s up|sup|thanks|thank you|thank you so much|thanks a lot|ok|okay|cool|great|nice|"
+        r"who are you|what are you|what is your name|what s your name|goodbye|see you|see ya)( there| again| today)?$"
+    )
+
+    def __init__(self, faq_table: FAQTable = None, structured_store: StructuredStore = None):
+        """Initialize the router that picks the cheapest route able to answer a query.
+
+        Args:
+            (optional) faq_table: FAQTable instance used for the FAQ route. Default is None, which disables it.
+            (optional) structured_store: StructuredStore instance used for filters and aggregations over tabular files. Default is None, which disables the structured route.
+        """
+        self.faq_table = faq_table
+        self.structured_store = structured_store
+
+    def route(self, query: str) -> tuple[str, Any]:
+        """Classify a query.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            Tuple containing the route name ("calculator", "faq", "structured", "smalltalk" or "rag") and its payload: the answer for routes that need no LLM call, the query result for the structured route, otherwise None.
+        """
+        expression = Calculator.parse(query)
+        if expression is not None:
+            return "calculator", Calculator.calculate(expression)
+
+        if self.faq_table is not None:
+            entry = self.faq_table.lookup(query)
+            if entry is not None:
+                return "faq", entry
+
+        if self.structured_store is not None:
+            result = self.structured_store.query(query)
+            if result is not None:
+                return "structured", result
+
+        if self.SMALLTALK_PATTERN.match(ResponseCache.normalize(query)):
+            return "smalltalk", None
+
+        return "rag", None
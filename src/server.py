@@ -0,0 +1,248 @@
+import asyncio
+from collections import deque
+from time import perf_counter
+from typing import Any
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from main import main, build_arg_parser
+from retrieval import Retriever
+from agent import Agent, serialize_response
+from tracing import PrometheusMetrics
+from cascade import ModelCascade
+
+class QueryBatcher:
+    def __init__(self, retriever: Retriever, max_batch_size: int = 16, max_wait_ms: float = 5.0, max_queue: int = 256):
+        """Initialize the micro-batcher that groups concurrent retrievals into one embedding and search call.
+
+        It exposes the same retrieve()/aretrieve() interface as Retriever, so an Agent can use it in place of one.
+
+        Args:
+            retriever: Retriever instance used to run the batched searches.
+            (optional) max_batch_size: Maximum number of queries per batch. Default is 16.
+            (optional) max_wait_ms: Milliseconds to wait for more queries after the first one arrives. Default is 5.0.
+            (optional) max_queue: Maximum number of queries waiting to be batched. Further queries are rejected. Default is 256.
+        """
+        self.retriever = retriever
+        self.vector_store = retriever.vector_store
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize = max_queue)
+        self.batch_sizes = deque(maxlen = 1000)
+        self._task = None
+
+    def start(self) -> None:
+        """Start the background batching task on the running event loop.
+
+        Returns:
+            None.
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background batching task.
+
+        Returns:
+            None.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def retrieve(self, query: str, top_k: int = 3, query_embedding: Any = None) -> list[dict[str, Any]]:
+        """Retrieve chunks for a single query without batching.
+
+        Args:
+            query: The user query string.
+            (optional) top_k: Number of chunks to retrieve. Default is 3.
+            (optional) query_embedding: Precomputed embedding of the query. Default is None.
+
+        Returns:
+            Same as Retriever.retrieve().
+        """
+        return self.retriever.retrieve(query, top_k, query_embedding)
+
+    async def aretrieve(self, query: str, top_k: int = 3, query_embedding: Any = None) -> list[dict[str, Any]]:
+        """Queue a query for the next batch and wait for its chunks.
+
+        Args:
+            query: The user query string.
+            (optional) top_k: Number of chunks to retrieve. Default is 3.
+            (optional) query_embedding: Ignored; embeddings are computed for the whole batch.
+
+        Returns:
+            Same as Retriever.retrieve().
+
+        Raises:
+            asyncio.QueueFull: If the batching queue is full.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((query, top_k, future))
+        return await future
+
+    async def _run(self) -> None:
+        """Collect queued queries into batches and resolve them with one search per batch.
+
+        Returns:
+            None.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.batch_sizes.append(len(batch))
+            queries = [query for query, _, _ in batch]
+            top_k = max(k for _, k, _ in batch)
+            try:
+                results = await asyncio.to_thread(self.retriever.retrieve_batch, queries, top_k)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, k, future), chunks in zip(batch, results):
+                if not future.done():
+                    future.set_result(chunks[:k])
+
+class LatencyTracker:
+    def __init__(self, window: int = 10000):
+        """Initialize the tracker of recent request latencies.
+
+        Args:
+            (optional) window: Number of most recent latencies kept. Default is 10000.
+        """
+        self.latencies = deque(maxlen = window)
+        self.rejected = 0
+        self.errors = 0
+
+    def record(self, seconds: float) -> None:
+        """Record the latency of a completed request.
+
+        Args:
+            seconds: Request latency in seconds.
+
+        Returns:
+            None.
+        """
+        self.latencies.append(seconds)
+
+    def summary(self) -> dict[str, Any]:
+        """Summarize the recorded latencies.
+
+        Returns:
+            Dictionary with the request count and p50/p95/p99 latency in milliseconds.
+        """
+        if not self.latencies:
+            return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "rejected": self.rejected, "errors": self.errors}
+        p50, p95, p99 = np.percentile(np.fromiter(self.latencies, dtype = float), [50, 95, 99]) * 1000
+        return {"count": len(self.latencies), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "rejected": self.rejected, "errors": self.errors}
+
+class QueryRequest(BaseModel):
+    query: str
+
+def create_app(rag: main, max_batch_size: int = 16, max_wait_ms: float = 5.0, max_queue: int = 256, max_in_flight: int = 64) -> FastAPI:
+    """Create the HTTP application serving a RAG pipeline that was built once.
+
+    Args:
+        rag: The main instance holding the loaded index and LLM service.
+        (optional) max_batch_size: Maximum number of queries retrieved together. Default is 16.
+        (optional) max_wait_ms: Milliseconds to wait for more queries to fill a batch. Default is 5.0.
+        (optional) max_queue: Maximum number of queries waiting for retrieval. Default is 256.
+        (optional) max_in_flight: Maximum number of queries admitted at once. Further queries get HTTP 503. Default is 64.
+
+    Returns:
+        The FastAPI application.
+    """
+    batcher = QueryBatcher(rag.retriever, max_batch_size, max_wait_ms, max_queue)
+    if rag.tracer.metrics is None:
+        rag.tracer.metrics = PrometheusMetrics()
+    agent = Agent(batcher, rag.llm_service, rag.cache, rag.context_builder, rag.router, rag.tracer)
+    latency = LatencyTracker()
+    state = {"in_flight": 0}
+    ingest_lock = asyncio.Lock()
+
+    app = FastAPI(title = "RAG Agent System")
+    app.add_event_handler("startup", batcher.start)
+    app.add_event_handler("shutdown", batcher.stop)
+
+    @app.post("/query")
+    async def query(request: QueryRequest) -> dict[str, Any]:
+        if state["in_flight"] >= max_in_flight:
+            latency.rejected += 1
+            raise HTTPException(status_code = 503, detail = "Server is at capacity. Please retry later.", headers = {"Retry-After": "1"})
+
+        state["in_flight"] += 1
+        start = perf_counter()
+        try:
+            response = await agent.aprocess_query(request.query)
+        except asyncio.QueueFull:
+            latency.rejected += 1
+            raise HTTPException(status_code = 503, detail = "Retrieval queue is full. Please retry later.", headers = {"Retry-After": "1"})
+        except Exception as e:
+            latency.errors += 1
+            raise HTTPException(status_code = 500, detail = str(e))
+        finally:
+            state["in_flight"] -= 1
+
+        elapsed = perf_counter() - start
+        latency.record(elapsed)
+        body = serialize_response(response)
+        body["latency_ms"] = elapsed * 1000
+        return body
+
+    @app.post("/ingest")
+    async def ingest() -> dict[str, Any]:
+        async with ingest_lock:
+            changed, deleted = await asyncio.to_thread(rag._sync_index, atomic = True)
+        return {"reindexed": changed, "removed": deleted, "chunks": rag.vector_store.count()}
+
+    @app.get("/stats")
+    async def stats() -> dict[str, Any]:
+        return {
+            "latency": latency.summary(),
+            "in_flight": state["in_flight"],
+            "queued": batcher.queue.qsize(),
+            "mean_batch_size": float(np.mean(batcher.batch_sizes)) if batcher.batch_sizes else None,
+            "response_cache": rag.cache.stats if rag.cache is not None else None,
+            "llm_backends": rag.llm_service.backend_stats(),
+            "cascade": rag.llm_service.summary() if isinstance(rag.llm_service, ModelCascade) else None
+        }
+
+    @app.get("/metrics", response_class = PlainTextResponse)
+    async def metrics() -> str:
+        return rag.tracer.metrics.render()
+
+    @app.get("/health")
+    async def health() -> dict[str, Any]:
+        return {"status": "ok", "chunks": rag.vector_store.count()}
+
+    return app
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = build_arg_parser()
+    parser.description = "Serve the RAG Agent System over HTTP."
+    parser.add_argument("--host", default = "127.0.0.1", help = "Host to bind to. Defaults to 127.0.0.1.")
+    parser.add_argument("--port", type = int, default = 8000, help = "Port to listen on. Defaults to 8000.")
+    parser.add_argument("--max_batch_size", type = int, default = 16, help = "Maximum number of queries embedded and searched together. Defaults to 16.")
+    parser.add_argument("--max_wait_ms", type = float, default = 5.0, help = "Milliseconds to wait for more queries to fill a batch. Defaults to 5.")
+    parser.add_argument("--max_queue", type = int, default = 256, help = "Maximum number of queries waiting for retrieval. Defaults to 256.")
+    parser.add_argument("--max_in_flight", type = int, default = 64, help = "Maximum number of queries admitted at once. Further queries get HTTP 503. Defaults to 64.")
+    args = parser.parse_args()
+    app = create_app(main(args), args.max_batch_size, args.max_wait_ms, args.max_queue, args.max_in_flight)
+    uvicorn.run(app, host = args.host, port = args.port)
@@ -0,0 +1,34 @@
+import sys
+from multiprocessing.connection import Client, Connection
+from vector_backends import MmapBackend
+
+def serve(connection: Connection) -> None:
+    """Serve one shard of a ShardedBackend: open the shard named in the first message, then run the backend calls received over the connection and send back their results.
+
+    Args:
+        connection: Connection to the ShardedBackend.
+
+    Returns:
+        None.
+    """
+    path, options = connection.recv()
+    backend = MmapBackend(path, **options)
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            # The parent exited without closing the backend
+            break
+        if request is None:
+            break
+        method, args = request
+        try:
+            connection.send((True, getattr(backend, method)(*args)))
+        except Exception as e:
+            connection.send((False, e))
+    connection.close()
+
+if __name__ == "__main__":
+    # Started as a script so only NumPy and the backend are imported, not the application that started it
+    # The key comes on stdin so it does not show up in the process list
+    serve(Client(sys.argv[1], authkey = bytes.fromhex(sys.stdin.readline().strip())))
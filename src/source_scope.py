@@ -0,0 +1,82 @@
+import os
+import threading
+from typing import Any
+from lexical_index import LexicalIndex
+
+class SourceScope:
+    # Filename words that describe the kind of file rather than what it is about
+    GENERIC_TERMS = frozenset("faq faqs data info document documents file files list table sheet notes guide manual series misc".split())
+
+    def __init__(self, min_term_length: int = 3):
+        """Initialize the automatic scope that maps entities named in a query to the source files about them.
+
+        Entities are taken from the filenames: "nvidia_rtx_50_series.txt" is about "nvidia" and "rtx", so a query naming either is only searched in that file. Words shared by half or more of the files, and generic words like "faq", name no entity.
+
+        Args:
+            (optional) min_term_length: Minimum length of a filename word to count as an entity. Default is 3.
+        """
+        self.min_term_length = min_term_length
+        self.term_sources = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stem(term: str) -> str:
+        """Reduce a term to a crude singular, so "movie" matches "movies".
+
+        Args:
+            term: Lowercase term.
+
+        Returns:
+            The stemmed term.
+        """
+        return term[:-1] if len(term) > 3 and term.endswith("s") and not term.endswith("ss") else term
+
+    def update(self, sources: list[str], links: dict[str, list[str]] = None) -> None:
+        """Rebuild the entity map from the current source files.
+
+        Args:
+            sources: Filenames in the index.
+            (optional) links: Files each file shares deduplicated chunks with. A chunk found in several files is stored under only one of them, so a query scoped to a file is also searched in the files linked to it. Default is None.
+
+        Returns:
+            None.
+        """
+        term_sources = {}
+        for source in sources:
+            for term in LexicalIndex.tokenize(os.path.splitext(source)[0]):
+                if len(term) >= self.min_term_length and not term.isdigit() and term not in self.GENERIC_TERMS:
+                    term_sources.setdefault(self._stem(term), set()).add(source)
+        links = links or {}
+        with self._lock:
+            self.term_sources = {
+                term: matched.union(*(links.get(source, ()) for source in matched))
+                for term, matched in term_sources.items() if len(matched) * 2 < len(sources)
+            }
+
+    def sources_for(self, query: str) -> list[str]:
+        """Find the source files the entities named in a query belong to.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            Sorted filenames, or an empty list if the query names no entity.
+        """
+        with self._lock:
+            term_sources = self.term_sources
+        sources = set()
+        for term in LexicalIndex.tokenize(query):
+            sources |= term_sources.get(self._stem(term), set())
+        return sorted(sources)
+
+    def where(self, query: str) -> dict[str, Any]:
+        """Build the metadata filter that scopes a query to the sources it names.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            Filter on the 'filename' metadata, or None to search every source.
+        """
+        sources = self.sources_for(query)
+        return {"filename": {"$in": sources}} if sources else None
@@ -0,0 +1,398 @@
+import os
+import re
+import csv
+import json
+import sqlite3
+import threading
+from typing import Any
+
+class StructuredStore:
+    TABULAR_EXTENSIONS = ('.csv', '.json')
+    NUMBER = r"(\d+(?:\.\d+)?)"
+    COMPARISON_PATTERN = re.compile(
+        r"(?P<op>>=|<=|>|<|=|\b(?:at least|no less than|at most|no more than|more than|greater than|higher than|above|over|"
+        r"less than|lower than|below|under|after|later than|since|before|earlier than|between|from|in|of|is|equals?)\b)\s*"
+        + NUMBER + r"(?:\s*(?:and|to|-)\s*" + NUMBER + r")?"
+    )
+    OPERATORS = {
+        ">=": ">=", "at least": ">=", "no less than": ">=", "since": ">=",
+        "<=": "<=", "at most": "<=", "no more than": "<=",
+        ">": ">", "more than": ">", "greater than": ">", "higher than": ">", "above": ">", "over": ">", "after": ">", "later than": ">",
+        "<": "<", "less than": "<", "lower than": "<", "below": "<", "under": "<", "before": "<", "earlier than": "<",
+        "=": "=", "in": "=", "of": "=", "is": "=", "equal": "=", "equals": "=",
+        "between": "between", "from": "between"
+    }
+    # Words that refer to a year column without naming it
+    YEAR_WORDS = ("released", "published", "written", "came out", "year")
+    DESCENDING_WORDS = ("highest", "best", "top", "maximum", "max", "largest", "most", "newest", "latest", "most recent")
+    ASCENDING_WORDS = ("lowest", "worst", "minimum", "min", "smallest", "least", "oldest", "earliest")
+    # A value named in the question only filters the rows on its own when the question asks for a list, e.g. "list all drama movies"
+    LISTING_PATTERN = re.compile(r"\b(list|all|every)\b")
+
+    def __init__(self, max_rows: int = 20):
+        """Initialize the in-memory SQLite store holding tabular sources with typed columns.
+
+        Args:
+            (optional) max_rows: Maximum number of rows returned by a structured query. Default is 20.
+        """
+        self.max_rows = max_rows
+        self.connection = sqlite3.connect(":memory:", check_same_thread = False)
+        self.tables = {}
+        self.sources = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def is_tabular_file(cls, filename: str) -> bool:
+        """Check whether a file is loaded into the structured store.
+
+        Args:
+            filename: Name of the file.
+
+        Returns:
+            True for CSV and JSON files.
+        """
+        return os.path.splitext(filename)[1].lower() in cls.TABULAR_EXTENSIONS
+
+    @staticmethod
+    def _read_records(file_path: str) -> list[dict[str, Any]]:
+        """Read the records of a CSV file or a JSON array of objects.
+
+        Args:
+            file_path: Path of the file.
+
+        Returns:
+            List of records. Empty if the file holds no records.
+        """
+        if file_path.lower().endswith('.csv'):
+            with open(file_path, 'r', encoding = 'utf-8', newline = '') as f:
+                return list(csv.DictReader(f))
+
+        with open(file_path, 'r', encoding = 'utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            # Accept {"items": [...]}-style files by taking the first list of objects
+            data = next((value for value in data.values() if isinstance(value, list)), [data])
+        return [record for record in data if isinstance(record, dict)] if isinstance(data, list) else []
+
+    @staticmethod
+    def _column_type(values: list[Any]) -> str:
+        """Infer the SQLite type of a column from its values.
+
+        Args:
+            values: Non-empty values of the column.
+
+        Returns:
+            "INTEGER", "REAL" or "TEXT".
+        """
+        column_type = "INTEGER"
+        for value in values:
+            if isinstance(value, bool) or isinstance(value, (list, dict)):
+                return "TEXT"
+            try:
+                if float(value) != int(float(value)) or (isinstance(value, str) and "." in value):
+                    column_type = "REAL"
+            except (TypeError, ValueError):
+                return "TEXT"
+        return column_type
+
+    @staticmethod
+    def _table_name(filename: str) -> str:
+        """Derive a table name from a filename.
+
+        Args:
+            filename: Name of the file.
+
+        Returns:
+            The file's stem with non-alphanumeric characters replaced by underscores.
+        """
+        return re.sub(r"\W", "_", os.path.splitext(filename)[0].lower())
+
+    @staticmethod
+    def _column_names(keys: list[Any]) -> dict[Any, str]:
+        """Derive unique column names from the keys of the records.
+
+        SQLite compares column names case-insensitively, so names are lowercased and repeats get a numeric suffix, e.g. "Name" and "name" become "name" and "name_2".
+
+        Args:
+            keys: Record keys in column order.
+
+        Returns:
+            Dictionary mapping each key to its column name.
+        """
+        names = {}
+        for key in keys:
+            base = str(key).strip().lower() or "column"
+            name, suffix = base, 2
+            while name in names.values():
+                name, suffix = f"{base}_{suffix}", suffix + 1
+            names[key] = name
+        return names
+
+    @staticmethod
+    def _quote(identifier: str) -> str:
+        """Quote a table or column name for use in SQL.
+
+        Args:
+            identifier: The name.
+
+        Returns:
+            The name in double quotes, with double quotes inside it doubled.
+        """
+        return '"' + identifier.replace('"', '""') + '"'
+
+    def load_file(self, data_dir: str, filename: str) -> int:
+        """Load a tabular file into its own table, replacing any previous version.
+
+        Args:
+            data_dir: Directory containing the file.
+            filename: Name of the file.
+
+        Returns:
+            Number of rows loaded.
+        """
+        try:
+            records = self._read_records(os.path.join(data_dir, filename))
+        except (OSError, ValueError) as e:
+            print(f"Error loading {filename} into the structured store: {str(e)}")
+            return 0
+
+        names = self._column_names(list(dict.fromkeys(key for record in records for key in record)))
+        if not names:
+            return 0
+        types = {
+            name: self._column_type([record[key] for record in records if record.get(key) not in (None, "")])
+            for key, name in names.items()
+        }
+        casts = {"INTEGER": lambda value: int(float(value)), "REAL": float, "TEXT": lambda value: value if isinstance(value, str) else json.dumps(value)}
+        rows = [
+            [None if record.get(key) in (None, "") else casts[types[name]](record[key]) for key, name in names.items()]
+            for record in records
+        ]
+
+        table = self._table_name(filename)
+        quoted = self._quote(table)
+        column_sql = ", ".join(f"{self._quote(name)} {column_type}" for name, column_type in types.items())
+        with self._lock:
+            try:
+                self.connection.execute(f"DROP TABLE IF EXISTS {quoted}")
+                self.connection.execute(f"CREATE TABLE {quoted} ({column_sql})")
+                self.connection.executemany(f'INSERT INTO {quoted} VALUES ({", ".join("?" * len(types))})', rows)
+                self.connection.commit()
+                values = {
+                    name: {str(value).lower(): value for (value,) in self.connection.execute(f"SELECT DISTINCT {self._quote(name)} FROM {quoted} WHERE {self._quote(name)} IS NOT NULL")}
+                    for name, column_type in types.items() if column_type == "TEXT"
+                }
+            except sqlite3.Error as e:
+                self.connection.rollback()
+                self.tables.pop(table, None)
+                self.sources.pop(filename, None)
+                print(f"Error loading {filename} into the structured store: {str(e)}")
+                return 0
+            self.tables[table] = {
+                "filename": filename,
+                "source": os.path.join(data_dir, filename),
+                "columns": types,
+                "values": values
+            }
+            self.sources[filename] = table
+        return len(rows)
+
+    def remove_sources(self, sources: list[str]) -> None:
+        """Drop the tables loaded from the given files.
+
+        Args:
+            sources: Filenames whose tables should be dropped.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            for source in sources:
+                table = self.sources.pop(source, None)
+                if table is not None:
+                    self.connection.execute(f"DROP TABLE IF EXISTS {self._quote(table)}")
+                    self.tables.pop(table, None)
+            self.connection.commit()
+
+    def _find_table(self, text: str) -> str:
+        """Find the table a query is about from its name, e.g. "movies" or "books" for classic_books.
+
+        Args:
+            text: The lowercased query.
+
+        Returns:
+            The table name, or None if no table is mentioned.
+        """
+        for table in self.tables:
+            words = set(table.split("_")) | {table.replace("_", " ")}
+            words |= {word[:-1] for word in words if word.endswith("s")}
+            if any(re.search(rf"\b{re.escape(word)}s?\b", text) for word in words if len(word) > 2):
+                return table
+        return None
+
+    @staticmethod
+    def _column_mentions(text: str, columns: list[str]) -> list[tuple[int, str]]:
+        """Find where columns are mentioned in a query, by full name or by the last word of their name.
+
+        Args:
+            text: The lowercased query.
+            columns: Column names to look for.
+
+        Returns:
+            List of (position, column) pairs sorted by position.
+        """
+        mentions = []
+        for column in columns:
+            names = {column.lower(), column.lower().split()[-1]}
+            names |= {name[:-3] + "ed" for name in names if name.endswith("ing")}
+            for name in names:
+                mentions += [(match.start(), column) for match in re.finditer(rf"\b{re.escape(name)}\b", text)]
+        return sorted(mentions)
+
+    def plan(self, query: str) -> dict[str, Any]:
+        """Translate a question into a structured query over one table.
+
+        Numeric filters ("rating > 8", "released after 2010", "between 1900 and 1950"), text filters on values that appear in the question ("drama", "George Orwell"), counts, averages, sums and superlatives ("highest rated", "top 3", "oldest") are recognized. A question whose only filter is a value it names, e.g. "recommend me a movie like Inception", is not a structured query unless it asks for a list.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            Dictionary with 'table', 'filename', 'source', 'sql', 'params' and a readable 'description', or None if the question is not a structured query.
+        """
+        text = query.lower()
+        with self._lock:
+            table = self._find_table(text)
+            if table is None:
+                return None
+            info = self.tables[table]
+        columns = info["columns"]
+        numeric = [column for column, column_type in columns.items() if column_type != "TEXT"]
+        year_column = next((column for column in numeric if "year" in column.lower()), None)
+        mentions = self._column_mentions(text, numeric)
+
+        conditions, params, description, spans = [], [], [], []
+        for match in self.COMPARISON_PATTERN.finditer(text):
+            op = self.OPERATORS[re.sub(r"\s+", " ", match.group("op"))]
+            if op == "between" and not match.group(3):
+                op = "="
+            if op == "between" and match.group("op") == "from" and not match.group(3):
+                continue
+            preceding = [column for position, column in mentions if position < match.start()]
+            if preceding and match.start() - max(position for position, _ in mentions if position < match.start()) < 40:
+                column = preceding[-1]
+            elif year_column is not None and len(match.group(2).split(".")[0]) == 4 and any(word in text for word in self.YEAR_WORDS + ("after", "before", "since", "between", "from", " in ")):
+                column = year_column
+            else:
+                continue
+            if op in ("=", "between") and match.group("op") in ("in", "of", "is", "from") and column != year_column and not preceding:
+                continue
+            spans.append(match.span())
+            if op == "between":
+                conditions.append(f"{self._quote(column)} BETWEEN ? AND ?")
+                params += [float(match.group(2)), float(match.group(3))]
+                description.append(f"{column} between {match.group(2)} and {match.group(3)}")
+            else:
+                conditions.append(f"{self._quote(column)} {op} ?")
+                params.append(float(match.group(2)))
+                description.append(f"{column} {op} {match.group(2)}")
+
+        for column, values in info["values"].items():
+            matched = []
+            for key, value in values.items():
+                found = re.search(rf"(?<!\w){re.escape(key)}(?!\w)", text) if len(key) > 2 else None
+                # Skip numbers already used by a comparison, e.g. 1984 in "after 1984"
+                if found and not any(start <= found.start() < end for start, end in spans):
+                    matched.append(value)
+            if matched:
+                conditions.append(f'{self._quote(column)} IN ({", ".join("?" * len(matched))})')
+                params += matched
+                description.append(f"{column} in {matched}")
+
+        select, order, limit = "*", "", self.max_rows
+        mentioned_column = mentions[-1][1] if mentions else None
+        aggregate_column = mentioned_column or (numeric[0] if len(numeric) == 1 else None)
+        if re.search(r"\b(how many|count|number of)\b", text):
+            select = "COUNT(*) AS count"
+            description.append("count")
+        elif re.search(r"\b(average|mean|avg)\b", text) and aggregate_column is not None:
+            column = aggregate_column
+            select = f'AVG({self._quote(column)}) AS average_{re.sub(r"[^a-z0-9]", "_", column.lower())}, COUNT(*) AS count'
+            description.append(f"average {column}")
+        elif re.search(r"\b(sum|total)\b", text) and aggregate_column is not None:
+            column = aggregate_column
+            select = f'SUM({self._quote(column)}) AS total_{re.sub(r"[^a-z0-9]", "_", column.lower())}, COUNT(*) AS count'
+            description.append(f"total {column}")
+        else:
+            direction = None
+            if any(re.search(rf"\b{word}\b", text) for word in self.DESCENDING_WORDS):
+                direction = "DESC"
+            elif any(re.search(rf"\b{word}\b", text) for word in self.ASCENDING_WORDS):
+                direction = "ASC"
+            column = mentioned_column
+            if re.search(r"\b(oldest|newest|latest|earliest|most recent)\b", text) and year_column is not None:
+                column = year_column
+            if direction is not None and column is not None:
+                top = re.search(r"\b(?:top|best|worst)\s+(\d+)\b", text)
+                limit = min(int(top.group(1)), self.max_rows) if top else 1
+                order = f" ORDER BY {self._quote(column)} {direction}"
+                description.append(f"{'top' if direction == 'DESC' else 'bottom'} {limit} by {column}")
+
+        if select == "*" and not order and not spans and not (conditions and self.LISTING_PATTERN.search(text)):
+            return None
+
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return {
+            "table": table,
+            "filename": info["filename"],
+            "source": info["source"],
+            "sql": f"SELECT {select} FROM {self._quote(table)}{where}{order} LIMIT {limit}",
+            "params": params,
+            "description": ", ".join(description)
+        }
+
+    def execute(self, plan: dict[str, Any]) -> list[dict[str, Any]]:
+        """Run a planned structured query.
+
+        Args:
+            plan: Plan returned by plan().
+
+        Returns:
+            List of result rows as dictionaries.
+        """
+        with self._lock:
+            cursor = self.connection.execute(plan["sql"], plan["params"])
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def query(self, query: str) -> dict[str, Any]:
+        """Answer a question with a structured query if it is one.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            The plan with its result 'rows' added, or None if the question is not a structured query.
+        """
+        plan = self.plan(query)
+        if plan is None:
+            return None
+        return {**plan, "rows": self.execute(plan)}
+
+    @staticmethod
+    def format_rows(result: dict[str, Any]) -> str:
+        """Format a structured query result as compact text for the LLM.
+
+        Args:
+            result: Result returned by query().
+
+        Returns:
+            The result set, one row per line.
+        """
+        lines = [f"Rows from {result['filename']} matching: {result['description']}"]
+        for row in result["rows"]:
+            lines.append("; ".join(f"{column}: {value}" for column, value in row.items()))
+        return "\n".join(lines)
+
+    def __len__(self) -> int:
+        return len(self.tables)
@@ -0,0 +1,129 @@
+from typing import Any, AsyncIterator, Iterator
+from time import perf_counter, sleep
+import asyncio
+import hashlib
+from langchain_core.messages import AIMessage
+import tracing
+
+class StubLLMService:
+    def __init__(self, model_name: str = "stub", latency: float = 0.0, max_concurrency: int = 4):
+        """Initialize a deterministic stand-in for LLMService that never contacts Ollama.
+
+        Used to run the server, batch mode and benchmarks without a model.
+
+        Args:
+            (optional) model_name: Name reported for the model. Default is "stub".
+            (optional) latency: Seconds each response takes, to simulate generation time. Default is 0.0.
+            (optional) max_concurrency: Maximum number of async requests served at once. Default is 4.
+        """
+        self.model_name = model_name
+        self.base_url = None
+        self.latency = latency
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    def warm_up(self) -> bool:
+        """Do nothing; the stub has no model to load.
+
+        Returns:
+            True.
+        """
+        return True
+
+    def backend_stats(self) -> list[dict[str, Any]]:
+        """Report no backends; the stub does not use any.
+
+        Returns:
+            Empty list.
+        """
+        return []
+
+    def _answer(self, query: str, context_chunks: list[dict[str, Any]] = None) -> AIMessage:
+        """Build the deterministic answer for a query.
+
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+
+        Returns:
+            AIMessage with the answer and token usage estimates.
+        """
+        context_chunks = context_chunks or []
+        content = f"Stub answer to '{query}' using {len(context_chunks)} context chunk(s)."
+        input_tokens = (len(query) + sum(len(chunk['content']) for chunk in context_chunks)) // 4
+        output_tokens = len(content.split())
+        return AIMessage(
+            content = content,
+            id = f"stub-{hashlib.sha1(query.encode('utf-8')).hexdigest()[:12]}",
+            response_metadata = {"model": self.model_name},
+            usage_metadata = {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+        )
+
+    def generate_response(self, query: str, context_chunks: list[dict[str, Any]] = None) -> tuple[AIMessage, list[str]]:
+        """Generate the stub response.
+
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+
+        Returns:
+            Tuple containing the response and an empty reasoning list.
+        """
+        with tracing.span("llm_total"):
+            if self.latency:
+                sleep(self.latency)
+            return self._answer(query, context_chunks), []
+
+    async def agenerate_response(self, query: str, context_chunks: list[dict[str, Any]] = None) -> tuple[AIMessage, list[str]]:
+        """Asynchronously generate the stub response.
+
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+
+        Returns:
+            Tuple containing the response and an empty reasoning list.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            with tracing.span("llm_total"):
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                return self._answer(query, context_chunks), []
+
+    def generate_response_stream(self, query: str, context_chunks: list[dict[str, Any]] = None) -> Iterator[dict[str, Any]]:
+        """Stream the stub response word by word.
+
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+
+        Returns:
+            Iterator over the same events as LLMService.generate_response_stream().
+        """
+        start = perf_counter()
+        message, reason = self.generate_response(query, context_chunks)
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            yield {"type": "token", "content": word if i == 0 else f" {word}"}
+        elapsed = perf_counter() - start
+        yield {"type": "end", "result": message, "reason": reason, "time_to_first_token": elapsed, "tokens_per_second": len(words) / elapsed if elapsed > 0 else None}
+
+    async def agenerate_response_stream(self, query: str, context_chunks: list[dict[str, Any]] = None) -> AsyncIterator[dict[str, Any]]:
+        """Asynchronously stream the stub response word by word.
+
+        Args:
+            query: The user query.
+            (optional) context_chunks: List of context chunks for the query. Default is None.
+
+        Returns:
+            Async iterator over the same events as LLMService.generate_response_stream().
+        """
+        start = perf_counter()
+        message, reason = await self.agenerate_response(query, context_chunks)
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            yield {"type": "token", "content": word if i == 0 else f" {word}"}
+        elapsed = perf_counter() - start
+        yield {"type": "end", "result": message, "reason": reason, "time_to_first_token": elapsed, "tokens_per_second": len(words) / elapsed if elapsed > 0 else None}
@@ -0,0 +1,198 @@
+from typing import Any
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from time import perf_counter, sleep
+import threading
+import random
+import json
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, host: str = "127.0.0.1", models: list[str] = None, latency: float = 0.0, token_delay: float = 0.0, fail_rate: float = 0.0):
+        """Initialize a local HTTP server speaking the parts of the Ollama API that LLMService uses.
+
+        Used to test the LLM backend pool (load spreading, failover, ejection, keep-alive) without Ollama. Answers name the server, so it is visible which backend answered.
+
+        Args:
+            (optional) port: Port to listen on. Default is 0, which picks a free port.
+            (optional) host: Host to listen on. Default is "127.0.0.1".
+            (optional) models: Names of the models the server has. Default is None, which means ["gemma3:1b"].
+            (optional) latency: Seconds before the first token of a chat response. Default is 0.0.
+            (optional) token_delay: Seconds between streamed tokens. Default is 0.0.
+            (optional) fail_rate: Probability of answering a chat request with HTTP 500. Default is 0.0.
+        """
+        super().__init__((host, port), StubOllamaHandler)
+        self.models = models or ["gemma3:1b"]
+        self.latency = latency
+        self.token_delay = token_delay
+        self.fail_rate = fail_rate
+        self.stats = {"requests": 0, "connections": 0, "failures": 0}
+        self.stopped = False
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubOllamaServer":
+        """Serve on a background thread.
+
+        Returns:
+            The server.
+        """
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving, also dropping kept-alive connections, as if the server went down.
+
+        Returns:
+            None.
+        """
+        self.stopped = True
+        self.shutdown()
+        self.server_close()
+
+    def count(self, key: str) -> None:
+        """Increment one of the request counters.
+
+        Args:
+            key: Name of the counter.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            self.stats[key] += 1
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open, so client connection reuse shows up in the "connections" counter
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.count("connections")
+
+    def parse_request(self) -> bool:
+        # A stopped server closes kept-alive connections instead of answering on them
+        if self.server.stopped:
+            self.close_connection = True
+            return False
+        return super().parse_request()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, status: int, body: dict[str, Any]) -> None:
+        """Send a complete JSON response.
+
+        Args:
+            status: HTTP status code.
+            body: Response body.
+
+        Returns:
+            None.
+        """
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, body: dict[str, Any]) -> None:
+        """Send one NDJSON line of a streamed response as an HTTP chunk.
+
+        Args:
+            body: The line's JSON object.
+
+        Returns:
+            None.
+        """
+        data = (json.dumps(body) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self) -> None:
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": model, "model": model} for model in self.server.models]})
+        elif self.path == "/api/version":
+            self._send_json(200, {"version": "0.0.0-stub"})
+        elif self.path == "/stub/stats":
+            self._send_json(200, self.server.stats)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path not in ("/api/chat", "/api/generate"):
+            self._send_json(404, {"error": "not found"})
+            return
+        model = request.get("model")
+        if model not in self.server.models:
+            self._send_json(404, {"error": f"model \"{model}\" not found, try pulling it first"})
+            return
+        if self.path == "/api/generate":
+            self._send_json(200, {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "response": "", "done": True, "done_reason": "load"})
+            return
+
+        self.server.count("requests")
+        if random.random() < self.server.fail_rate:
+            self.server.count("failures")
+            self._send_json(500, {"error": "stub failure"})
+            return
+
+        start = perf_counter()
+        sleep(self.server.latency)
+        question = request["messages"][-1]["content"].strip().splitlines()[-1].strip() if request.get("messages") else ""
+        tokens = f"Stub answer from {self.server.url} ({model}) to: {question}".split(" ")
+        tokens = [token if i == 0 else f" {token}" for i, token in enumerate(tokens)]
+        created_at = datetime.now(timezone.utc).isoformat()
+        final = {
+            "model": model,
+            "created_at": created_at,
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": len(question.split()),
+            "eval_count": len(tokens)
+        }
+
+        if not request.get("stream", True):
+            sleep(self.server.token_delay * len(tokens))
+            final["message"]["content"] = "".join(tokens)
+            final["total_duration"] = final["eval_duration"] = int((perf_counter() - start) * 1e9)
+            self._send_json(200, final)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            self._send_chunk({"model": model, "created_at": created_at, "message": {"role": "assistant", "content": token}, "done": False})
+            sleep(self.server.token_delay)
+        final["total_duration"] = final["eval_duration"] = int((perf_counter() - start) * 1e9)
+        self._send_chunk(final)
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def main() -> None:
+    parser = ArgumentParser(description = "Serve a stub of the Ollama API, e.g. several on different ports to try out --model_url with a list of backends.")
+    parser.add_argument("--port", type = int, default = 11435, help = "Port to listen on. Defaults to 11435.")
+    parser.add_argument("--models", default = "gemma3:1b", help = "Comma-separated names of the models the server has. Defaults to gemma3:1b.")
+    parser.add_argument("--latency", type = float, default = 0.0, help = "Seconds before the first token. Defaults to 0.")
+    parser.add_argument("--token_delay", type = float, default = 0.0, help = "Seconds between streamed tokens. Defaults to 0.")
+    parser.add_argument("--fail_rate", type = float, default = 0.0, help = "Probability of answering a chat request with HTTP 500. Defaults to 0.")
+    args = parser.parse_args()
+
+    server = StubOllamaServer(args.port, models = args.models.split(","), latency = args.latency, token_delay = args.token_delay, fail_rate = args.fail_rate)
+    print(f"Stub Ollama server listening on {server.url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+from typing import Any, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+from time import perf_counter, time
+import threading
+import bisect
+import json
+import os
+
+_current_trace = ContextVar("current_trace", default = None)
+
+class Trace:
+    def __init__(self, query: str):
+        """Initialize the trace of one query, a list of timed spans for the stages it went through.
+
+        Args:
+            query: The user query.
+        """
+        self.query = query
+        self.timestamp = time()
+        self.start = perf_counter()
+        self.end = None
+        self.spans = []
+        self.attributes = {}
+        self._depth = 0
+
+    @contextmanager
+    def activate(self) -> Iterator["Trace"]:
+        """Make this the trace that span() and record() add to, in the current thread or task and the threads it starts with asyncio.to_thread().
+
+        Returns:
+            Context manager yielding the trace.
+        """
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def record(self, name: str, start: float, end: float = None, **attributes: Any) -> None:
+        """Add a span measured by the caller.
+
+        Args:
+            name: Name of the stage.
+            start: perf_counter() value when the stage started.
+            (optional) end: perf_counter() value when the stage ended. Default is None, which uses the current time.
+            (optional) attributes: Extra values stored with the span.
+
+        Returns:
+            None.
+        """
+        end = perf_counter() if end is None else end
+        self.spans.append({
+            "name": name,
+            "start_ms": (start - self.start) * 1000,
+            "duration_ms": (end - start) * 1000,
+            "depth": self._depth,
+            **attributes
+        })
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[dict[str, Any]]:
+        """Time a stage. Spans opened inside it are nested under it.
+
+        Args:
+            name: Name of the stage.
+            (optional) attributes: Extra values stored with the span.
+
+        Returns:
+            Context manager yielding the attributes dictionary, which the stage may add to.
+        """
+        start = perf_counter()
+        index = len(self.spans)
+        self.record(name, start, start, **attributes)
+        self._depth += 1
+        try:
+            yield attributes
+        finally:
+            self._depth -= 1
+            # The span is added on entry so it is listed before its children
+            self.spans[index].update(attributes, duration_ms = (perf_counter() - start) * 1000)
+
+    def finish(self) -> dict[str, Any]:
+        """End the trace.
+
+        Returns:
+            The trace as a JSON-serializable dictionary.
+        """
+        self.end = perf_counter()
+        return self.to_dict()
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert the trace into a JSON-serializable dictionary.
+
+        Returns:
+            Dictionary with the query, its wall-clock start timestamp, total milliseconds, spans and attributes.
+        """
+        return {
+            "query": self.query,
+            "timestamp": self.timestamp,
+            "total_ms": ((self.end or perf_counter()) - self.start) * 1000,
+            "spans": list(self.spans),
+            "attributes": dict(self.attributes)
+        }
+
+def current_trace() -> Trace:
+    """Get the active trace.
+
+    Returns:
+        The trace activated in the current context, or None.
+    """
+    return _current_trace.get()
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[dict[str, Any]]:
+    """Time a stage in the active trace. Does nothing if no trace is active, so components can be used without tracing.
+
+    Args:
+        name: Name of the stage.
+        (optional) attributes: Extra values stored with the span.
+
+    Returns:
+        Context manager yielding the attributes dictionary, which the stage may add to.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield attributes
+        return
+    with trace.span(name, **attributes) as attributes:
+        yield attributes
+
+def record(name: str, start: float, end: float = None, **attributes: Any) -> None:
+    """Add a span measured by the caller to the active trace, if any.
+
+    Args:
+        name: Name of the stage.
+        start: perf_counter() value when the stage started.
+        (optional) end: perf_counter() value when the stage ended. Default is None, which uses the current time.
+        (optional) attributes: Extra values stored with the span.
+
+    Returns:
+        None.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record(name, start, end, **attributes)
+
+def annotate(**attributes: Any) -> None:
+    """Attach values to the active trace, if any.
+
+    Args:
+        attributes: Values to store with the trace.
+
+    Returns:
+        None.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+def format_breakdown(trace: dict[str, Any], width: int = 30) -> list[str]:
+    """Format a finished trace as a timing breakdown, one line per span.
+
+    Args:
+        trace: Trace dictionary from Trace.finish().
+        (optional) width: Width of the bar showing each span's share of the total. Default is 30.
+
+    Returns:
+        List of lines.
+    """
+    total = trace["total_ms"]
+    lines = [f"{'total':<32}{total:10.1f} ms"]
+    for item in trace["spans"]:
+        share = item["duration_ms"] / total if total > 0 else 0.0
+        label = "  " * item["depth"] + item["name"]
+        lines.append(f"{label:<32}{item['duration_ms']:10.1f} ms {share:6.1%} {'#' * round(share * width)}")
+    usage = trace["attributes"].get("usage")
+    if usage:
+        lines.append(f"tokens: {usage.get('input_tokens')} in, {usage.get('output_tokens')} out, {usage.get('total_tokens')} total")
+    return lines
+
+class PrometheusMetrics:
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, path: str = None, buckets: tuple[float, ...] = BUCKETS):
+        """Initialize the Prometheus counters and histograms aggregated from traces.
+
+        Args:
+            (optional) path: File the metrics are rewritten to after every query, for the node exporter's textfile collector. Default is None, which only keeps them in memory.
+            (optional) buckets: Upper bounds of the histogram buckets in seconds. Default is BUCKETS.
+        """
+        self.path = path
+        self.buckets = tuple(sorted(buckets))
+        self.queries = defaultdict(int)
+        self.tokens = defaultdict(int)
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def _observe(self, name: str, seconds: float) -> None:
+        """Add one observation to a histogram. The caller holds the lock.
+
+        Args:
+            name: Stage name, or "total" for the whole query.
+            seconds: Observed duration.
+
+        Returns:
+            None.
+        """
+        histogram = self.histograms.setdefault(name, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0})
+        histogram["counts"][bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+    def observe(self, trace: dict[str, Any]) -> None:
+        """Add a finished trace to the metrics.
+
+        Args:
+            trace: Trace dictionary from Trace.finish().
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            self.queries[trace["attributes"].get("tool_used") or "unknown"] += 1
+            self._observe("total", trace["total_ms"] / 1000)
+            for item in trace["spans"]:
+                self._observe(item["name"], item["duration_ms"] / 1000)
+            for key, value in (trace["attributes"].get("usage") or {}).items():
+                if key.endswith("_tokens") and isinstance(value, int):
+                    self.tokens[key[:-len("_tokens")]] += value
+        if self.path:
+            self.save()
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format.
+
+        Returns:
+            The metrics text.
+        """
+        lines = [
+            "# HELP rag_queries_total Queries processed, by the tool that answered them.",
+            "# TYPE rag_queries_total counter"
+        ]
+        with self._lock:
+            lines += [f'rag_queries_total{{tool="{tool}"}} {count}' for tool, count in sorted(self.queries.items())]
+            lines += [
+                "# HELP rag_llm_tokens_total Tokens reported by the LLM, by type.",
+                "# TYPE rag_llm_tokens_total counter"
+            ]
+            lines += [f'rag_llm_tokens_total{{type="{kind}"}} {count}' for kind, count in sorted(self.tokens.items())]
+            lines += [
+                "# HELP rag_stage_duration_seconds Duration of each query pipeline stage. stage=\"total\" is the whole query.",
+                "# TYPE rag_stage_duration_seconds histogram"
+            ]
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram["counts"]):
+                    cumulative += count
+                    lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+                lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def save(self) -> None:
+        """Atomically write the metrics to the configured file.
+
+        Returns:
+            None.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding = 'utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
+
+class Tracer:
+    def __init__(self, path: str = None, metrics: PrometheusMetrics = None):
+        """Initialize the tracer that starts a trace per query and exports it once the query is done.
+
+        Args:
+            (optional) path: JSONL file every finished trace is appended to. Default is None.
+            (optional) metrics: PrometheusMetrics instance finished traces are aggregated into. Default is None.
+        """
+        self.path = path
+        self.metrics = metrics
+        self._lock = threading.Lock()
+
+    def start(self, query: str) -> Trace:
+        """Start the trace of a query.
+
+        Args:
+            query: The user query.
+
+        Returns:
+            The new trace. Activate it with trace.activate() around the work to be traced.
+        """
+        return Trace(query)
+
+    def finish(self, trace: Trace, response: dict[str, Any]) -> dict[str, Any]:
+        """End a trace, attach it to the response as 'trace' and export it.
+
+        Args:
+            trace: The trace of the query.
+            response: The completed response.
+
+        Returns:
+            The response.
+        """
+        trace.attributes["tool_used"] = response.get("tool_used")
+        response["trace"] = trace.finish()
+        if self.path:
+            line = json.dumps(response["trace"], default = str)
+            with self._lock:
+                with open(self.path, 'a', encoding = 'utf-8') as f:
+                    f.write(line + "\n")
+        if self.metrics is not None:
+            self.metrics.observe(response["trace"])
+        return response
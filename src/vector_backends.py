@@ -0,0 +1,1165 @@
+import os
+import sys
+import json
+import zlib
+import atexit
+import tempfile
+import threading
+import subprocess
+from multiprocessing.connection import Listener, Connection
+from typing import Any
+import numpy as np
+from metadata_index import MetadataIndex
+
+class VectorBackend:
+    """Storage and search behind a VectorStore.
+
+    Results use the same shapes as a ChromaDB collection: get() returns flat lists under 'ids', 'documents', 'metadatas' and 'embeddings', and query() returns one list per query under the same keys plus 'distances' (squared L2).
+    """
+    max_batch_size = 1024
+
+    def count(self) -> int:
+        """Count the chunks in the backend."""
+        raise NotImplementedError
+
+    def upsert(self, ids: list[str], embeddings: list[Any], documents: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """Insert chunks, replacing chunks with the same ids."""
+        raise NotImplementedError
+
+    def delete_sources(self, sources: list[str]) -> None:
+        """Delete every chunk whose 'filename' metadata is in sources."""
+        raise NotImplementedError
+
+    def update_metadata(self, ids: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """Replace the metadata of existing chunks. Unknown ids are ignored."""
+        raise NotImplementedError
+
+    def get(self, ids: list[str] = None, include_embeddings: bool = False, limit: int = None, offset: int = 0) -> dict[str, Any]:
+        """Fetch chunks by id, or page through all chunks if ids is None."""
+        raise NotImplementedError
+
+    def query(self, query_embeddings: list[Any], n_results: int, include_embeddings: bool = False, ann_effort: int = None, where: dict[str, Any] = None) -> dict[str, Any]:
+        """Find the n_results nearest chunks to each query embedding, among the chunks whose metadata matches the ChromaDB-style where filter if one is given. ann_effort trades latency for recall where the backend supports it."""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Make pending writes visible to other readers of the index."""
+
+class ChromaBackend(VectorBackend):
+    def __init__(self, embedding_function: Any, persist_dir: str = None, collection_name: str = "document_chunks", hnsw: dict[str, int] = None):
+        """Initialize the ChromaDB backend.
+
+        Args:
+            embedding_function: Embedding function the collection is created with.
+            (optional) persist_dir: Directory to persist the database in. Default is None, which keeps the database in memory only.
+            (optional) collection_name: Name of the collection. Default is "document_chunks".
+            (optional) hnsw: HNSW parameters of a new collection: "M", "ef_construction" and "ef_search". Default is None, which uses Chroma's defaults. An existing collection keeps the parameters it was built with.
+        """
+        import chromadb
+
+        self._lock = threading.Lock()
+        self.ef_search = (hnsw or {}).get("ef_search")
+        metadata = None
+        if hnsw:
+            names = {"M": "hnsw:M", "ef_construction": "hnsw:construction_ef", "ef_search": "hnsw:search_ef"}
+            metadata = {"hnsw:space": "l2", **{names[key]: value for key, value in hnsw.items() if value is not None}}
+        if persist_dir:
+            self.client = chromadb.PersistentClient(path = persist_dir)
+        else:
+            self.client = chromadb.EphemeralClient()
+        self.max_batch_size = self.client.get_max_batch_size()
+        try:
+            self.collection = self.client.get_or_create_collection(name = collection_name, embedding_function = embedding_function, metadata = metadata)
+        except Exception as e:
+            print(f"Error while accessing database:\n{e}")
+            self.collection = None
+
+    def count(self) -> int:
+        """Count the chunks in the collection.
+
+        Returns:
+            Number of chunks, or 0 if the collection could not be opened.
+        """
+        return self.collection.count() if self.collection is not None else 0
+
+    def upsert(self, ids: list[str], embeddings: list[Any], documents: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """Insert chunks into the collection, replacing chunks with the same ids.
+
+        Args:
+            ids: Chunk ids.
+            embeddings: Embedding of each chunk.
+            documents: Text of each chunk.
+            metadatas: Metadata of each chunk.
+
+        Returns:
+            None.
+        """
+        self.collection.upsert(ids = ids, embeddings = embeddings, documents = documents, metadatas = metadatas)
+
+    def delete_sources(self, sources: list[str]) -> None:
+        """Delete every chunk whose 'filename' metadata is in sources.
+
+        Args:
+            sources: Filenames whose chunks should be deleted.
+
+        Returns:
+            None.
+        """
+        self.collection.delete(where = {"filename": {"$in": list(sources)}})
+
+    def update_metadata(self, ids: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """Replace the metadata of existing chunks. Unknown ids are ignored.
+
+        Args:
+            ids: Ids of the chunks to update.
+            metadatas: New metadata of each chunk.
+
+        Returns:
+            None.
+        """
+        self.collection.update(ids = list(ids), metadatas = list(metadatas))
+
+    def get(self, ids: list[str] = None, include_embeddings: bool = False, limit: int = None, offset: int = 0) -> dict[str, Any]:
+        """Fetch chunks by id, or page through all chunks if ids is None.
+
+        Args:
+            (optional) ids: Ids of the chunks to fetch. Default is None, which pages through all chunks.
+            (optional) include_embeddings: Also return the embeddings. Default is False.
+            (optional) limit: Maximum number of chunks returned when paging. Default is None, which returns every chunk.
+            (optional) offset: Number of chunks skipped when paging. Default is 0.
+
+        Returns:
+            Dictionary with 'ids', 'documents', 'metadatas' and, if requested, 'embeddings'.
+        """
+        include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+        if ids is not None:
+            return self.collection.get(ids = list(ids), include = include)
+        return self.collection.get(include = include, limit = limit, offset = offset)
+
+    def query(self, query_embeddings: list[Any], n_results: int, include_embeddings: bool = False, ann_effort: int = None, where: dict[str, Any] = None) -> dict[str, Any]:
+        """Find the n_results nearest chunks to each query embedding with the collection's HNSW index.
+
+        Args:
+            query_embeddings: Query embeddings.
+            n_results: Number of results per query.
+            (optional) include_embeddings: Also return the embeddings. Default is False.
+            (optional) ann_effort: HNSW ef_search. Higher values raise recall and latency. Default is None, which keeps the collection's setting.
+            (optional) where: ChromaDB metadata filter. Default is None, which searches every chunk.
+
+        Returns:
+            ChromaDB query results.
+        """
+        # Chroma fixes ef_search per collection, so a different effort is applied to the collection before querying
+        if ann_effort is not None and ann_effort != self.ef_search:
+            with self._lock:
+                self.collection.modify(configuration = {"hnsw": {"ef_search": ann_effort}})
+                self.ef_search = ann_effort
+        return self.collection.query(
+            query_embeddings = list(query_embeddings),
+            n_results = n_results,
+            where = MetadataIndex.normalize(where),
+            include = ["documents", "metadatas", "distances"] + (["embeddings"] if include_embeddings else [])
+        )
+
+class MmapBackend(VectorBackend):
+    DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+    max_batch_size = 65536
+    # Rows scored per matrix multiplication, bounding the scratch memory of a search
+    search_block = 65536
+    # Below this many rows an exact scan is as fast as probing clusters
+    ann_min_rows = 4096
+
+    # Files holding the rows; a compaction writes them under the next generation's names
+    DATA_FILES = ("embeddings.bin", "row_stats.bin", "offsets.bin", "texts.bin", "records.bin", "record_offsets.bin")
+
+    def __init__(self, path: str = None, dtype: str = None, ann: bool = False, ann_lists: int = None, nprobe: int = 8):
+        """Initialize the native backend that keeps embeddings in a memory-mapped file.
+
+        The index directory holds:
+            embeddings.bin: Embeddings, one row per chunk, stored as float32, float16 or int8.
+            row_stats.bin: Per-row float32 dequantization scale and squared norm.
+            texts.bin: Chunk texts as one UTF-8 blob.
+            offsets.bin: Per-row int64 start and length of the text in texts.bin.
+            records.bin: Per-row JSON [id, metadata] records as one UTF-8 blob.
+            record_offsets.bin: Per-row int64 start and length of the record in records.bin.
+            meta.json: Dimension, storage type, row and byte counts, deleted rows and the generation of the files above.
+            ivf.npz: Optional IVF index (k-means centroids and the rows filed under each).
+
+        Rows are only appended. Updates and deletions mark rows as deleted, and the files are compacted once most rows are deleted. Writes become visible to other processes when meta.json is replaced by flush(), so several processes can search one on-disk index while only the pages they touch are resident. Ids and metadata are read for the rows a search returns; the id lookup and the metadata index are built on first use. Compaction writes a new generation of the files (e.g. embeddings.1.bin) and deletes the previous one only after meta.json names the new one. Only one process should write to an index at a time.
+
+        Args:
+            (optional) path: Directory of the index. Default is None, which uses a temporary directory removed on exit.
+            (optional) dtype: Storage type of the embeddings of a new index: "float32", "float16" or "int8" (per-row scaled). Default is None, which uses float32. An existing index keeps its storage type.
+            (optional) ann: Build an IVF index on flush() so searches only scan the clusters nearest to the query. Default is False, which searches exactly unless an index was built explicitly.
+            (optional) ann_lists: Number of IVF clusters. Default is None, which uses 4 * sqrt(rows).
+            (optional) nprobe: Number of IVF clusters searched per query unless overridden per query. Default is 8.
+        """
+        if dtype is not None and dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported embedding storage type: {dtype}. Choose one of {', '.join(self.DTYPES)}.")
+        if path is None:
+            self._tempdir = tempfile.TemporaryDirectory()
+            path = self._tempdir.name
+        os.makedirs(path, exist_ok = True)
+        self.path = path
+        self._lock = threading.RLock()
+        self._meta_mtime = None
+        self._maps = None
+        self._retired = None
+        self.ann = ann
+        self.ann_lists = ann_lists
+        self.nprobe = nprobe
+        self.ivf = None
+        self.meta = self._empty_meta(dtype or "float32")
+        self._index_rows()
+        self._load_meta()
+        if dtype is not None and self.meta["rows"] and self.meta["dtype"] != dtype:
+            print(f"Index at {path} stores {self.meta['dtype']} embeddings; ignoring requested {dtype}.")
+
+    @staticmethod
+    def _empty_meta(dtype: str) -> dict[str, Any]:
+        """Create the metadata of an empty index.
+
+        Args:
+            dtype: Storage type of the embeddings.
+
+        Returns:
+            The contents of meta.json for an index without rows.
+        """
+        return {"dim": None, "dtype": dtype, "rows": 0, "text_bytes": 0, "record_bytes": 0, "deleted": [], "generation": 0}
+
+    def _file(self, name: str) -> str:
+        """Get the path of a file in the index directory.
+
+        Args:
+            name: Name of the file.
+
+        Returns:
+            Path of the file.
+        """
+        return os.path.join(self.path, name)
+
+    def _data_file(self, name: str, generation: int = None) -> str:
+        """Get the path of one of the DATA_FILES.
+
+        Args:
+            name: Name of the file, e.g. "embeddings.bin".
+            (optional) generation: Generation of the file. Default is None, which uses the published generation.
+
+        Returns:
+            Path of the file. Generation 0 uses the plain name.
+        """
+        generation = self.meta["generation"] if generation is None else generation
+        stem, extension = os.path.splitext(name)
+        return self._file(f"{stem}.{generation}{extension}" if generation else name)
+
+    def _load_meta(self) -> None:
+        """Load meta.json if it changed since it was last read, and map the files it names.
+
+        Returns:
+            None.
+        """
+        for _ in range(3):
+            try:
+                mtime = os.stat(self._file("meta.json")).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime == self._meta_mtime:
+                return
+            with open(self._file("meta.json"), 'r', encoding = 'utf-8') as f:
+                meta = json.load(f)
+            if "ids" in meta:
+                print(f"Index at {self.path} uses an older layout that kept ids and metadata in meta.json; it is rebuilt.")
+                meta = self._empty_meta(meta["dtype"])
+            self.meta = meta
+            self._meta_mtime = mtime
+            self._index_rows()
+            try:
+                self._mapped()
+            except FileNotFoundError:
+                # A compaction published a new generation and deleted these files since meta.json was read
+                self._meta_mtime = None
+                continue
+            self._load_ivf()
+            return
+        raise FileNotFoundError(f"Index files named in {self._file('meta.json')} are missing.")
+
+    def _index_rows(self) -> None:
+        """Rebuild the deleted-row mask from the metadata, and drop the mappings and lookups built for the previous rows.
+
+        Returns:
+            None.
+        """
+        self.deleted = np.zeros(self.meta["rows"], dtype = bool)
+        self.deleted[self.meta["deleted"]] = True
+        self.live_rows = int(self.meta["rows"] - self.deleted.sum())
+        self._maps = None
+        self._row_of = None
+        self._metadata_index = None
+
+    def _records(self, rows: list[int]) -> list[tuple[str, dict[str, Any]]]:
+        """Read the ids and metadata of rows.
+
+        Args:
+            rows: Rows to read.
+
+        Returns:
+            List of (id, metadata) pairs.
+        """
+        maps = self._mapped()
+        return [tuple(json.loads(bytes(maps["records"][start:start + length]))) for start, length in (maps["record_offsets"][row] for row in rows)]
+
+    def _row_lookup(self) -> dict[str, int]:
+        """Map the ids of the live rows to their rows, reading every record on first use after the rows changed.
+
+        Returns:
+            Dictionary mapping chunk ids to rows.
+        """
+        if self._row_of is None:
+            rows = np.flatnonzero(~self.deleted).tolist()
+            self._row_of = {chunk_id: row for row, (chunk_id, _) in zip(rows, self._records(rows))}
+        return self._row_of
+
+    def _metadata(self) -> MetadataIndex:
+        """Index the metadata of the live rows, on the first filtered search after the rows changed.
+
+        Returns:
+            MetadataIndex keyed by row.
+        """
+        if self._metadata_index is None:
+            index = MetadataIndex()
+            rows = np.flatnonzero(~self.deleted).tolist()
+            index.add(rows, (metadata for _, metadata in self._records(rows)))
+            self._metadata_index = index
+        return self._metadata_index
+
+    def _mapped(self) -> dict[str, np.ndarray]:
+        """Memory-map the index files for the committed rows.
+
+        Returns:
+            Dictionary with the 'embeddings', 'row_stats', 'offsets', 'texts', 'record_offsets' and 'records' arrays, or None if the index is empty.
+        """
+        if self._maps is None and self.meta["rows"]:
+            rows, dim = self.meta["rows"], self.meta["dim"]
+            self._maps = {
+                "embeddings": np.memmap(self._data_file("embeddings.bin"), dtype = self.DTYPES[self.meta["dtype"]], mode = "r", shape = (rows, dim)),
+                "row_stats": np.memmap(self._data_file("row_stats.bin"), dtype = np.float32, mode = "r", shape = (rows, 2)),
+                "offsets": np.memmap(self._data_file("offsets.bin"), dtype = np.int64, mode = "r", shape = (rows, 2)),
+                "texts": np.memmap(self._data_file("texts.bin"), dtype = np.uint8, mode = "r", shape = (self.meta["text_bytes"],)) if self.meta["text_bytes"] else np.zeros(0, dtype = np.uint8),
+                "record_offsets": np.memmap(self._data_file("record_offsets.bin"), dtype = np.int64, mode = "r", shape = (rows, 2)),
+                "records": np.memmap(self._data_file("records.bin"), dtype = np.uint8, mode = "r", shape = (self.meta["record_bytes"],))
+            }
+        return self._maps
+
+    def _append(self, name: str, data: bytes, position: int) -> None:
+        """Write data at the end of the committed part of a file, overwriting anything left by an interrupted write.
+
+        Args:
+            name: Name of the file.
+            data: Bytes to write.
+            position: Byte offset where the committed part ends.
+
+        Returns:
+            None.
+        """
+        path = self._data_file(name)
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            f.seek(position)
+            f.write(data)
+            f.truncate()
+
+    @staticmethod
+    def _blob(items: list[bytes], start: int = 0) -> tuple[bytes, np.ndarray]:
+        """Join byte strings into one blob and compute where each one is.
+
+        Args:
+            items: Byte strings, one per row.
+            (optional) start: Byte offset the blob is written at. Default is 0.
+
+        Returns:
+            Tuple containing the blob and an int64 array with the start and length of each item.
+        """
+        lengths = np.array([len(item) for item in items], dtype = np.int64)
+        offsets = np.stack([start + np.cumsum(lengths) - lengths, lengths], axis = 1) if len(items) else np.zeros((0, 2), dtype = np.int64)
+        return b"".join(items), offsets.astype(np.int64)
+
+    def _quantize(self, embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Convert embeddings to the storage type.
+
+        Args:
+            embeddings: float32 embeddings, one per row.
+
+        Returns:
+            Tuple containing the stored rows and their float32 dequantization scales.
+        """
+        if self.meta["dtype"] != "int8":
+            return embeddings.astype(self.DTYPES[self.meta["dtype"]]), np.ones(len(embeddings), dtype = np.float32)
+        scales = np.abs(embeddings).max(axis = 1) / 127
+        scales[scales == 0] = 1.0
+        return np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8), scales.astype(np.float32)
+
+    def _dequantize(self, start: int, end: int) -> np.ndarray:
+        """Read a range of rows back as float32.
+
+        Args:
+            start: First row.
+            end: Row after the last one.
+
+        Returns:
+            float32 embeddings of the rows.
+        """
+        maps = self._mapped()
+        rows = np.asarray(maps["embeddings"][start:end], dtype = np.float32)
+        if self.meta["dtype"] == "int8":
+            rows *= maps["row_stats"][start:end, 0][:, None]
+        return rows
+
+    def count(self) -> int:
+        """Count the chunks that are not deleted.
+
+        Returns:
+            Number of live chunks.
+        """
+        with self._lock:
+            self._load_meta()
+            return self.live_rows
+
+    def upsert(self, ids: list[str], embeddings: list[Any], documents: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """Append chunks to the index files, marking earlier rows with the same ids as deleted.
+
+        Other processes see the new rows after the next flush().
+
+        Args:
+            ids: Chunk ids.
+            embeddings: Embedding of each chunk.
+            documents: Text of each chunk.
+            metadatas: Metadata of each chunk.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            self._load_meta()
+            vectors = np.asarray(embeddings, dtype = np.float32)
+            if self.meta["dim"] is None:
+                self.meta["dim"] = int(vectors.shape[1])
+            elif vectors.shape[1] != self.meta["dim"]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the index dimension {self.meta['dim']}.")
+
+            stored, scales = self._quantize(vectors)
+            dequantized = stored.astype(np.float32) * scales[:, None]
+            row_stats = np.stack([scales, (dequantized * dequantized).sum(axis = 1)], axis = 1).astype(np.float32)
+            texts, offsets = self._blob([document.encode('utf-8') for document in documents], self.meta["text_bytes"])
+            metadatas = [dict(metadata) for metadata in metadatas]
+            records, record_offsets = self._blob([json.dumps([chunk_id, metadata]).encode('utf-8') for chunk_id, metadata in zip(ids, metadatas)], self.meta["record_bytes"])
+
+            rows = self.meta["rows"]
+            self._append("embeddings.bin", stored.tobytes(), rows * stored.shape[1] * stored.itemsize)
+            self._append("row_stats.bin", row_stats.tobytes(), rows * 2 * 4)
+            self._append("offsets.bin", offsets.tobytes(), rows * 2 * 8)
+            self._append("texts.bin", texts, self.meta["text_bytes"])
+            self._append("record_offsets.bin", record_offsets.tobytes(), rows * 2 * 8)
+            self._append("records.bin", records, self.meta["record_bytes"])
+
+            # Kept up to date rather than rebuilt, since rebuilding them reads every record
+            row_of, index = self._row_lookup(), self._metadata_index
+            replaced = []
+            for row, chunk_id in enumerate(ids, start = rows):
+                if chunk_id in row_of:
+                    replaced.append(row_of[chunk_id])
+                row_of[chunk_id] = row
+            self.meta["deleted"] += replaced
+            self.meta["rows"] += len(ids)
+            self.meta["text_bytes"] += len(texts)
+            self.meta["record_bytes"] += len(records)
+            self._index_rows()
+            self._row_of = row_of
+            if index is not None:
+                index.remove(replaced)
+                index.add(range(rows, rows + len(ids)), metadatas)
+                # A replaced id may occur twice in one batch; only its last row is live
+                index.remove(np.flatnonzero(self.deleted[rows:]) + rows)
+                self._metadata_index = index
+
+    def delete_sources(self, sources: list[str]) -> None:
+        """Mark every chunk whose 'filename' metadata is in sources as deleted.
+
+        The rows stay in the files until the next compaction.
+
+        Args:
+            sources: Filenames whose chunks should be deleted.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            self._load_meta()
+            rows = sorted(self._metadata().keys({"filename": {"$in": list(sources)}}))
+            if not rows:
+                return
+            row_of, index = self._row_lookup(), self._metadata_index
+            for chunk_id, _ in self._records(rows):
+                row_of.pop(chunk_id, None)
+            index.remove(rows)
+            self.meta["deleted"] += rows
+            self._index_rows()
+            self._row_of, self._metadata_index = row_of, index
+
+    def update_metadata(self, ids: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """Replace the metadata of existing chunks. Unknown ids are ignored.
+
+        Args:
+            ids: Ids of the chunks to update.
+            metadatas: New metadata of each chunk.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            self._load_meta()
+            row_of = self._row_lookup()
+            known = [(row_of[chunk_id], metadata) for chunk_id, metadata in zip(ids, metadatas) if chunk_id in row_of]
+            if not known:
+                return
+            # Rows are only appended, so updated chunks are written again with their new metadata
+            fetched = self._rows([row for row, _ in known], include_embeddings = True)
+            self.upsert(fetched["ids"], fetched["embeddings"], fetched["documents"], [metadata for _, metadata in known])
+
+    def flush(self) -> None:
+        """Compact the index if most rows are deleted, then publish the metadata atomically.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            if len(self.meta["deleted"]) > max(1024, self.live_rows):
+                self._compact()
+            if self._ann_stale():
+                self.build_ann()
+            temporary = self._file("meta.json.tmp")
+            with open(temporary, 'w', encoding = 'utf-8') as f:
+                json.dump(self.meta, f)
+            os.replace(temporary, self._file("meta.json"))
+            self._meta_mtime = os.stat(self._file("meta.json")).st_mtime_ns
+            if self._retired is not None:
+                # Mappings other processes hold on these files stay valid; new readers only see the published generation
+                for name in self.DATA_FILES:
+                    try:
+                        os.remove(self._data_file(name, self._retired))
+                    except FileNotFoundError:
+                        pass
+                self._retired = None
+
+    def _compact(self) -> None:
+        """Write the live rows to the next generation of the index files. flush() publishes it and deletes the previous one.
+
+        Returns:
+            None.
+        """
+        keep = np.flatnonzero(~self.deleted)
+        maps = self._mapped()
+        generation = self.meta["generation"] + 1
+        texts, offsets = self._blob([bytes(maps["texts"][start:start + length]) for start, length in maps["offsets"][keep]] if len(keep) else [])
+        records, record_offsets = self._blob([bytes(maps["records"][start:start + length]) for start, length in maps["record_offsets"][keep]] if len(keep) else [])
+        files = {
+            "embeddings.bin": np.asarray(maps["embeddings"][keep]).tobytes() if len(keep) else b"",
+            "row_stats.bin": np.asarray(maps["row_stats"][keep]).tobytes() if len(keep) else b"",
+            "offsets.bin": offsets.tobytes(),
+            "texts.bin": texts,
+            "record_offsets.bin": record_offsets.tobytes(),
+            "records.bin": records
+        }
+        for name, data in files.items():
+            with open(self._data_file(name, generation), 'wb') as f:
+                f.write(data)
+
+        if self._retired is None:
+            self._retired = self.meta["generation"]
+        else:
+            # Compacted twice before publishing: the unpublished generation can go right away
+            for name in self.DATA_FILES:
+                os.remove(self._data_file(name))
+        # Compaction renumbers rows, so an IVF index no longer applies
+        self.meta = {**self.meta, "rows": len(keep), "text_bytes": len(texts), "record_bytes": len(records), "deleted": [], "generation": generation}
+        self.meta.pop("ivf", None)
+        self.ivf = None
+        self._index_rows()
+
+    def _rows(self, rows: list[int], include_embeddings: bool) -> dict[str, Any]:
+        """Read rows into the ChromaDB result shape.
+
+        Args:
+            rows: Rows to read.
+            include_embeddings: Also return the dequantized embeddings.
+
+        Returns:
+            Dictionary with 'ids', 'documents', 'metadatas' and 'embeddings'.
+        """
+        maps = self._mapped()
+        documents = [bytes(maps["texts"][start:start + length]).decode('utf-8') for start, length in (maps["offsets"][row] for row in rows)]
+        records = self._records(rows)
+        return {
+            "ids": [chunk_id for chunk_id, _ in records],
+            "documents": documents,
+            "metadatas": [metadata for _, metadata in records],
+            "embeddings": [self._dequantize(row, row + 1)[0] for row in rows] if include_embeddings else None
+        }
+
+    def get(self, ids: list[str] = None, include_embeddings: bool = False, limit: int = None, offset: int = 0) -> dict[str, Any]:
+        """Fetch chunks by id, or page through the live chunks in row order if ids is None.
+
+        Args:
+            (optional) ids: Ids of the chunks to fetch. Default is None, which pages through all chunks.
+            (optional) include_embeddings: Also return the embeddings. Default is False.
+            (optional) limit: Maximum number of chunks returned when paging. Default is None, which returns every chunk.
+            (optional) offset: Number of chunks skipped when paging. Default is 0.
+
+        Returns:
+            Dictionary with 'ids', 'documents', 'metadatas' and 'embeddings' (None unless requested).
+        """
+        with self._lock:
+            self._load_meta()
+            if ids is not None:
+                row_of = self._row_lookup()
+                rows = [row_of[chunk_id] for chunk_id in ids if chunk_id in row_of]
+            else:
+                alive = np.flatnonzero(~self.deleted)
+                rows = alive[offset:None if limit is None else offset + limit].tolist()
+            return self._rows(rows, include_embeddings)
+
+    def _dequantize_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Read arbitrary rows back as float32.
+
+        Args:
+            rows: Sorted row numbers.
+
+        Returns:
+            float32 embeddings of the rows.
+        """
+        maps = self._mapped()
+        vectors = np.asarray(maps["embeddings"][rows], dtype = np.float32)
+        if self.meta["dtype"] == "int8":
+            vectors *= maps["row_stats"][rows, 0][:, None]
+        return vectors
+
+    @staticmethod
+    def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, n: int = 1, block: int = 8192) -> np.ndarray:
+        """Find the nearest centroids of each vector by squared L2 distance.
+
+        Args:
+            vectors: float32 vectors, one per row.
+            centroids: float32 centroids, one per row.
+            (optional) n: Number of nearest centroids to return per vector. Default is 1.
+            (optional) block: Vectors compared per matrix multiplication. Default is 8192.
+
+        Returns:
+            Array of shape (len(vectors), n) with centroid numbers, nearest first.
+        """
+        centroid_norms = (centroids * centroids).sum(axis = 1)
+        nearest = []
+        for start in range(0, len(vectors), block):
+            distances = centroid_norms[None, :] - 2 * (vectors[start:start + block] @ centroids.T)
+            if n < len(centroids):
+                top = np.argpartition(distances, n - 1, axis = 1)[:, :n]
+            else:
+                top = np.broadcast_to(np.arange(len(centroids)), distances.shape)
+            order = np.argsort(np.take_along_axis(distances, top, axis = 1), axis = 1)
+            nearest.append(np.take_along_axis(top, order, axis = 1))
+        return np.concatenate(nearest) if nearest else np.zeros((0, n), dtype = np.int64)
+
+    def build_ann(self, n_lists: int = None, iterations: int = 10, seed: int = 0) -> None:
+        """Build the IVF index: cluster the embeddings with k-means and file every row under its nearest centroid.
+
+        The index covers the rows present at build time. Rows added later are searched exhaustively until the next build, and deleted rows are skipped, so results stay correct between builds. The index is written to ivf.npz and published by the next flush().
+
+        Args:
+            (optional) n_lists: Number of clusters. Default is None, which uses the backend's ann_lists or 4 * sqrt(rows).
+            (optional) iterations: Number of k-means iterations. Default is 10.
+            (optional) seed: Random seed of the k-means initialization. Default is 0.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            alive = np.flatnonzero(~self.deleted)
+            if len(alive) == 0:
+                self.ivf = None
+                self.meta.pop("ivf", None)
+                return
+            n_lists = min(n_lists or self.ann_lists or max(1, int(4 * np.sqrt(len(alive)))), len(alive))
+
+            # Train on a sample; 64 points per cluster is plenty for k-means to settle
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(alive, size = min(len(alive), n_lists * 64), replace = False))
+            training = self._dequantize_rows(sample)
+            centroids = training[rng.choice(len(training), n_lists, replace = False)].copy()
+            for _ in range(iterations):
+                assignment = self._nearest_centroids(training, centroids)[:, 0]
+                order = np.argsort(assignment, kind = "stable")
+                counts = np.bincount(assignment, minlength = n_lists)
+                filled = counts > 0
+                sums = np.add.reduceat(training[order], np.concatenate([[0], np.cumsum(counts)[:-1]])[filled], axis = 0)
+                centroids[filled] = sums / counts[filled, None]
+
+            assignment = np.concatenate([
+                self._nearest_centroids(self._dequantize_rows(alive[start:start + self.search_block]), centroids)[:, 0]
+                for start in range(0, len(alive), self.search_block)
+            ])
+            order = np.argsort(assignment, kind = "stable")
+            self.ivf = {
+                "centroids": centroids.astype(np.float32),
+                "list_offsets": np.searchsorted(assignment[order], np.arange(n_lists + 1)).astype(np.int64),
+                "list_rows": alive[order].astype(np.int64),
+                "built_rows": self.meta["rows"]
+            }
+            temporary = self._file("ivf.npz.tmp")
+            with open(temporary, 'wb') as f:
+                np.savez(f, **self.ivf)
+            os.replace(temporary, self._file("ivf.npz"))
+            self.meta["ivf"] = {"lists": n_lists, "built_rows": self.meta["rows"]}
+
+    def _load_ivf(self) -> None:
+        """Load the IVF index published in the metadata, if any.
+
+        Returns:
+            None.
+        """
+        self.ivf = None
+        if not self.meta.get("ivf"):
+            return
+        try:
+            with np.load(self._file("ivf.npz")) as data:
+                ivf = {key: data[key] for key in data.files}
+        except (OSError, ValueError) as e:
+            print(f"Error while reading the ANN index, falling back to exact search:\n{e}")
+            return
+        if int(ivf["built_rows"]) == self.meta["ivf"]["built_rows"]:
+            ivf["built_rows"] = int(ivf["built_rows"])
+            self.ivf = ivf
+
+    def _ann_stale(self) -> bool:
+        """Check whether the IVF index should be (re)built before publishing.
+
+        Returns:
+            True if ANN is enabled and the index is missing or more than a fifth of the rows were added since it was built.
+        """
+        if not self.ann or self.live_rows < self.ann_min_rows:
+            return False
+        if self.ivf is None:
+            return True
+        return self.meta["rows"] - self.ivf["built_rows"] > 0.2 * self.ivf["built_rows"]
+
+    def _exact_search(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Score every row against the queries, block by block.
+
+        Args:
+            queries: float32 query embeddings.
+            k: Number of results per query.
+
+        Returns:
+            Tuple containing the rows and squared L2 distances of the top k per query, unsorted.
+        """
+        query_norms = (queries * queries).sum(axis = 1)
+        best_rows = np.zeros((len(queries), 0), dtype = np.int64)
+        best_distances = np.zeros((len(queries), 0), dtype = np.float32)
+        row_stats = self._mapped()["row_stats"]
+        for start in range(0, self.meta["rows"], self.search_block):
+            end = min(start + self.search_block, self.meta["rows"])
+            # Squared L2 distance, the same metric as the Chroma backend
+            distances = row_stats[start:end, 1][None, :] - 2 * (queries @ self._dequantize(start, end).T) + query_norms[:, None]
+            distances[:, self.deleted[start:end]] = np.inf
+            rows = np.broadcast_to(np.arange(start, end), distances.shape)
+            distances = np.concatenate([best_distances, distances], axis = 1)
+            rows = np.concatenate([best_rows, rows], axis = 1)
+            top = np.argpartition(distances, k - 1, axis = 1)[:, :k] if distances.shape[1] > k else np.argsort(distances, axis = 1)
+            best_distances = np.take_along_axis(distances, top, axis = 1)
+            best_rows = np.take_along_axis(rows, top, axis = 1)
+        return best_rows, best_distances
+
+    def _filtered_search(self, queries: np.ndarray, rows: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Score only the given rows against the queries, block by block.
+
+        Args:
+            queries: float32 query embeddings.
+            rows: Sorted live rows to score, e.g. the rows matching a metadata filter.
+            k: Number of results per query.
+
+        Returns:
+            Tuple containing the rows and squared L2 distances of the top k per query, unsorted.
+        """
+        query_norms = (queries * queries).sum(axis = 1)
+        best_rows = np.zeros((len(queries), 0), dtype = np.int64)
+        best_distances = np.zeros((len(queries), 0), dtype = np.float32)
+        row_stats = self._mapped()["row_stats"]
+        for start in range(0, len(rows), self.search_block):
+            block = rows[start:start + self.search_block]
+            distances = row_stats[block, 1][None, :] - 2 * (queries @ self._dequantize_rows(block).T) + query_norms[:, None]
+            distances = np.concatenate([best_distances, distances], axis = 1)
+            candidates = np.concatenate([best_rows, np.broadcast_to(block, (len(queries), len(block)))], axis = 1)
+            top = np.argpartition(distances, k - 1, axis = 1)[:, :k] if distances.shape[1] > k else np.argsort(distances, axis = 1)
+            best_distances = np.take_along_axis(distances, top, axis = 1)
+            best_rows = np.take_along_axis(candidates, top, axis = 1)
+        return best_rows, best_distances
+
+    def _ivf_search(self, queries: np.ndarray, k: int, nprobe: int) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Score only the rows filed under each query's nprobe nearest clusters, plus rows added since the build.
+
+        Args:
+            queries: float32 query embeddings.
+            k: Number of results per query.
+            nprobe: Number of clusters searched per query.
+
+        Returns:
+            One (rows, squared L2 distances) pair of the top k per query, unsorted.
+        """
+        ivf = self.ivf
+        row_stats = self._mapped()["row_stats"]
+        tail = np.arange(ivf["built_rows"], self.meta["rows"], dtype = np.int64)
+        results = []
+        for query, lists in zip(queries, self._nearest_centroids(queries, ivf["centroids"], nprobe)):
+            rows = np.concatenate([ivf["list_rows"][ivf["list_offsets"][l]:ivf["list_offsets"][l + 1]] for l in lists] + [tail])
+            rows = np.sort(rows[~self.deleted[rows]])
+            distances = row_stats[rows, 1] - 2 * (self._dequantize_rows(rows) @ query) + query @ query
+            top = np.argpartition(distances, k - 1)[:k] if len(rows) > k else np.arange(len(rows))
+            results.append((rows[top], distances[top]))
+        return results
+
+    def query(self, query_embeddings: list[Any], n_results: int, include_embeddings: bool = False, ann_effort: int = None, where: dict[str, Any] = None) -> dict[str, Any]:
+        """Find the n_results nearest chunks to each query embedding.
+
+        Args:
+            query_embeddings: Query embeddings.
+            n_results: Number of results per query.
+            (optional) include_embeddings: Also return the dequantized embeddings. Default is False.
+            (optional) ann_effort: Number of IVF clusters searched per query. Higher values raise recall and latency. Default is None, which uses the backend's nprobe. Ignored without an IVF index.
+            (optional) where: ChromaDB-style metadata filter. The matching rows are looked up in the metadata index and only they are scored, exactly. Default is None, which searches every chunk.
+
+        Returns:
+            ChromaDB-shaped query results.
+        """
+        with self._lock:
+            self._load_meta()
+            queries = np.asarray(query_embeddings, dtype = np.float32)
+            candidates = None
+            if MetadataIndex.normalize(where) is not None:
+                candidates = np.array(sorted(self._metadata().keys(where)), dtype = np.int64)
+            k = min(n_results, self.live_rows if candidates is None else len(candidates))
+            results = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": [] if include_embeddings else None}
+            if k == 0:
+                for key in ("ids", "documents", "metadatas", "distances"):
+                    results[key] = [[] for _ in queries]
+                if include_embeddings:
+                    results["embeddings"] = [[] for _ in queries]
+                return results
+
+            nprobe = ann_effort or self.nprobe
+            if candidates is not None:
+                # A filter usually leaves few rows, and probing clusters could miss all of them
+                matches = zip(*self._filtered_search(queries, candidates, k))
+            elif self.ivf is not None and nprobe < len(self.ivf["centroids"]):
+                matches = self._ivf_search(queries, k, nprobe)
+            else:
+                matches = zip(*self._exact_search(queries, k))
+
+            for rows, distances in matches:
+                order = np.argsort(distances)
+                rows = [int(rows[i]) for i in order if np.isfinite(distances[i])]
+                fetched = self._rows(rows, include_embeddings)
+                for key in ("ids", "documents", "metadatas"):
+                    results[key].append(fetched[key])
+                results["distances"].append([float(distances[i]) for i in order[:len(rows)]])
+                if include_embeddings:
+                    results["embeddings"].append(fetched["embeddings"])
+            return results
+
+class ShardedBackend(VectorBackend):
+    max_batch_size = 65536
+    # BLAS libraries read these when they are loaded, so they are set in the environment the workers are started with
+    THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+    WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shard_worker.py")
+
+    def __init__(self, shards: int, path: str = None, dtype: str = None, ann: bool = False, ann_lists: int = None, nprobe: int = 8, threads_per_shard: int = None):
+        """Initialize the backend that hash-partitions chunks across MmapBackend shards, each owned by a worker process.
+
+        Each query is sent to every shard at once, the shards search in parallel on their own cores, and their top results are merged by distance.
+
+        Args:
+            shards: Number of shards and worker processes.
+            (optional) path: Directory of the index. The shards are kept in "shard_<n>" subdirectories. Default is None, which uses a temporary directory removed on exit.
+            (optional) dtype: Storage type of the embeddings of a new index, as in MmapBackend. Default is None.
+            (optional) ann: Build and maintain an IVF index in every shard. Default is False.
+            (optional) ann_lists: Number of IVF clusters per shard. Default is None, which uses 4 * sqrt(shard rows).
+            (optional) nprobe: Number of IVF clusters searched per query in each shard. Default is 8.
+            (optional) threads_per_shard: Number of BLAS threads per worker. Default is None, which divides the CPUs evenly between the shards.
+
+        Raises:
+            ValueError: If the index at path was built with a different number of shards.
+        """
+        if path is None:
+            self._tempdir = tempfile.TemporaryDirectory()
+            path = self._tempdir.name
+        os.makedirs(path, exist_ok = True)
+        layout = os.path.join(path, "shards.json")
+        if os.path.exists(layout):
+            with open(layout, 'r', encoding = 'utf-8') as f:
+                existing = json.load(f)["shards"]
+            if existing != shards:
+                raise ValueError(f"Index at {path} has {existing} shards, not {shards}. Use --shards {existing} or a new --persist_dir.")
+        else:
+            with open(layout, 'w', encoding = 'utf-8') as f:
+                json.dump({"shards": shards}, f)
+        self.path = path
+        self.shards = shards
+        self._lock = threading.Lock()
+
+        threads = str(threads_per_shard or max(1, (os.cpu_count() or 1) // shards))
+        self._connections, self._workers = [], []
+        try:
+            self._connections = self._start_workers(shards, {**os.environ, **{name: threads for name in self.THREAD_VARIABLES}})
+            for shard, connection in enumerate(self._connections):
+                connection.send((os.path.join(path, f"shard_{shard}"), {"dtype": dtype, "ann": ann, "ann_lists": ann_lists, "nprobe": nprobe}))
+        except Exception:
+            self.close()
+            raise
+        atexit.register(self.close)
+
+    def _start_workers(self, count: int, env: dict[str, str]) -> list[Connection]:
+        """Start worker processes and wait for each to connect back.
+
+        Workers run shard_worker.py as a script rather than through multiprocessing, which would import the script that started this process in every worker.
+
+        Args:
+            count: Number of workers.
+            env: Environment of the workers.
+
+        Returns:
+            One connection per worker.
+
+        Raises:
+            RuntimeError: If a worker exits before connecting.
+        """
+        authkey = os.urandom(32)
+        connections = []
+        with Listener(authkey = authkey) as listener:
+            for _ in range(count):
+                worker = subprocess.Popen([sys.executable, self.WORKER, listener.address], stdin = subprocess.PIPE, env = env)
+                worker.stdin.write(authkey.hex().encode('ascii') + b"\n")
+                worker.stdin.close()
+                self._workers.append(worker)
+
+            def accept() -> None:
+                try:
+                    while len(connections) < count:
+                        connections.append(listener.accept())
+                except (OSError, EOFError):
+                    pass
+            # accept() cannot time out, so it runs on a thread while the workers are watched for early exits
+            acceptor = threading.Thread(target = accept, daemon = True)
+            acceptor.start()
+            while acceptor.is_alive():
+                acceptor.join(0.05)
+                if acceptor.is_alive() and any(worker.poll() is not None for worker in self._workers):
+                    break
+        if len(connections) < count:
+            for connection in connections:
+                connection.close()
+            raise RuntimeError(f"A shard worker exited before connecting; run {self.WORKER} directly to see why.")
+        return connections
+
+    def shard_of(self, chunk_id: str) -> int:
+        """Pick the shard a chunk belongs to. Stable across processes and runs.
+
+        Args:
+            chunk_id: The chunk's id.
+
+        Returns:
+            Index of the shard.
+        """
+        return zlib.crc32(chunk_id.encode('utf-8')) % self.shards
+
+    def _call(self, calls: dict[int, tuple[str, tuple]]) -> dict[int, Any]:
+        """Send calls to several shards at once and wait for all of their results.
+
+        Args:
+            calls: Method name and arguments per shard index.
+
+        Returns:
+            Result per shard index.
+
+        Raises:
+            Exception: The first exception raised by a shard.
+        """
+        with self._lock:
+            for shard, call in calls.items():
+                self._connections[shard].send(call)
+            replies = {shard: self._connections[shard].recv() for shard in calls}
+        for ok, value in replies.values():
+            if not ok:
+                raise value
+        return {shard: value for shard, (ok, value) in replies.items()}
+
+    def _broadcast(self, method: str, *args: Any) -> list[Any]:
+        """Call a method on every shard.
+
+        Args:
+            method: Name of the MmapBackend method.
+            args: Its arguments.
+
+        Returns:
+            The results of the shards, in shard order.
+        """
+        results = self._call({shard: (method, args) for shard in range(self.shards)})
+        return [results[shard] for shard in range(self.shards)]
+
+    def count(self) -> int:
+        """Count the chunks in every shard.
+
+        Returns:
+            Total number of chunks.
+        """
+        return sum(self._broadcast("count"))
+
+    def upsert(self, ids: list[str], embeddings: list[Any], documents: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """Insert chunks into the shards they hash to, replacing chunks with the same ids.
+
+        Args:
+            ids: Chunk ids.
+            embeddings: Embedding of each chunk.
+            documents: Text of each chunk.
+            metadatas: Metadata of each chunk.
+
+        Returns:
+            None.
+        """
+        parts = {}
+        for chunk_id, embedding, document, metadata in zip(ids, embeddings, documents, metadatas):
+            part = parts.setdefault(self.shard_of(chunk_id), ([], [], [], []))
+            for values, value in zip(part, (chunk_id, np.asarray(embedding, dtype = np.float32), document, metadata)):
+                values.append(value)
+        self._call({shard: ("upsert", (part_ids, np.stack(part_embeddings), part_documents, part_metadatas)) for shard, (part_ids, part_embeddings, part_documents, part_metadatas) in parts.items()})
+
+    def delete_sources(self, sources: list[str]) -> None:
+        """Delete every chunk whose 'filename' metadata is in sources from every shard.
+
+        Args:
+            sources: Filenames whose chunks should be deleted.
+
+        Returns:
+            None.
+        """
+        self._broadcast("delete_sources", list(sources))
+
+    def update_metadata(self, ids: list[str], metadatas: list[dict[str, Any]]) -> None:
+        """Replace the metadata of existing chunks in the shards they hash to. Unknown ids are ignored.
+
+        Args:
+            ids: Ids of the chunks to update.
+            metadatas: New metadata of each chunk.
+
+        Returns:
+            None.
+        """
+        parts = {}
+        for chunk_id, metadata in zip(ids, metadatas):
+            part = parts.setdefault(self.shard_of(chunk_id), ([], []))
+            part[0].append(chunk_id)
+            part[1].append(dict(metadata))
+        self._call({shard: ("update_metadata", part) for shard, part in parts.items()})
+
+    def flush(self) -> None:
+        """Flush every shard, publishing its pending writes.
+
+        Returns:
+            None.
+        """
+        self._broadcast("flush")
+
+    def get(self, ids: list[str] = None, include_embeddings: bool = False, limit: int = None, offset: int = 0) -> dict[str, Any]:
+        """Fetch chunks by id, or page through all chunks shard by shard if ids is None.
+
+        Args:
+            (optional) ids: Ids of the chunks to fetch. Default is None, which pages through all chunks.
+            (optional) include_embeddings: Also return the embeddings. Default is False.
+            (optional) limit: Maximum number of chunks returned when paging. Default is None, which returns every chunk.
+            (optional) offset: Number of chunks skipped when paging. Default is 0.
+
+        Returns:
+            Dictionary with 'ids', 'documents', 'metadatas' and 'embeddings' (None unless requested). Chunks fetched by id keep the order of ids.
+        """
+        results = {"ids": [], "documents": [], "metadatas": [], "embeddings": [] if include_embeddings else None}
+        if ids is not None:
+            parts = {}
+            for chunk_id in ids:
+                parts.setdefault(self.shard_of(chunk_id), []).append(chunk_id)
+            fetched = self._call({shard: ("get", (part, include_embeddings)) for shard, part in parts.items()})
+            found = {}
+            for page in fetched.values():
+                for i, chunk_id in enumerate(page["ids"]):
+                    found[chunk_id] = (page, i)
+            # Results keep the order of the requested ids, like the other backends
+            for chunk_id in ids:
+                if chunk_id in found:
+                    page, i = found[chunk_id]
+                    for key in results:
+                        if results[key] is not None:
+                            results[key].append(page[key][i])
+            return results
+
+        # Pages run through the shards one after the other
+        for shard, shard_count in enumerate(self._broadcast("count")):
+            if limit is not None and len(results["ids"]) >= limit:
+                break
+            if offset >= shard_count:
+                offset -= shard_count
+                continue
+            remaining = None if limit is None else limit - len(results["ids"])
+            page = self._call({shard: ("get", (None, include_embeddings, remaining, offset))})[shard]
+            offset = 0
+            for key in results:
+                if results[key] is not None:
+                    results[key] += page[key]
+        return results
+
+    def query(self, query_embeddings: list[Any], n_results: int, include_embeddings: bool = False, ann_effort: int = None, where: dict[str, Any] = None) -> dict[str, Any]:
+        """Search every shard in parallel and merge their results.
+
+        Args:
+            query_embeddings: Query embeddings.
+            n_results: Number of results per query.
+            (optional) include_embeddings: Also return the embeddings. Default is False.
+            (optional) ann_effort: Number of IVF clusters searched per query in each shard. Default is None.
+            (optional) where: ChromaDB-style metadata filter, applied by every shard before scoring. Default is None.
+
+        Returns:
+            ChromaDB-shaped query results.
+        """
+        queries = np.asarray(query_embeddings, dtype = np.float32)
+        pages = self._broadcast("query", queries, n_results, include_embeddings, ann_effort, where)
+        keys = ["ids", "documents", "metadatas", "distances"] + (["embeddings"] if include_embeddings else [])
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": [] if include_embeddings else None}
+        for query in range(len(queries)):
+            candidates = [(distance, page, i) for page in pages for i, distance in enumerate(page["distances"][query])]
+            best = sorted(candidates, key = lambda candidate: candidate[0])[:n_results]
+            for key in keys:
+                results[key].append([page[key][query][i] for _, page, i in best])
+        return results
+
+    def close(self) -> None:
+        """Stop the worker processes.
+
+        Returns:
+            None.
+        """
+        with self._lock:
+            for connection in self._connections:
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+            for worker in self._workers:
+                try:
+                    worker.wait(timeout = 5)
+                except subprocess.TimeoutExpired:
+                    worker.kill()
+            for connection in self._connections:
+                connection.close()
+            self._connections, self._workers = [], []
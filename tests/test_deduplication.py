@@ -0,0 +1,97 @@
+import hashlib
+import numpy as np
+import pytest
+from deduplication import ChunkDeduplicator
+from document_loader import DocumentLoader
+from embeddings import VectorStore
+from index_manifest import IndexManifest
+from ingestion import IngestionPipeline
+from vector_backends import MmapBackend
+
+POLICY = "Refunds are issued within 14 days of the return being received. Items must be unused and in their original packaging. Shipping costs are not refunded unless the item arrived damaged."
+OTHER = "The RTX 5090 draws up to 575 W under load and needs a 1000 W power supply."
+
+def chunk(content, filename):
+    return {'content': content, 'metadata': {'filename': filename}}
+
+def fake_embeddings(texts):
+    """Deterministic stand-in for the embedding model."""
+    return [np.frombuffer(hashlib.sha256(text.encode('utf-8')).digest()[:16], dtype = np.uint8).astype(np.float32) for text in texts]
+
+def stored(store):
+    """Map each stored chunk's text to its filename and deduplication metadata."""
+    return {
+        chunk['content']: {key: value for key, value in chunk['metadata'].items() if key in ('filename', 'duplicates', 'sources')}
+        for page in store.iter_chunks() for chunk in page
+    }
+
+def test_threshold():
+    # Estimated similarity of the two texts is about 0.81; case and whitespace are ignored
+    edited = POLICY + " Contact support for help."
+    assert len(list(ChunkDeduplicator(0.8).filter([chunk(POLICY, "a.txt"), chunk(edited, "b.txt")]))) == 1
+    assert len(list(ChunkDeduplicator(0.9).filter([chunk(POLICY, "a.txt"), chunk(edited, "b.txt")]))) == 2
+    assert len(list(ChunkDeduplicator(0.9).filter([chunk(POLICY, "a.txt"), chunk(POLICY.upper().replace(" ", " \n "), "b.txt")]))) == 1
+    assert len(list(ChunkDeduplicator(0.9).filter([chunk(POLICY, "a.txt"), chunk(OTHER, "b.txt")]))) == 2
+
+def test_canonical_id_and_links():
+    deduplicator = ChunkDeduplicator(0.9)
+    chunks = [chunk(POLICY, "a.txt"), chunk(OTHER, "b.txt"), chunk(POLICY, "c.txt"), chunk(POLICY, "a.txt")]
+    kept = list(deduplicator.filter(chunks))
+    assert kept == chunks[:2]
+
+    # The first copy is kept under the id the store gives it, and lists every file the text occurs in
+    ids, metadatas = deduplicator.updates()
+    assert ids == [VectorStore._chunk_ids([chunks[0]])[0]]
+    assert metadatas == [{'filename': "a.txt", 'duplicates': 2, 'sources': "a.txt, c.txt"}]
+    summary = deduplicator.summary()
+    assert (summary["chunks"], summary["duplicates"], summary["kept"]) == (4, 2, 2)
+    assert summary["links"] == {"a.txt": ["c.txt"], "c.txt": ["a.txt"]}
+
+def test_existing_chunks_are_canonical():
+    deduplicator = ChunkDeduplicator(0.9)
+    deduplicator.add_existing([{'id': "stored", 'content': POLICY, 'metadata': {'filename': "a.txt", 'duplicates': 1, 'sources': "a.txt, b.txt"}}])
+    assert list(deduplicator.filter([chunk(POLICY, "c.txt")])) == []
+    assert deduplicator.updates() == (["stored"], [{'filename': "a.txt", 'duplicates': 2, 'sources': "a.txt, b.txt, c.txt"}])
+    assert deduplicator.summary()["chunks"] == 1
+
+@pytest.mark.parametrize("atomic", [False, True])
+def test_reindex_linked_file_after_canonical_is_deleted(tmp_path, atomic):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text(POLICY, encoding = "utf-8")
+    (data_dir / "b.txt").write_text(OTHER, encoding = "utf-8")
+    store = VectorStore(backend = MmapBackend(str(tmp_path / "index")))
+    store._embedding_function = fake_embeddings
+    ingestion = IngestionPipeline(DocumentLoader(str(data_dir)), store, workers = 1, dedup_threshold = 0.9)
+    manifest = IndexManifest(str(tmp_path / "manifest.json"))
+
+    def sync():
+        """Run one sync the way the RAG system does."""
+        current = manifest.scan(str(data_dir))
+        changed, deleted = manifest.diff(current)
+        changed += [filename for filename in manifest.linked(changed + deleted) if filename in current and filename not in changed]
+        if atomic and changed:
+            stats = ingestion.run(changed, replace_sources = changed + deleted)
+        else:
+            store.delete_sources(changed + deleted)
+            stats = ingestion.run(changed) if changed else {}
+        manifest.update(current, changed, stats.get("dedup", {}).get("links"))
+        return sorted(changed)
+
+    assert sync() == ["a.txt", "b.txt"]
+
+    # A copy of an already indexed file is not embedded again, and the indexed copy lists it
+    (data_dir / "c.txt").write_text(POLICY, encoding = "utf-8")
+    assert sync() == ["c.txt"]
+    assert stored(store) == {
+        POLICY: {'filename': "a.txt", 'duplicates': 1, 'sources': "a.txt, c.txt"},
+        OTHER: {'filename': "b.txt"}
+    }
+    assert manifest.linked(["a.txt"]) == ["c.txt"]
+
+    # Deleting the file that held the chunk re-indexes the copy, which now holds it
+    (data_dir / "a.txt").unlink()
+    assert sync() == ["c.txt"]
+    assert stored(store) == {POLICY: {'filename': "c.txt"}, OTHER: {'filename': "b.txt"}}
+    assert store.count() == 2
+    assert "linked" not in manifest.files["c.txt"]
@@ -0,0 +1,21 @@
+from importlib import metadata
+from dependencies import missing_requirements
+
+def write_requirements(tmp_path, lines, encoding = "utf-8"):
+    path = tmp_path / "requirements.txt"
+    path.write_bytes(("\r\n".join(lines) + "\r\n").encode(encoding))
+    return str(path)
+
+def test_environment_markers_skip_other_platforms(tmp_path):
+    path = write_requirements(tmp_path, [
+        'surely-not-installed-package==1.0; sys_platform == "no-such-platform"',
+        'surely-not-installed-package==1.0; python_version < "3"'
+    ])
+    assert missing_requirements(path) == []
+
+def test_versions_are_checked_against_the_specifier(tmp_path):
+    installed = metadata.version("numpy")
+    satisfied = [f"numpy=={installed}", f"numpy>={installed}", "numpy>0", f"NumPy == {installed}  # comment"]
+    unsatisfied = ["numpy==0.0.1", "numpy<0.1", "surely-not-installed-package", "not a requirement ==="]
+    path = write_requirements(tmp_path, satisfied + unsatisfied, encoding = "utf-16")
+    assert missing_requirements(path) == unsatisfied
@@ -0,0 +1,66 @@
+import json
+from document_loader import DocumentLoader
+from index_manifest import IndexManifest
+from ingestion import IngestionPipeline
+
+class RecordingStore:
+    """Stands in for the VectorStore: keeps the chunks instead of embedding them."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def add_chunks(self, chunks, batch_size = None, replace_sources = None, metadata_updates = None):
+        self.chunks += list(chunks)
+        return {"chunks": len(self.chunks), "seconds": 0.0, "embed_seconds": 0.0, "insert_seconds": 0.0, "swap_seconds": 0.0}
+
+def sync(data_dir, manifest_path):
+    """Run one sync the way the RAG system does and return what it re-indexed."""
+    manifest = IndexManifest(manifest_path)
+    current = manifest.scan(str(data_dir))
+    changed, deleted = manifest.diff(current)
+    stats = IngestionPipeline(DocumentLoader(str(data_dir)), RecordingStore(), workers = 1).run(changed) if changed else {}
+    manifest.update(current, changed, failed = stats.get("load", {}).get("failed"))
+    return changed, deleted, stats
+
+def test_diff_deletion_and_retry_after_failure(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("Alpha text.", encoding = "utf-8")
+    (data_dir / "b.txt").write_text("Beta text.", encoding = "utf-8")
+    (data_dir / "broken.json").write_text("{not json", encoding = "utf-8")
+    (data_dir / "notes.xyz").write_text("Unsupported type.", encoding = "utf-8")
+    manifest_path = str(tmp_path / "manifest.json")
+
+    changed, deleted, stats = sync(data_dir, manifest_path)
+    assert sorted(changed) == ["a.txt", "b.txt", "broken.json", "notes.xyz"]
+    assert deleted == []
+    assert stats["load"]["failed"] == ["broken.json"]
+    with open(manifest_path, encoding = "utf-8") as f:
+        assert sorted(json.load(f)) == ["a.txt", "b.txt", "notes.xyz"]
+
+    # The file that failed is retried even though it did not change
+    changed, deleted, stats = sync(data_dir, manifest_path)
+    assert (changed, deleted) == (["broken.json"], [])
+
+    (data_dir / "broken.json").write_text('{"fixed": true}', encoding = "utf-8")
+    changed, deleted, stats = sync(data_dir, manifest_path)
+    assert (changed, deleted, stats["load"]["failed"]) == (["broken.json"], [], [])
+    assert sync(data_dir, manifest_path)[:2] == ([], [])
+
+    (data_dir / "a.txt").write_text("Alpha text, edited.", encoding = "utf-8")
+    (data_dir / "b.txt").unlink()
+    changed, deleted, _ = sync(data_dir, manifest_path)
+    assert (changed, deleted) == (["a.txt"], ["b.txt"])
+    assert sorted(IndexManifest(manifest_path).files) == ["a.txt", "broken.json", "notes.xyz"]
+
+def test_links_are_kept_for_unchanged_files(tmp_path):
+    (tmp_path / "a.txt").write_text("Alpha.", encoding = "utf-8")
+    (tmp_path / "b.txt").write_text("Beta.", encoding = "utf-8")
+    manifest = IndexManifest()
+    current = manifest.scan(str(tmp_path))
+    manifest.update(current, ["a.txt", "b.txt"], links = {"a.txt": ["b.txt"], "b.txt": ["a.txt"]})
+
+    manifest.update(manifest.scan(str(tmp_path)), ["a.txt"], links = {})
+    assert "linked" not in manifest.files["a.txt"]
+    assert manifest.files["b.txt"]["linked"] == ["a.txt"]
+    assert manifest.linked(["b.txt"]) == ["a.txt"]
@@ -0,0 +1,41 @@
+from lexical_index import LexicalIndex
+
+def chunk(content, filename, **metadata):
+    return {"content": content, "metadata": {"filename": filename, **metadata}}
+
+def ids(results):
+    return [chunk_id for chunk_id, _ in results]
+
+def test_bm25_ranks_exact_terms_first():
+    index = LexicalIndex()
+    index.add(["a", "b", "c"], [
+        chunk("The RTX 5090 draws 575 W under load.", "nvidia.txt"),
+        chunk("The RX 9070 XT draws 304 W.", "amd.txt"),
+        chunk("Refunds are issued within 7 days.", "faq.txt")
+    ])
+    assert ids(index.search("rtx 5090 draws")) == ["a", "b"]
+    assert ids(index.search("draws", where = {"filename": "amd.txt"})) == ["b"]
+
+def test_moved_chunk_survives_removal_of_its_old_source():
+    index = LexicalIndex()
+    index.add(["shared", "only-a"], [chunk("warranty claims policy", "a.txt"), chunk("shipping windows", "a.txt")])
+    # The same chunk id is indexed again under another file, e.g. after a.txt lost the text to b.txt
+    index.add(["shared"], [chunk("warranty claims policy", "b.txt")])
+
+    index.remove_sources(["a.txt"])
+    assert ids(index.search("warranty")) == ["shared"]
+    assert ids(index.search("shipping")) == []
+
+    index.remove_sources(["b.txt"])
+    assert ids(index.search("warranty")) == []
+    assert len(index) == 0 and not index.source_ids and not index.chunk_sources
+
+def test_remove_and_metadata_updates_keep_sources_in_sync():
+    index = LexicalIndex()
+    index.add(["x", "y"], [chunk("alpha beta", "a.txt"), chunk("alpha gamma", "a.txt")])
+    index.remove(["x"])
+    assert index.source_ids["a.txt"] == {"y"}
+
+    index.update_metadata(["y"], [{"filename": "c.txt"}])
+    index.remove_sources(["a.txt"])
+    assert ids(index.search("alpha", where = {"filename": "c.txt"})) == ["y"]
@@ -0,0 +1,82 @@
+import shutil
+from time import perf_counter
+import pytest
+from stub_ollama import StubOllamaServer
+from llm import LLMService
+
+MODEL = "gemma3:1b"
+GENERIC_ERROR = "Error while accessing LLM service. Please ensure the Ollama server is running by running 'ollama ps'.\n(Maybe the model is listening on a different port?)"
+
+@pytest.fixture(autouse = True)
+def ollama_installed(monkeypatch):
+    # LLMService exits for localhost URLs when the ollama binary is missing; the stubs stand in for it
+    monkeypatch.setattr(shutil, "which", lambda name: f"/usr/bin/{name}")
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(count, **options):
+        for _ in range(count):
+            started.append(StubOllamaServer(**options).start())
+        return started[-count:]
+
+    yield start
+    for server in started:
+        if not server.stopped:
+            server.stop()
+
+def answer(service, query = "hello"):
+    result, _ = service.generate_response(query)
+    return result if isinstance(result, str) else result.content
+
+def test_requests_go_round_robin(servers):
+    first, second = servers(2)
+    service = LLMService(MODEL, [first.url, second.url])
+
+    for _ in range(6):
+        assert answer(service).startswith("Stub answer")
+
+    assert first.stats["requests"] == 3
+    assert second.stats["requests"] == 3
+
+def test_fails_over_when_a_backend_goes_down(servers):
+    first, second = servers(2)
+    service = LLMService(MODEL, [first.url, second.url], eject_seconds = 60.0)
+    answer(service)
+    answer(service)
+    first.stop()
+
+    for _ in range(4):
+        assert answer(service).startswith(f"Stub answer from {second.url}")
+
+    down, up = service.pool.backends
+    assert down.ejected_until is not None
+    # Refused on a new connection, or dropped on a kept-alive one; the health check may also have found it first
+    assert "ConnectError" in down.last_error or "RemoteProtocolError" in down.last_error
+    assert up.ejected_until is None
+    # Once ejected, the stopped backend is not tried again
+    assert down.failures <= 1
+    assert second.stats["requests"] == 5
+
+def test_deadline_bounds_retries(servers):
+    slow = servers(2, latency = 3.0)
+    service = LLMService(MODEL, [server.url for server in slow], deadline = 0.5)
+
+    start = perf_counter()
+    assert answer(service) == GENERIC_ERROR
+    assert perf_counter() - start < 2.0
+    # The first attempt used up the deadline, so the other backend was not tried
+    assert sum(server.stats["requests"] for server in slow) == 1
+
+def test_invalid_model_with_single_backend(servers):
+    server, = servers(1)
+    service = LLMService("missing-model", server.url, max_failures = 1)
+
+    assert answer(service) == "Invalid model."
+    backend, = service.pool.backends
+    assert backend.ejected_until is not None
+    # The only backend stays in use while ejected and keeps reporting the specific error
+    assert answer(service) == "Invalid model."
+    service.deadline = 0.0
+    assert answer(service) == "Invalid model."
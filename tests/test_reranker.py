@@ -0,0 +1,48 @@
+import numpy as np
+from reranker import Reranker
+
+QUERY = "rtx 5090 power draw"
+
+def make_candidates(count, seed = 0):
+    rng = np.random.default_rng(seed)
+    words = ["rtx", "5090", "power", "draw", "gpu", "memory", "cooling", "price"]
+    return [
+        {
+            "id": f"chunk-{i}",
+            "content": " ".join(rng.choice(words, size = 4)),
+            "embedding": rng.normal(size = 8).tolist()
+        }
+        for i in range(count)
+    ]
+
+def ranked_ids(results):
+    return [result["id"] for result in results]
+
+def test_partial_cache_hit_ranks_like_a_cold_run():
+    candidates = make_candidates(30)
+    query_embedding = np.ones(8)
+    warm = Reranker(latency_budget_ms = 10_000)
+    # Caches the features of the first 20 candidates, scored within a different candidate list
+    warm.rerank(QUERY, query_embedding, candidates[:20], top_k = 5)
+
+    overlapping = candidates[10:]
+    cold = Reranker(latency_budget_ms = 10_000).rerank(QUERY, query_embedding, overlapping, top_k = 10)
+    cached = warm.rerank(QUERY, query_embedding, overlapping, top_k = 10)
+
+    assert warm.stats["cache_hits"] == 10
+    assert ranked_ids(cached) == ranked_ids(cold)
+    assert [result["rerank_score"] for result in cached] == [result["rerank_score"] for result in cold]
+
+def test_term_coverage_breaks_dense_ties():
+    candidates = [
+        {"id": "a", "content": "gpu cooling", "embedding": [1.0, 0.0]},
+        {"id": "b", "content": "rtx 5090 power draw", "embedding": [1.0, 0.0]}
+    ]
+    results = Reranker(latency_budget_ms = 10_000).rerank(QUERY, [1.0, 0.0], candidates, top_k = 1)
+    assert ranked_ids(results) == ["b"]
+
+def test_exceeded_budget_keeps_first_stage_order():
+    candidates = make_candidates(5)
+    reranker = Reranker(latency_budget_ms = 0)
+    assert ranked_ids(reranker.rerank(QUERY, np.ones(8), candidates, top_k = 3)) == ["chunk-0", "chunk-1", "chunk-2"]
+    assert reranker.stats["fallbacks"] == 1
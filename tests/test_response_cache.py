@@ -0,0 +1,51 @@
+import numpy as np
+from response_cache import ResponseCache
+
+# Every query about GPU power draw gets nearly the same embedding, as a real embedding model would give them
+EMBEDDINGS = {
+    "What is the power draw of the RTX 5090?": [1.0, 0.0, 0.0],
+    "How much power does the RTX 5090 draw?": [0.99, 0.1, 0.0],
+    "What is the power draw of the RTX 5080?": [0.995, 0.05, 0.0],
+    "What is the power draw of the RTX 5090 Ti?": [0.99, 0.0, 0.1],
+    "Tell me a joke": [0.0, 0.0, 1.0]
+}
+
+def make_cache(**options):
+    return ResponseCache(embed = lambda query: np.array(EMBEDDINGS[query]), similarity_threshold = 0.95, **options)
+
+def test_exact_repeat_hits_without_embedding():
+    cache = ResponseCache()
+    cache.put("What is the power draw of the RTX 5090?", {"result": "575 W"}, ["gpus.pdf"])
+
+    response, tier, _ = cache.get("what is the power draw of the rtx 5090")
+    assert (response, tier) == ({"result": "575 W"}, "exact")
+    assert cache.get("How much power does the RTX 5090 draw?") == (None, None, 0.0)
+
+def test_paraphrase_hits_semantic_tier():
+    cache = make_cache()
+    cache.put("What is the power draw of the RTX 5090?", {"result": "575 W"}, ["gpus.pdf"])
+
+    response, tier, similarity = cache.get("How much power does the RTX 5090 draw?")
+    assert (response, tier) == ({"result": "575 W"}, "semantic")
+    assert similarity >= 0.95
+
+def test_different_number_or_name_misses():
+    cache = make_cache()
+    cache.put("What is the power draw of the RTX 5090?", {"result": "575 W"}, ["gpus.pdf"])
+
+    assert cache.get("What is the power draw of the RTX 5080?") == (None, None, 0.0)
+    assert cache.get("What is the power draw of the RTX 5090 Ti?") == (None, None, 0.0)
+    assert cache.stats["semantic_hits"] == 0
+
+def test_key_tokens_ignore_sentence_starts():
+    assert ResponseCache.key_tokens("What is the power draw of the RTX 5090?") == {"rtx", "5090"}
+    assert ResponseCache.key_tokens("How much power does the RTX 5090 draw? Tell me, I need it.") == {"rtx", "5090"}
+    assert ResponseCache.key_tokens("Tell me a joke") == set()
+
+def test_invalidation_drops_entries_of_changed_files():
+    cache = make_cache()
+    cache.put("What is the power draw of the RTX 5090?", {"result": "575 W"}, ["gpus.pdf"])
+    cache.put("Tell me a joke", {"result": "..."}, [])
+
+    assert cache.invalidate_sources(["gpus.pdf"]) == 2
+    assert cache.get("What is the power draw of the RTX 5090?") == (None, None, 0.0)
@@ -0,0 +1,36 @@
+import pytest
+from router import Calculator, QueryRouter
+
+@pytest.mark.parametrize("query, answer", [
+    ("what is 2 + 3 * 4?", "2 + 3 * 4 = 14"),
+    ("2^10", "2^10 = 1024"),
+    ("calculate 2020-2010", "2020-2010 = 10"),
+    ("10-3-2", "10-3-2 = 5"),
+    ("(1 + 2) x 3", "(1 + 2) * 3 = 9")
+])
+def test_arithmetic_goes_to_calculator(query, answer):
+    assert QueryRouter().route(query) == ("calculator", answer)
+
+@pytest.mark.parametrize("query", [
+    "3.5.6 + 1",
+    "1..2 + 3",
+    "2010-2020",
+    "2010 - 2020",
+    "1-800-555-0199",
+    "2024-01-15",
+    "(555) 123-4567"
+])
+def test_non_arithmetic_falls_back_to_rag(query):
+    assert Calculator.parse(query) is None
+    assert QueryRouter().route(query) == ("rag", None)
+
+@pytest.mark.parametrize("expression, error", [
+    ("9**9**9**9", "Error: Result is too large."),
+    ("0.5**-2000", "Error: Result is too large."),
+    ("1/0", "Error: division by zero.")
+])
+def test_calculator_errors(expression, error):
+    assert Calculator.calculate(expression) == error
+
+def test_small_talk_skips_retrieval():
+    assert QueryRouter().route("Thanks a lot!") == ("smalltalk", None)
@@ -0,0 +1,45 @@
+import os
+import pytest
+from structured_store import StructuredStore
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+@pytest.fixture(scope = "module")
+def store():
+    store = StructuredStore()
+    assert store.load_file(DATA_DIR, "movies.csv") > 0
+    assert store.load_file(DATA_DIR, "classic_books.json") > 0
+    return store
+
+@pytest.mark.parametrize("query", [
+    "movies released after 2010 with rating > 8",
+    "how many books were published before 1900",
+    "average rating of crime movies",
+    "highest rated movie",
+    "top 3 movies by rating",
+    "list all drama movies",
+    "crime movies from the 1990s released between 1990 and 1999"
+])
+def test_filters_aggregations_and_superlatives_are_structured(store, query):
+    assert store.query(query) is not None
+
+@pytest.mark.parametrize("query", [
+    "Recommend me a movie like Inception",
+    "Tell me about the movie Inception",
+    "What do people say about the book 1984?",
+    "Is The Godfather a good crime movie?",
+    "Which books did George Orwell write?"
+])
+def test_value_mentions_alone_go_to_retrieval(store, query):
+    assert store.plan(query) is None
+
+def test_count_with_text_filter(store):
+    result = store.query("how many crime movies are there")
+    assert result["params"] == ["Crime"]
+    assert result["rows"][0]["count"] >= 2
+
+def test_duplicate_and_quoted_column_names(tmp_path):
+    (tmp_path / "people.csv").write_text('Name,name,"we""ird"\nAda,Lovelace,1\n', encoding = "utf-8")
+    store = StructuredStore()
+    assert store.load_file(str(tmp_path), "people.csv") == 1
+    assert list(store.tables["people"]["columns"]) == ["name", "name_2", 'we"ird']
@@ -0,0 +1,131 @@
+import os
+import numpy as np
+import pytest
+from vector_backends import MmapBackend, ShardedBackend
+
+DIM = 16
+
+def make_chunks(count, seed = 0, prefix = "chunk", clusters = None):
+    rng = np.random.default_rng(seed)
+    if clusters:
+        centers = rng.normal(size = (clusters, DIM)) * 4
+        embeddings = centers[rng.integers(clusters, size = count)] + rng.normal(size = (count, DIM))
+    else:
+        embeddings = rng.normal(size = (count, DIM))
+    ids = [f"{prefix}-{i}" for i in range(count)]
+    documents = [f"Text of {chunk_id}" for chunk_id in ids]
+    metadatas = [{"filename": f"file_{i % 5}.pdf" if i % 2 else f"file_{i % 5}.txt", "file_type": ".pdf" if i % 2 else ".txt", "page": i % 7} for i in range(count)]
+    return ids, embeddings.astype(np.float32), documents, metadatas
+
+def brute_force(embeddings, ids, query, k, keep = None):
+    distances = ((embeddings - query) ** 2).sum(axis = 1)
+    order = [i for i in np.argsort(distances) if keep is None or keep(i)]
+    return [ids[i] for i in order[:k]]
+
+def test_upsert_replaces_and_persists(tmp_path):
+    ids, embeddings, documents, metadatas = make_chunks(50)
+    backend = MmapBackend(str(tmp_path))
+    backend.upsert(ids, embeddings, documents, metadatas)
+    backend.upsert(ids[:5], embeddings[:5] + 1, ["new"] * 5, metadatas[:5])
+    backend.flush()
+
+    reopened = MmapBackend(str(tmp_path))
+    assert reopened.count() == 50
+    fetched = reopened.get(ids[:6])
+    assert fetched["ids"] == ids[:6]
+    assert fetched["documents"] == ["new"] * 5 + [documents[5]]
+
+def test_compaction_writes_a_new_generation(tmp_path):
+    ids, embeddings, documents, metadatas = make_chunks(1500)
+    metadatas = [{**metadata, "filename": "keep.txt" if i < 100 else "drop.txt"} for i, metadata in enumerate(metadatas)]
+    writer = MmapBackend(str(tmp_path))
+    writer.upsert(ids, embeddings, documents, metadatas)
+    writer.flush()
+    reader = MmapBackend(str(tmp_path))
+    assert reader.count() == 1500
+
+    writer.delete_sources(["drop.txt"])
+    writer.flush()
+    assert writer.meta["generation"] == 1
+    assert os.path.exists(tmp_path / "embeddings.1.bin")
+    assert not os.path.exists(tmp_path / "embeddings.bin")
+
+    # A reader opened on the previous generation moves to the new one
+    assert reader.count() == 100
+    query = embeddings[7]
+    assert reader.query([query], 5)["ids"][0] == brute_force(embeddings[:100], ids[:100], query, 5)
+    assert reader.get(ids[98:102])["ids"] == ids[98:100]
+
+def test_ann_recall_against_exact_search(tmp_path):
+    ids, embeddings, documents, metadatas = make_chunks(6000, clusters = 40)
+    backend = MmapBackend(str(tmp_path), ann = True, nprobe = 8)
+    backend.upsert(ids, embeddings, documents, metadatas)
+    backend.flush()
+    assert backend.ivf is not None
+
+    queries = make_chunks(50, seed = 1, clusters = 40)[1]
+    k = 10
+    exact_rows, exact_distances = backend._exact_search(queries, k)
+    approximate = backend.query(queries, k)["ids"]
+    hits = 0
+    for rows, distances, found in zip(exact_rows, exact_distances, approximate):
+        exact = {ids[row] for row in rows[np.isfinite(distances)]}
+        hits += len(exact & set(found))
+    assert hits / (len(queries) * k) >= 0.9
+
+    # Searching every cluster is exact
+    assert backend.query(queries, k, ann_effort = len(backend.ivf["centroids"]))["ids"] == [brute_force(embeddings, ids, query, k) for query in queries]
+
+    # Rows added after the build are searched until the next one
+    backend.upsert(["late"], queries[:1] + 0.001, ["late"], [{"filename": "late.txt"}])
+    assert backend.query(queries[:1], 1)["ids"] == [["late"]]
+
+@pytest.mark.parametrize("where, keep", [
+    ({"file_type": ".pdf"}, lambda metadata: metadata["file_type"] == ".pdf"),
+    ({"$and": [{"file_type": ".pdf"}, {"page": {"$lte": 3}}]}, lambda metadata: metadata["file_type"] == ".pdf" and metadata["page"] <= 3),
+    ({"filename": {"$in": ["file_1.pdf", "file_2.txt"]}}, lambda metadata: metadata["filename"] in ("file_1.pdf", "file_2.txt")),
+    ({"$or": [{"page": 0}, {"page": {"$gt": 5}}]}, lambda metadata: metadata["page"] == 0 or metadata["page"] > 5)
+])
+def test_where_filters(tmp_path, where, keep):
+    ids, embeddings, documents, metadatas = make_chunks(300)
+    backend = MmapBackend(str(tmp_path))
+    backend.upsert(ids, embeddings, documents, metadatas)
+
+    queries = make_chunks(3, seed = 2)[1]
+    results = backend.query(queries, 8, where = where)
+    for query, found, found_metadatas in zip(queries, results["ids"], results["metadatas"]):
+        assert found == brute_force(embeddings, ids, query, 8, lambda i: keep(metadatas[i]))
+        assert all(keep(metadata) for metadata in found_metadatas)
+
+    assert backend.query(queries, 8, where = {"filename": "missing.txt"})["ids"] == [[], [], []]
+
+@pytest.fixture
+def sharded(tmp_path):
+    backend = ShardedBackend(3, str(tmp_path / "sharded"), threads_per_shard = 1)
+    yield backend
+    backend.close()
+
+def test_shards_merge_like_a_single_index(tmp_path, sharded):
+    ids, embeddings, documents, metadatas = make_chunks(400)
+    single = MmapBackend(str(tmp_path / "single"))
+    for backend in (single, sharded):
+        backend.upsert(ids, embeddings, documents, metadatas)
+        backend.flush()
+    assert sharded.count() == 400
+    assert len({sharded.shard_of(chunk_id) for chunk_id in ids}) == 3
+
+    queries = make_chunks(5, seed = 3)[1]
+    for where in (None, {"file_type": ".txt"}):
+        expected, merged = single.query(queries, 10, where = where), sharded.query(queries, 10, where = where)
+        assert merged["ids"] == expected["ids"]
+        assert np.allclose(merged["distances"], expected["distances"])
+        assert all(distances == sorted(distances) for distances in merged["distances"])
+
+    requested = [ids[17], "missing", ids[3], ids[250]]
+    assert sharded.get(requested)["ids"] == [ids[17], ids[3], ids[250]]
+    assert len(sharded.get(limit = 150, offset = 200)["ids"]) == 150
+
+    sharded.delete_sources(["file_0.txt"])
+    sharded.update_metadata([ids[1]], [{**metadatas[1], "page": 99}])
+    assert sharded.count() == 400 - sum(metadata["filename"] == "file_0.txt" for metadata in metadatas)
+    assert sharded.get([ids[1]])["metadatas"] == [{**metadatas[1], "page": 99}]